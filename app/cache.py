@@ -0,0 +1,435 @@
+import pickle
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from app import config
+from app.database import Database
+from app.metrics import CACHE_BYTES, CACHE_EVICTIONS, CACHE_LOOKUPS
+
+# seconds until the first of the cache entries looked up for the current request goes stale, None before any lookup.
+freshness: ContextVar[Optional[float]] = ContextVar('freshness', default=None)
+
+
+def sizeof(value: Any) -> int:
+    """
+    Approximate number of bytes of a value and everything it refers to: the items of containers and the attributes of
+    objects. What is referred to more than once is counted once.
+    """
+    seen = set()
+    pending = [value]
+    size = 0
+
+    while pending:
+        item = pending.pop()
+
+        if id(item) in seen:
+            continue
+
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+
+        if isinstance(item, dict):
+            pending += item.keys()
+            pending += item.values()
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending += item
+        else:
+            pending += [getattr(item, name) for name in getattr(type(item), '__slots__', ()) if hasattr(item, name)]
+            pending += [vars(item)] if hasattr(item, '__dict__') else []
+
+    return size
+
+
+class Budget:
+    """
+    Memory, in bytes, shared by the caches of a process. Entries are weighted by their size. When the caches together
+    need more than the limit, the least recently used entries of any cache are released, or with the lfu policy the
+    least frequently used. The entry added last is never released, so a single entry larger than the limit is kept.
+    """
+
+    def __init__(self, limit: int, policy: str = 'lru'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError('Unknown eviction policy {0}'.format(policy))
+
+        self.limit = limit
+        self.policy = policy
+        self.total = 0
+        # size and number of uses by backend and key, in least recently used order.
+        self.entries: 'OrderedDict[Tuple[Backend, Hashable], List[int]]' = OrderedDict()
+
+    def add(self, backend: 'Backend', key: Hashable, size: int):
+        self.discard(backend, key)
+        self.entries[backend, key] = [size, 1]
+        self.total += size
+        CACHE_BYTES.inc(size, cache=backend.name)
+
+        while self.limit and self.total > self.limit and len(self.entries) > 1:
+            victim = self.select()
+            self.discard(*victim)
+            victim[0].release(victim[1])
+            CACHE_EVICTIONS.inc(cache=victim[0].name, reason='budget')
+
+    def use(self, backend: 'Backend', key: Hashable):
+        self.entries[backend, key][1] += 1
+        self.entries.move_to_end((backend, key))
+
+    def discard(self, backend: 'Backend', key: Hashable):
+        entry = self.entries.pop((backend, key), None)
+
+        if entry is not None:
+            self.total -= entry[0]
+            CACHE_BYTES.inc(-entry[0], cache=backend.name)
+
+    def select(self) -> Tuple['Backend', Hashable]:
+        # every entry but the one added last, on equal uses the least recently used.
+        candidates = list(self.entries)[:-1]
+
+        if self.policy == 'lfu':
+            return min(candidates, key=lambda entry: self.entries[entry][1])
+
+        return candidates[0]
+
+
+class Backend(ABC):
+    """
+    Storage for cache entries, an entry is a value and the time it was created. Keys are kept in insertion order,
+    backends evict the least recently used entries when they hold more than maxsize entries. With a budget, the memory
+    of the entries counts towards the budget.
+    """
+
+    name = ''
+    budget: Optional[Budget] = None
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        Returns the value and creation time of the entry, or None when missing.
+        """
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, created: float):
+        """
+        Adds or replaces the entry.
+        """
+
+    @abstractmethod
+    def delete(self, key: Hashable) -> bool:
+        """
+        Removes the entry, returns False when missing.
+        """
+
+    @abstractmethod
+    def created(self, key: Hashable) -> Optional[float]:
+        """
+        Returns the creation time of the entry, or None when missing.
+        """
+
+    @abstractmethod
+    def oldest(self) -> Optional[float]:
+        """
+        Returns the creation time of the oldest entry, or None when empty.
+        """
+
+    @abstractmethod
+    def keys(self) -> List[Hashable]:
+        """
+        Returns all keys in insertion order.
+        """
+
+    @abstractmethod
+    def expire(self, before: float):
+        """
+        Removes all entries created at or before the given time.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Removes all entries.
+        """
+
+    @abstractmethod
+    def release(self, key: Hashable):
+        """
+        Frees the memory of the entry, because the budget is exceeded.
+        """
+
+
+class MemoryBackend(Backend):
+    """
+    Keeps the entries in the memory of the current process.
+    """
+
+    def __init__(self, maxsize: int, budget: Optional[Budget] = None, name: str = ''):
+        self.maxsize = maxsize
+        self.budget = budget
+        self.name = name
+        # entries in insertion order, recency in least recently used order.
+        self.entries: Dict[Hashable, Tuple[Any, float]] = {}
+        self.recency: 'OrderedDict[Hashable, None]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        if key not in self.entries:
+            return None
+
+        self.recency.move_to_end(key)
+        if self.budget is not None:
+            self.budget.use(self, key)
+
+        return self.entries[key]
+
+    def set(self, key: Hashable, value: Any, created: float):
+        self.entries[key] = (value, created)
+        self.recency[key] = None
+        self.recency.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.delete(next(iter(self.recency)))
+            CACHE_EVICTIONS.inc(cache=self.name, reason='maxsize')
+
+        if self.budget is not None:
+            self.budget.add(self, key, sizeof(value))
+
+    def delete(self, key: Hashable) -> bool:
+        self.recency.pop(key, None)
+        if self.budget is not None:
+            self.budget.discard(self, key)
+
+        return self.entries.pop(key, None) is not None
+
+    def created(self, key: Hashable) -> Optional[float]:
+        entry = self.entries.get(key)
+        return entry[1] if entry else None
+
+    def oldest(self) -> Optional[float]:
+        return min((created for _, created in self.entries.values()), default=None)
+
+    def keys(self) -> List[Hashable]:
+        return list(self.entries)
+
+    def expire(self, before: float):
+        for key in [key for key, (_, created) in self.entries.items() if created <= before]:
+            self.delete(key)
+
+    def clear(self):
+        for key in list(self.entries):
+            self.delete(key)
+
+    def release(self, key: Hashable):
+        self.delete(key)
+
+
+# seconds within which the access of a SQLite cache entry is recorded once, entries accessed within the same period are
+# evicted in insertion order.
+ACCESS_RESOLUTION = 60
+
+
+class SqliteBackend(Backend):
+    """
+    Keeps the entries in a SQLite database, so all worker processes on a host share them. Keys must be strings,
+    values are pickled. Each cache uses its own namespace within the database. With a budget, only the unpickled values
+    kept in memory count towards it.
+    """
+
+    def __init__(self, path: str, namespace: str, maxsize: int, budget: Optional[Budget] = None):
+        self.path = path
+        self.namespace = namespace
+        self.name = namespace
+        self.maxsize = maxsize
+        self.budget = budget
+        # unpickled values by key, reused as long as the entry in the database was not replaced.
+        self.values: Dict[str, Tuple[Any, float]] = {}
+        # the values unpickled through the connection of the parent process are not reused after a fork.
+        self.database = Database(path, 'CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, '
+                                       'value BLOB NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, '
+                                       'PRIMARY KEY (namespace, key))', self.forget)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self.database.connection
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        row = self.connection.execute('SELECT created, accessed FROM cache WHERE namespace = ? AND key = ?',
+                                      (self.namespace, key)).fetchone()
+
+        if row is None:
+            self.release(key)
+            return None
+
+        created, accessed = row
+        now = time.time()
+
+        # a hit only takes the write lock of the database when the recorded access is outdated.
+        if now - accessed >= ACCESS_RESOLUTION:
+            self.connection.execute('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?',
+                                    (now, self.namespace, key))
+
+        if key not in self.values or self.values[key][1] != created:
+            row = self.connection.execute('SELECT value FROM cache WHERE namespace = ? AND key = ?',
+                                          (self.namespace, key)).fetchone()
+            self.keep(key, pickle.loads(row[0]), created)
+        elif self.budget is not None:
+            self.budget.use(self, key)
+
+        return self.values[key]
+
+    def set(self, key: str, value: Any, created: float):
+        self.connection.execute('INSERT INTO cache (namespace, key, value, created, accessed) VALUES (?, ?, ?, ?, ?) '
+                                'ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, '
+                                'created = excluded.created, accessed = excluded.accessed',
+                                (self.namespace, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), created,
+                                 time.time()))
+        self.connection.execute('DELETE FROM cache WHERE namespace = ? AND key NOT IN ('
+                                'SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC, rowid DESC LIMIT ?)',
+                                (self.namespace, self.namespace, self.maxsize))
+        self.keep(key, value, created)
+
+    def keep(self, key: str, value: Any, created: float):
+        self.values[key] = (value, created)
+
+        if self.budget is not None:
+            self.budget.add(self, key, sizeof(value))
+
+    def delete(self, key: str) -> bool:
+        self.release(key)
+        return self.connection.execute('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                                       (self.namespace, key)).rowcount > 0
+
+    def created(self, key: str) -> Optional[float]:
+        row = self.connection.execute('SELECT created FROM cache WHERE namespace = ? AND key = ?',
+                                      (self.namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def oldest(self) -> Optional[float]:
+        return self.connection.execute('SELECT MIN(created) FROM cache WHERE namespace = ?',
+                                       (self.namespace,)).fetchone()[0]
+
+    def keys(self) -> List[str]:
+        return [row[0] for row in self.connection.execute(
+            'SELECT key FROM cache WHERE namespace = ? ORDER BY rowid', (self.namespace,))]
+
+    def expire(self, before: float):
+        self.connection.execute('DELETE FROM cache WHERE namespace = ? AND created <= ?', (self.namespace, before))
+
+    def clear(self):
+        self.forget()
+        self.connection.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+    def release(self, key: str):
+        # the entry stays in the database, it is unpickled again when needed.
+        self.values.pop(key, None)
+
+        if self.budget is not None:
+            self.budget.discard(self, key)
+
+    def forget(self):
+        for key in list(self.values):
+            self.release(key)
+
+
+class Cache(MutableMapping):
+    """
+    LRU cache with a soft and a hard ttl (in seconds). Entries older than the soft ttl are stale, they are still
+    returned but should be refreshed. Entries older than the hard ttl are dropped.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, hard_ttl: float, timer: Callable[[], float] = time.time,
+                 backend: Optional[Backend] = None, name: str = ''):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hard_ttl = max(ttl, hard_ttl)
+        self.timer = timer
+        self.backend = backend or MemoryBackend(maxsize)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        entry = self.entry(key)
+
+        if entry is None:
+            raise KeyError(key)
+
+        return entry[0]
+
+    def entry(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        entry = self.backend.get(key)
+
+        if entry is not None and self.timer() - entry[1] >= self.hard_ttl:
+            self.backend.delete(key)
+            return None
+
+        return entry
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.backend.set(key, value, self.timer())
+
+    def __delitem__(self, key: Hashable):
+        if not self.backend.delete(key):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        self.expire()
+        return iter(self.backend.keys())
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self.backend.keys())
+
+    def clear(self):
+        self.backend.clear()
+
+    def expire(self):
+        self.backend.expire(self.timer() - self.hard_ttl)
+
+    def is_stale(self, key: Hashable, ahead: float = 0) -> bool:
+        """
+        True when the entry is older than the soft ttl, or will be within ahead seconds, or missing.
+        """
+        created = self.backend.created(key)
+        return created is None or self.timer() - created >= self.ttl - ahead
+
+    def lookup(self, key: Hashable) -> Tuple[Any, bool]:
+        """
+        Returns the value, or None when missing, and whether it is stale. Counts the lookup as a hit, stale or miss and
+        keeps the freshness of the current request.
+        """
+        entry = self.entry(key)
+
+        if entry is None:
+            CACHE_LOOKUPS.inc(cache=self.name, result='miss')
+            return None, False
+
+        remaining = max(self.ttl - (self.timer() - entry[1]), 0)
+        CACHE_LOOKUPS.inc(cache=self.name, result='hit' if remaining else 'stale')
+
+        current = freshness.get()
+        freshness.set(remaining if current is None else min(current, remaining))
+        return entry[0], not remaining
+
+    def has_stale(self) -> bool:
+        oldest = self.backend.oldest()
+        return oldest is not None and self.timer() - oldest >= self.ttl
+
+
+# the memory budget shared by all caches of this worker process.
+budget = Budget(config.CACHE_MEMORY_BUDGET, config.CACHE_EVICTION)
+
+
+def create_backend(name: str, maxsize: int) -> Backend:
+    if config.CACHE_BACKEND == 'memory':
+        return MemoryBackend(maxsize, budget, name)
+
+    if config.CACHE_BACKEND == 'sqlite':
+        return SqliteBackend(config.CACHE_PATH, name, maxsize, budget)
+
+    raise ValueError('Unknown cache backend {0}'.format(config.CACHE_BACKEND))
+
+
+def create_cache(name: str) -> Cache:
+    return Cache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL, hard_ttl=config.CACHE_HARD_TTL,
+                 backend=create_backend(name, config.CACHE_MAXSIZE), name=name)
@@ -0,0 +1,367 @@
+import os
+import time
+
+import pytest
+
+from . import cache, config
+from .cache import ACCESS_RESOLUTION, Budget, Cache, MemoryBackend, SqliteBackend, create_backend, create_cache, \
+    freshness, sizeof
+from .funds import Funds
+from .metrics import CACHE_BYTES, CACHE_EVICTIONS
+from .models import Fund
+from .series import QuoteSeries
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return lambda maxsize, namespace='test': MemoryBackend(maxsize)
+    return lambda maxsize, namespace='test': SqliteBackend(str(tmp_path / 'cache.sqlite3'), namespace, maxsize)
+
+
+def test_fresh_entry_is_not_stale(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+
+    assert cache['a'] == 1
+    assert not cache.is_stale('a')
+    assert not cache.has_stale()
+
+
+def test_entry_is_stale_after_ttl(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+    clock.now += 10
+
+    assert 'a' in cache
+    assert cache['a'] == 1
+    assert cache.is_stale('a')
+    assert cache.has_stale()
+
+
+def test_entry_is_dropped_after_hard_ttl(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+    cache['b'] = 2
+    clock.now += 20
+
+    assert 'a' not in cache
+    assert len(cache) == 0
+    assert list(cache) == []
+
+
+def test_missing_entry_is_stale(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+
+    assert 'a' not in cache
+    assert cache.is_stale('a')
+    assert not cache.has_stale()
+
+
+def test_hard_ttl_is_at_least_ttl(clock):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=5, timer=clock)
+
+    assert cache.hard_ttl == 10
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=MemoryBackend(2))
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+
+    assert list(cache.keys()) == ['a', 'c']
+    assert list(cache.values()) == [1, 3]
+
+
+def test_keys_are_in_insertion_order(clock, backend):
+    cache = Cache(maxsize=3, ttl=10, hard_ttl=20, timer=clock, backend=backend(3))
+    cache['a'] = 1
+    cache['b'] = 2
+    cache['c'] = 3
+    assert cache['a'] == 1
+    cache['b'] = 4
+
+    assert list(cache.items()) == [('a', 1), ('b', 4), ('c', 3)]
+
+
+def test_setting_entry_resets_age(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+    clock.now += 15
+    cache['a'] = 2
+
+    assert not cache.is_stale('a')
+    assert cache['a'] == 2
+
+
+def test_delete_and_clear(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+    cache['b'] = 2
+
+    del cache['a']
+    assert list(cache) == ['b']
+
+    with pytest.raises(KeyError):
+        del cache['a']
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_sqlite_backend_is_shared(clock, tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    worker1 = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=SqliteBackend(path, 'meesman.quotes', 2))
+    worker2 = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=SqliteBackend(path, 'meesman.quotes', 2))
+    other = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=SqliteBackend(path, 'meesman.funds', 2))
+
+    worker1['a'] = [1, 2, 3]
+    assert worker2['a'] == [1, 2, 3]
+    assert 'a' not in other
+
+    clock.now += 1
+    worker2['a'] = [4]
+    assert worker1['a'] == [4]
+
+    del worker2['a']
+    assert 'a' not in worker1
+
+
+def test_sqlite_backend_records_access_once_per_resolution(tmp_path, monkeypatch):
+    backend = SqliteBackend(str(tmp_path / 'cache.sqlite3'), 'test', 2)
+    monkeypatch.setattr(time, 'time', lambda: 1000.0)
+    backend.set('a', 1, 1000.0)
+    backend.set('b', 2, 1000.0)
+
+    def accessed(key):
+        return backend.connection.execute('SELECT accessed FROM cache WHERE key = ?', (key,)).fetchone()[0]
+
+    # a hit within the resolution does not write to the database.
+    monkeypatch.setattr(time, 'time', lambda: 1000.0 + ACCESS_RESOLUTION - 1)
+    backend.get('a')
+    assert accessed('a') == 1000.0
+
+    monkeypatch.setattr(time, 'time', lambda: 1000.0 + ACCESS_RESOLUTION)
+    backend.get('a')
+    assert accessed('a') == 1000.0 + ACCESS_RESOLUTION
+
+    backend.set('c', 3, 1000.0)
+    assert backend.keys() == ['a', 'c']
+
+
+def test_sqlite_backend_reuses_unpickled_values(tmp_path):
+    backend = SqliteBackend(str(tmp_path / 'cache.sqlite3'), 'test', 2)
+    backend.set('a', [1, 2, 3], 1000.0)
+    backend.values.clear()
+
+    first = backend.get('a')
+    assert first == ([1, 2, 3], 1000.0)
+    assert backend.get('a')[0] is first[0]
+
+
+def test_sqlite_backend_releases_unpickled_values_for_budget(tmp_path):
+    budget = Budget(2500)
+    backend = SqliteBackend(str(tmp_path / 'cache.sqlite3'), 'test', 4, budget)
+    backend.set('a', b'a' * 1000, 1000.0)
+    backend.set('b', b'b' * 1000, 1000.0)
+    backend.set('c', b'c' * 1000, 1000.0)
+
+    # the database keeps every entry, only the unpickled value of a is released.
+    assert list(backend.values) == ['b', 'c']
+    assert backend.get('a') == (b'a' * 1000, 1000.0)
+    assert list(backend.values) == ['c', 'a']
+
+    backend.get('c')
+    backend.delete('c')
+    backend.clear()
+    assert budget.total == 0
+
+
+def test_sqlite_backend_reconnects_after_fork(tmp_path, monkeypatch):
+    backend = SqliteBackend(str(tmp_path / 'cache.sqlite3'), 'test', 2)
+    backend.set('a', 1, 1000.0)
+    connection = backend.connection
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+
+    assert backend.connection is not connection
+    assert backend.get('a') == (1, 1000.0)
+
+
+def test_lookup_returns_value_and_staleness(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+
+    assert cache.lookup('a') == (1, False)
+    assert cache.lookup('b') == (None, False)
+
+    clock.now += 10
+    assert cache.lookup('a') == (1, True)
+
+
+def test_lookup_keeps_least_freshness_of_request(clock, backend):
+    cache = Cache(maxsize=2, ttl=10, hard_ttl=20, timer=clock, backend=backend(2))
+    cache['a'] = 1
+    clock.now += 4
+    cache['b'] = 2
+
+    assert freshness.get() is None
+
+    cache.lookup('b')
+    assert freshness.get() == 10
+
+    cache.lookup('a')
+    cache.lookup('b')
+    cache.lookup('c')
+    assert freshness.get() == 6
+
+    clock.now += 8
+    cache.lookup('a')
+    assert freshness.get() == 0
+
+
+def test_sizeof_counts_contents_once():
+    long = QuoteSeries.from_pairs([(i * 86400, 10.0) for i in range(1000)])
+    short = QuoteSeries.from_pairs([(0, 10.0)])
+    body = b'x' * 10000
+
+    assert sizeof(long) - sizeof(short) >= 999 * 16
+    assert sizeof({'identity': body}) > len(body)
+    assert sizeof([body, body]) < 2 * len(body)
+
+
+def test_sizeof_of_funds_grows_with_funds():
+    funds = [Fund(id=str(i), name='fund-{0}'.format(i)) for i in range(10)]
+
+    assert sizeof(Funds(funds)) > 3 * sizeof(Funds(funds[:1]))
+
+
+def test_budget_evicts_least_recently_used_entry_of_any_cache():
+    budget = Budget(2500)
+    quotes = MemoryBackend(10, budget, 'quotes')
+    funds = MemoryBackend(10, budget, 'funds')
+    evictions = CACHE_EVICTIONS.get(cache='quotes', reason='budget')
+
+    quotes.set('a', b'a' * 1000, 1000.0)
+    funds.set('b', b'b' * 1000, 1000.0)
+    quotes.get('a')
+    quotes.set('c', b'c' * 1000, 1000.0)
+
+    assert quotes.keys() == ['a', 'c']
+    assert funds.keys() == []
+    assert CACHE_EVICTIONS.get(cache='funds', reason='budget') > 0
+    assert CACHE_EVICTIONS.get(cache='quotes', reason='budget') == evictions
+    assert budget.total == sizeof(b'a' * 1000) * 2
+
+
+def test_budget_evicts_least_frequently_used_entry_with_lfu():
+    budget = Budget(2500, 'lfu')
+    backend = MemoryBackend(10, budget)
+    backend.set('a', b'a' * 1000, 1000.0)
+    backend.set('b', b'b' * 1000, 1000.0)
+    backend.get('a')
+    backend.get('a')
+    backend.get('b')
+
+    backend.set('c', b'c' * 1000, 1000.0)
+
+    assert backend.keys() == ['a', 'c']
+
+
+def test_budget_keeps_entry_larger_than_limit():
+    budget = Budget(100)
+    backend = MemoryBackend(10, budget)
+    backend.set('a', b'a' * 1000, 1000.0)
+    backend.set('b', b'b' * 1000, 1000.0)
+
+    assert backend.keys() == ['b']
+
+
+def test_budget_without_limit_keeps_everything():
+    backend = MemoryBackend(10, Budget(0))
+
+    for key in 'abc':
+        backend.set(key, b'x' * 1000, 1000.0)
+
+    assert backend.keys() == ['a', 'b', 'c']
+
+
+def test_budget_requires_known_policy():
+    with pytest.raises(ValueError):
+        Budget(100, 'fifo')
+
+
+def test_budget_counts_replaced_expired_and_cleared_entries(clock):
+    budget = Budget(0)
+    backend = MemoryBackend(10, budget, 'test.budget')
+    bytes_before = CACHE_BYTES.get(cache='test.budget')
+
+    backend.set('a', b'a' * 1000, 1000.0)
+    backend.set('a', b'a' * 10, 1000.0)
+    assert budget.total == sizeof(b'a' * 10)
+
+    backend.set('b', b'b', 2000.0)
+    backend.expire(1000.0)
+    assert budget.total == sizeof(b'b')
+    assert CACHE_BYTES.get(cache='test.budget') == bytes_before + sizeof(b'b')
+
+    backend.clear()
+    assert budget.total == 0
+
+
+def test_memory_backend_counts_maxsize_evictions():
+    backend = MemoryBackend(1, name='test.maxsize')
+    evictions = CACHE_EVICTIONS.get(cache='test.maxsize', reason='maxsize')
+
+    backend.set('a', 1, 1000.0)
+    backend.set('b', 2, 1000.0)
+
+    assert CACHE_EVICTIONS.get(cache='test.maxsize', reason='maxsize') == evictions + 1
+
+
+def test_create_backend_shares_budget(monkeypatch, tmp_path):
+    assert create_backend('meesman.quotes', 2).budget is cache.budget
+
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'sqlite')
+    monkeypatch.setattr(config, 'CACHE_PATH', str(tmp_path / 'cache.sqlite3'))
+    assert create_backend('meesman.quotes', 2).budget is cache.budget
+
+
+def test_create_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'CACHE_PATH', str(tmp_path / 'cache.sqlite3'))
+
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'memory')
+    assert isinstance(create_backend('meesman.quotes', 2), MemoryBackend)
+
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'sqlite')
+    backend = create_backend('meesman.quotes', 2)
+    assert isinstance(backend, SqliteBackend)
+    assert backend.path == str(tmp_path / 'cache.sqlite3')
+    assert backend.namespace == 'meesman.quotes'
+
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'redis')
+    with pytest.raises(ValueError):
+        create_backend('meesman.quotes', 2)
+
+
+def test_create_cache_uses_config():
+    cache = create_cache('meesman.quotes')
+
+    assert cache.maxsize == config.CACHE_MAXSIZE
+    assert cache.ttl == config.CACHE_TTL
+    assert cache.hard_ttl == config.CACHE_HARD_TTL
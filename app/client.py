@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+from typing import Dict
+
+import httpx
+from fastapi import HTTPException
+
+from app import config
+from app.metrics import UPSTREAM_REJECTED, UPSTREAM_SECONDS
+from app.resilience import CircuitBreaker
+
+# one client (and thus one keep-alive connection pool) and one circuit breaker per upstream host.
+clients: Dict[str, httpx.AsyncClient] = {}
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def create_client(host: str = '') -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(config.HTTP_HOST_TIMEOUTS.get(host, config.HTTP_TIMEOUT),
+                              connect=config.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY),
+    )
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    host = httpx.URL(url).host
+
+    if host not in clients:
+        clients[host] = create_client(host)
+
+    return clients[host]
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    host = httpx.URL(url).host
+
+    if host not in breakers:
+        breakers[host] = CircuitBreaker(config.BREAKER_THRESHOLD, config.BREAKER_RESET_TIMEOUT)
+
+    return breakers[host]
+
+
+def open_clients(*urls: str):
+    for url in urls:
+        get_client(url)
+
+
+async def close_clients():
+    for client in clients.values():
+        await client.aclose()
+    clients.clear()
+
+
+def is_retryable(r: httpx.Response) -> bool:
+    return r.status_code >= 500 or r.status_code == httpx.codes.TOO_MANY_REQUESTS
+
+
+def is_not_modified(r: httpx.Response) -> bool:
+    # only a conditional request may be answered with 304 Not Modified.
+    return r.status_code == httpx.codes.NOT_MODIFIED and \
+        any(name in r.request.headers for name in ('If-None-Match', 'If-Modified-Since'))
+
+
+async def request(method: str, url: str, error: str, **kwargs) -> httpx.Response:
+    """
+    Requests the url, retrying transport errors and server errors with a jittered exponential backoff. Raises a 502
+    when the request failed, or a 503 without requesting while the circuit breaker of the host is open.
+    """
+    host = httpx.URL(url).host
+    breaker = get_breaker(url)
+
+    if not breaker.allow():
+        UPSTREAM_REJECTED.inc(host=host)
+        raise HTTPException(status_code=503, detail={'message': error})
+
+    for attempt in range(config.HTTP_RETRIES + 1):
+        if attempt > 0:
+            await asyncio.sleep(random.uniform(0, config.HTTP_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+        start = time.perf_counter()
+
+        try:
+            r = await get_client(url).request(method, url, **kwargs)
+        except httpx.HTTPError:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, host=host, outcome='transport_error')
+            continue
+
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, host=host, outcome=str(r.status_code))
+
+        if r.status_code == httpx.codes.OK or is_not_modified(r):
+            breaker.success()
+            return r
+
+        if not is_retryable(r):
+            # the host answered, it is up but does not have what was asked for.
+            breaker.success()
+            raise HTTPException(status_code=502, detail={'message': error})
+
+    breaker.failure()
+    raise HTTPException(status_code=502, detail={'message': error})
+
+
+async def get(url: str, error: str, **kwargs) -> httpx.Response:
+    return await request('GET', url, error, **kwargs)
+
+
+async def post(url: str, error: str, **kwargs) -> httpx.Response:
+    return await request('POST', url, error, **kwargs)
@@ -0,0 +1,146 @@
+import httpx
+import pytest
+import respx
+from fastapi import HTTPException
+
+from . import client, config
+
+
+@pytest.fixture(autouse=True)
+def clear_clients(run):
+    run(client.close_clients())
+    yield
+
+
+def test_get_client_returns_same_client_per_host():
+    first = client.get_client('https://www.meesman.nl/onze-fondsen/')
+    second = client.get_client('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/')
+    other = client.get_client('https://secure.brandnewday.nl/service/getfundsnew/')
+
+    assert first is second
+    assert first is not other
+    assert len(client.clients) == 2
+
+
+def test_open_clients_creates_client_per_host():
+    client.open_clients('https://www.meesman.nl/onze-fondsen/', 'https://secure.brandnewday.nl/service/{0}/')
+
+    assert list(client.clients.keys()) == ['www.meesman.nl', 'secure.brandnewday.nl']
+
+
+def test_close_clients_closes_and_removes_clients(run):
+    c = client.get_client('https://www.meesman.nl/onze-fondsen/')
+
+    run(client.close_clients())
+
+    assert c.is_closed
+    assert len(client.clients) == 0
+
+
+@respx.mock
+def test_request_returns_response(run):
+    respx.post('https://www.meesman.nl/').mock(return_value=httpx.Response(200, text='ok'))
+
+    r = run(client.post('https://www.meesman.nl/', 'error'))
+
+    assert r.text == 'ok'
+
+
+@respx.mock
+def test_request_returns_not_modified_response_of_conditional_request(run):
+    respx.get('https://www.meesman.nl/').mock(return_value=httpx.Response(304))
+
+    r = run(client.get('https://www.meesman.nl/', 'error', headers={'If-None-Match': '"v1"'}))
+
+    assert r.status_code == 304
+
+    with pytest.raises(HTTPException) as e:
+        run(client.get('https://www.meesman.nl/', 'error'))
+
+    assert e.value.status_code == 502
+
+
+@respx.mock
+def test_request_non_ok_status_raises_http502(run):
+    respx.get('https://www.meesman.nl/').mock(return_value=httpx.Response(404, text='not found'))
+
+    with pytest.raises(HTTPException) as e:
+        run(client.get('https://www.meesman.nl/', 'Could not retrieve funds'))
+
+    assert e.value.status_code == 502
+    assert e.value.detail == {'message': 'Could not retrieve funds'}
+
+
+@respx.mock
+def test_request_transport_error_raises_http502(run):
+    respx.get('https://www.meesman.nl/').mock(side_effect=httpx.ConnectTimeout)
+
+    with pytest.raises(HTTPException) as e:
+        run(client.get('https://www.meesman.nl/', 'Could not retrieve funds'))
+
+    assert e.value.status_code == 502
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    monkeypatch.setattr(config, 'HTTP_RETRIES', 2)
+    monkeypatch.setattr(config, 'HTTP_RETRY_BACKOFF', 0.001)
+    yield
+
+
+@respx.mock
+def test_request_retries_server_errors(run, retries):
+    route = respx.get('https://www.meesman.nl/').mock(
+        side_effect=[httpx.Response(500), httpx.ConnectTimeout, httpx.Response(200, text='ok')])
+
+    r = run(client.get('https://www.meesman.nl/', 'error'))
+
+    assert r.text == 'ok'
+    assert route.call_count == 3
+
+
+@respx.mock
+def test_request_retries_too_many_requests_until_retries_are_exhausted(run, retries):
+    route = respx.get('https://www.meesman.nl/').mock(return_value=httpx.Response(429))
+
+    with pytest.raises(HTTPException) as e:
+        run(client.get('https://www.meesman.nl/', 'Could not retrieve funds'))
+
+    assert e.value.status_code == 502
+    assert route.call_count == 3
+
+
+@respx.mock
+def test_request_does_not_retry_client_errors(run, retries):
+    route = respx.get('https://www.meesman.nl/').mock(return_value=httpx.Response(404))
+
+    with pytest.raises(HTTPException):
+        run(client.get('https://www.meesman.nl/', 'error'))
+
+    assert route.call_count == 1
+    assert client.get_breaker('https://www.meesman.nl/').failures == 0
+
+
+@respx.mock
+def test_request_fails_fast_while_breaker_is_open(run, monkeypatch):
+    monkeypatch.setattr(config, 'BREAKER_THRESHOLD', 2)
+    route = respx.get('https://www.meesman.nl/').mock(return_value=httpx.Response(500))
+    other = respx.get('https://secure.brandnewday.nl/').mock(return_value=httpx.Response(200))
+
+    for status_code in [502, 502, 503, 503]:
+        with pytest.raises(HTTPException) as e:
+            run(client.get('https://www.meesman.nl/', 'Could not retrieve funds'))
+
+        assert e.value.status_code == status_code
+        assert e.value.detail == {'message': 'Could not retrieve funds'}
+
+    assert route.call_count == 2
+    run(client.get('https://secure.brandnewday.nl/', 'error'))
+    assert other.call_count == 1
+
+
+def test_create_client_uses_host_timeout(monkeypatch):
+    monkeypatch.setattr(config, 'HTTP_HOST_TIMEOUTS', {'www.meesman.nl': 5.0})
+
+    assert client.create_client('www.meesman.nl').timeout.read == 5.0
+    assert client.create_client('secure.brandnewday.nl').timeout.read == config.HTTP_TIMEOUT
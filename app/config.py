@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+# upstream http client settings, timeouts in seconds.
+HTTP_TIMEOUT = float(os.getenv('QUOTES_HTTP_TIMEOUT', 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('QUOTES_HTTP_CONNECT_TIMEOUT', 10))
+HTTP_MAX_CONNECTIONS = int(os.getenv('QUOTES_HTTP_MAX_CONNECTIONS', 10))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('QUOTES_HTTP_MAX_KEEPALIVE_CONNECTIONS', 5))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('QUOTES_HTTP_KEEPALIVE_EXPIRY', 60))
+# timeouts per upstream host, overriding HTTP_TIMEOUT, as host=seconds separated by commas.
+HTTP_HOST_TIMEOUTS = {host.strip(): float(timeout) for host, _, timeout in
+                      (item.partition('=') for item in os.getenv('QUOTES_HTTP_HOST_TIMEOUTS', '').split(',') if item)}
+
+# failed upstream requests are retried, waiting a random time up to the backoff (in seconds) doubled every retry.
+HTTP_RETRIES = int(os.getenv('QUOTES_HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.getenv('QUOTES_HTTP_RETRY_BACKOFF', 0.5))
+
+# after this many failed requests in a row, requests to the upstream host fail fast for the reset timeout (in seconds).
+BREAKER_THRESHOLD = int(os.getenv('QUOTES_BREAKER_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('QUOTES_BREAKER_RESET_TIMEOUT', 60))
+
+# cache settings, in seconds. Entries older than the ttl are served stale while they are refreshed in the
+# background, entries older than the hard ttl are dropped.
+CACHE_TTL = float(os.getenv('QUOTES_CACHE_TTL', 60 * 60 * 4))
+CACHE_HARD_TTL = float(os.getenv('QUOTES_CACHE_HARD_TTL', 60 * 60 * 24))
+CACHE_MAXSIZE = int(os.getenv('QUOTES_CACHE_MAXSIZE', 128))
+# bytes of memory the caches of a worker process share, 0 for no limit. When the caches together need more, entries
+# are evicted: 'lru' the least recently used, 'lfu' the least frequently used.
+CACHE_MEMORY_BUDGET = int(os.getenv('QUOTES_CACHE_MEMORY_BUDGET', 64 * 1024 * 1024))
+CACHE_EVICTION = os.getenv('QUOTES_CACHE_EVICTION', 'lru')
+
+# where cache entries are kept; 'memory' for each worker process on its own, or 'sqlite' for a database at
+# QUOTES_CACHE_PATH shared by all worker processes on the host.
+CACHE_BACKEND = os.getenv('QUOTES_CACHE_BACKEND', 'memory')
+CACHE_PATH = os.getenv('QUOTES_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'quotes-cache.sqlite3'))
+
+# where the history of quotes is kept; 'sqlite' for a database at QUOTES_STORE_PATH that survives restarts, or
+# 'memory' for each worker process on its own.
+STORE_BACKEND = os.getenv('QUOTES_STORE_BACKEND', 'sqlite')
+STORE_PATH = os.getenv('QUOTES_STORE_PATH', os.path.join(tempfile.gettempdir(), 'quotes.sqlite3'))
+
+# seconds between the publishes of the metrics of a worker process, when worker processes share the SQLite cache.
+METRICS_INTERVAL = float(os.getenv('QUOTES_METRICS_INTERVAL', 15))
+
+# maximum number of seconds clients may cache a response, shared caches like a reverse proxy use the remaining ttl.
+CACHE_CONTROL_MAX_AGE = int(os.getenv('QUOTES_CACHE_CONTROL_MAX_AGE', 600))
+
+# maximum number of parsed upstream pages kept in memory, a page that did not change since is not parsed again.
+PAGE_CACHE_MAXSIZE = int(os.getenv('QUOTES_PAGE_CACHE_MAXSIZE', 64))
+
+# maximum number of Brand New Day pages retrieved concurrently for a single fund.
+BRANDNEWDAY_PAGE_CONCURRENCY = int(os.getenv('QUOTES_BRANDNEWDAY_PAGE_CONCURRENCY', 4))
+
+# maximum number of encoded responses kept in memory.
+RESPONSE_CACHE_MAXSIZE = int(os.getenv('QUOTES_RESPONSE_CACHE_MAXSIZE', 256))
+
+# JSON responses of at least this many bytes are compressed for clients that accept it, once per encoded response.
+COMPRESSION_MIN_SIZE = int(os.getenv('QUOTES_COMPRESSION_MIN_SIZE', 500))
+GZIP_LEVEL = int(os.getenv('QUOTES_GZIP_LEVEL', 9))
+BROTLI_QUALITY = int(os.getenv('QUOTES_BROTLI_QUALITY', 9))
+
+# maximum number of funds of a batch request resolved at the same time.
+BATCH_CONCURRENCY = int(os.getenv('QUOTES_BATCH_CONCURRENCY', 4))
+
+# funds fetched at startup and kept fresh, comma separated as provider/fund or provider/* and * for all funds.
+WARMUP_FUNDS = os.getenv('QUOTES_WARMUP_FUNDS', '')
+# seconds between warm ups, each refreshes what would go stale before the next one.
+WARMUP_INTERVAL = float(os.getenv('QUOTES_WARMUP_INTERVAL', 15 * 60))
+# maximum random delay in seconds added to the interval, so worker processes do not refresh at the same time.
+WARMUP_JITTER = float(os.getenv('QUOTES_WARMUP_JITTER', 60))
+# maximum number of funds refreshed at the same time while warming up.
+WARMUP_CONCURRENCY = int(os.getenv('QUOTES_WARMUP_CONCURRENCY', 2))
+# maximum number of seconds startup waits for the first warm up.
+WARMUP_TIMEOUT = float(os.getenv('QUOTES_WARMUP_TIMEOUT', 30))
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from app import client, config, pages
+from app.cache import freshness
+
+
+@pytest.fixture
+def run():
+    # a private event loop, so the loop used by the TestClient is left untouched.
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(autouse=True)
+def upstream(monkeypatch):
+    # requests are not retried and circuit breakers start closed, unless a test says otherwise.
+    monkeypatch.setattr(config, 'HTTP_RETRIES', 0)
+    client.breakers.clear()
+    # pages parsed by an earlier test would be taken as unchanged.
+    pages.pages.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def fresh_request():
+    # lookups outside of a task would otherwise leave their freshness behind for the next test.
+    token = freshness.set(None)
+    yield
+    freshness.reset(token)
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+
+class Database:
+    """
+    SQLite database shared by all worker processes on a host, with a connection per process. Statements outside of a
+    transaction are committed one by one.
+    """
+
+    def __init__(self, path: str, schema: str, connected: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.schema = schema
+        # called after every new connection, for what was derived from the database through the previous one.
+        self.connected = connected
+        self.pid: Optional[int] = None
+        self.db: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # a connection must not be shared with forked worker processes.
+        if self.pid != os.getpid():
+            self.db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(self.schema)
+            self.pid = os.getpid()
+
+            if self.connected is not None:
+                self.connected()
+
+        return self.db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Commits the statements executed within at once, or none of them when an exception is raised. The write lock is
+        taken at the start, so the transaction does not fail on upgrading a read lock.
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+
+
+class Lease:
+    """
+    Named lease in a SQLite database, held by at most one process at a time. The holder renews it by claiming it again
+    before it expires, an expired lease can be claimed by any process.
+    """
+
+    def __init__(self, path: str, name: str, duration: float):
+        self.name = name
+        self.duration = duration
+        self.database = Database(path, 'CREATE TABLE IF NOT EXISTS leases (name TEXT NOT NULL PRIMARY KEY, '
+                                       'holder INTEGER NOT NULL, expires REAL NOT NULL)')
+
+    def claim(self) -> bool:
+        """
+        Claims or renews the lease, returns whether this process holds it.
+        """
+        now = time.time()
+        return self.database.connection.execute(
+            'INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET '
+            'holder = excluded.holder, expires = excluded.expires WHERE holder = excluded.holder OR expires <= ?',
+            (self.name, os.getpid(), now + self.duration, now)).rowcount > 0
+
+    def release(self):
+        self.database.connection.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self.name, os.getpid()))
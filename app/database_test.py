@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+from .database import Database, Lease
+
+SCHEMA = 'CREATE TABLE IF NOT EXISTS test (key TEXT PRIMARY KEY)'
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'test.sqlite3')
+
+
+def count(path: str) -> int:
+    return Database(path, SCHEMA).connection.execute('SELECT COUNT(*) FROM test').fetchone()[0]
+
+
+def test_transaction_commits_at_the_end(path):
+    database = Database(path, SCHEMA)
+
+    with database.transaction() as connection:
+        connection.executemany('INSERT INTO test (key) VALUES (?)', [('a',), ('b',)])
+        # other connections do not see the rows until the transaction is committed.
+        assert count(path) == 0
+
+    assert count(path) == 2
+    assert not database.connection.in_transaction
+
+
+def test_transaction_rolls_back_on_error(path):
+    database = Database(path, SCHEMA)
+
+    with pytest.raises(ValueError):
+        with database.transaction() as connection:
+            connection.execute('INSERT INTO test (key) VALUES (?)', ('a',))
+            raise ValueError()
+
+    assert count(path) == 0
+    assert not database.connection.in_transaction
+
+
+def test_reconnects_after_fork(path, monkeypatch):
+    connected = []
+    database = Database(path, SCHEMA, lambda: connected.append(os.getpid()))
+    connection = database.connection
+
+    assert database.connection is connection
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+
+    assert database.connection is not connection
+    assert connected == [connected[0], -1]
+
+
+def test_lease_is_held_by_one_process_until_released(path, monkeypatch):
+    lease = Lease(path, 'warmup', 60)
+    other = Lease(path, 'other', 60)
+    monkeypatch.setattr(time, 'time', lambda: 1000.0)
+
+    assert lease.claim()
+    # the holder renews the lease, other leases are independent.
+    assert lease.claim()
+    assert other.claim()
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert not lease.claim()
+    # only the holder releases the lease.
+    lease.release()
+    assert not lease.claim()
+
+    monkeypatch.undo()
+    lease.release()
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert lease.claim()
+
+
+def test_expired_lease_can_be_claimed(path, monkeypatch):
+    lease = Lease(path, 'warmup', 60)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    assert lease.claim()
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    now[0] += 59
+    assert not lease.claim()
+    now[0] += 1
+    assert lease.claim()
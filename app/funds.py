@@ -0,0 +1,111 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+from fastapi import HTTPException
+
+from app.cache import create_cache
+from app.models import Fund
+from app.resilience import with_fallback
+from app.singleflight import SingleFlight
+from app.utils import clean_fund_name
+
+KEY = 'funds'
+
+
+def normalize(name: str) -> str:
+    return clean_fund_name(name.strip())
+
+
+class Funds:
+    """
+    Funds of a provider indexed by id and by name. A fund is also found by its normalized name, so
+    'Aandelen Wereldwijd Totaal' finds aandelen-wereldwijd-totaal.
+    """
+
+    def __init__(self, funds: Iterable[Fund] = ()):
+        self.by_id: Dict[str, Fund] = {}
+        self.by_name: Dict[str, Fund] = {}
+
+        for fund in funds:
+            self.by_id[fund.id] = fund
+            self.by_name[fund.name] = fund
+
+        # a normalized name never replaces the name of another fund.
+        for fund in self.by_id.values():
+            self.by_name.setdefault(normalize(fund.name), fund)
+
+    def find(self, name: str) -> Optional[Fund]:
+        fund = self.by_name.get(name)
+        return fund if fund is not None else self.by_name.get(normalize(name))
+
+    def get(self, fund_id: str) -> Optional[Fund]:
+        return self.by_id.get(fund_id)
+
+    def names(self) -> List[str]:
+        return [fund.name for fund in self.by_id.values()]
+
+    def __iter__(self) -> Iterator[Fund]:
+        return iter(self.by_id.values())
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+
+class FundRegistry:
+    """
+    Funds of a provider, cached as a single index that is replaced as a whole when it is refreshed. Concurrent misses
+    share a single fetch, a stale index is refreshed in the background. After a refresh, invalidate is called for every
+    fund that disappeared or changed.
+    """
+
+    def __init__(self, name: str, fetch: Callable[[], Awaitable[Iterable[Fund]]],
+                 invalidate: Optional[Callable[[Fund], Any]] = None):
+        self.cache = create_cache(name)
+        self.flight = SingleFlight()
+        self.fetch = fetch
+        self.invalidate = invalidate
+        # the last funds of this worker process, served when the funds cannot be retrieved.
+        self.last: Optional[Funds] = None
+
+    async def funds(self) -> Funds:
+        funds, stale = self.cache.lookup(KEY)
+
+        if funds is None:
+            return await with_fallback(self.flight.do(KEY, self.refresh), lambda: self.last)
+
+        if stale:
+            self.flight.background(KEY, self.refresh)
+
+        return funds
+
+    async def prefetch(self, ahead: float):
+        """
+        Refreshes the funds when they are missing or go stale within ahead seconds.
+        """
+        if self.cache.is_stale(KEY, ahead):
+            await self.flight.do(KEY, self.refresh)
+
+    async def refresh(self) -> Funds:
+        funds = Funds(await self.fetch())
+        previous = self.cache.get(KEY)
+        self.cache[KEY] = funds
+        self.last = funds
+
+        # only what is cached for funds that disappeared or changed is invalidated, the rest stays warm.
+        if previous is not None and self.invalidate is not None:
+            for fund in previous:
+                if funds.get(fund.id) != fund:
+                    self.invalidate(fund)
+
+        return funds
+
+    async def find(self, name: str) -> Fund:
+        fund = (await self.funds()).find(name)
+
+        if fund is None:
+            raise HTTPException(status_code=404, detail={'message': 'Fund {0} could not be found'.format(name)})
+
+        return fund
+
+    def clear(self):
+        self.cache.clear()
+        self.last = None
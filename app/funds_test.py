@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from .funds import FundRegistry, Funds
+from .models import Fund
+
+hedged = Fund(id='1002', name='bnd-wereld-indexfonds-c-hedged')
+unhedged = Fund(id='1012', name='bnd-wereld-indexfonds-c-unhedged')
+
+
+def test_funds_are_indexed_by_id_and_name():
+    funds = Funds([hedged, unhedged])
+
+    assert funds.get('1012') is unhedged
+    assert funds.get('unknown') is None
+    assert funds.find('bnd-wereld-indexfonds-c-hedged') is hedged
+    assert funds.names() == ['bnd-wereld-indexfonds-c-hedged', 'bnd-wereld-indexfonds-c-unhedged']
+    assert list(funds) == [hedged, unhedged]
+    assert len(funds) == 2
+
+
+@pytest.mark.parametrize('name', [
+    'bnd-wereld-indexfonds-c-hedged',
+    ' BND Wereld Indexfonds C Hedged ',
+    'BND-Wereld-Indexfonds-C-Hedged',
+])
+def test_funds_find_normalized_name(name):
+    assert Funds([hedged, unhedged]).find(name) is hedged
+
+
+def test_funds_normalized_name_never_replaces_name():
+    exact = Fund(id='1', name='fonds-a')
+    other = Fund(id='2', name='Fonds A')
+
+    funds = Funds([other, exact])
+
+    assert funds.find('fonds-a') is exact
+    assert funds.find('Fonds A') is other
+    assert funds.find('unknown') is None
+
+
+def test_registry_fetches_funds_once(run):
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return [hedged, unhedged]
+
+    registry = FundRegistry('test.funds.once', fetch)
+    registry.clear()
+
+    async def main():
+        return await asyncio.gather(*[registry.funds() for _ in range(5)])
+
+    results = run(main())
+
+    assert len(calls) == 1
+    assert all(funds is results[0] for funds in results)
+    assert run(registry.funds()).names() == results[0].names()
+    assert run(registry.find('bnd-wereld-indexfonds-c-unhedged')) is unhedged
+
+
+def test_registry_replaces_stale_funds_in_background(run, monkeypatch):
+    lists = [[hedged, unhedged], [hedged]]
+
+    async def fetch():
+        return lists.pop(0)
+
+    registry = FundRegistry('test.funds.stale', fetch)
+    registry.clear()
+    now = [1000.0]
+    monkeypatch.setattr(registry.cache, 'timer', lambda: now[0])
+
+    async def main():
+        first = await registry.funds()
+        now[0] += registry.cache.ttl
+
+        stale = await registry.funds()
+        await asyncio.gather(*registry.flight.calls.values())
+
+        return first, stale, await registry.funds()
+
+    first, stale, fresh = run(main())
+
+    assert stale.names() == first.names()
+    assert fresh.names() == ['bnd-wereld-indexfonds-c-hedged']
+
+
+def test_registry_find_unknown_fund_raises_404(run):
+    async def fetch():
+        return [hedged]
+
+    registry = FundRegistry('test.funds.unknown', fetch)
+    registry.clear()
+
+    with pytest.raises(HTTPException) as e:
+        run(registry.find('unknown'))
+
+    assert e.value.status_code == 404
+    assert e.value.detail == {'message': 'Fund unknown could not be found'}
+
+    registry.clear()
+    assert len(registry.cache) == 0
+
+
+def test_registry_invalidates_funds_that_disappeared_or_changed(run):
+    renamed = Fund(id='1012', name='bnd-wereld-indexfonds-c-unhedged-2')
+    added = Fund(id='1020', name='bnd-duurzaam-aandelenfonds')
+    lists = [[hedged, unhedged, Fund(id='1030', name='removed')], [hedged, renamed, added]]
+    invalidated = []
+
+    async def fetch():
+        return lists.pop(0)
+
+    registry = FundRegistry('test.funds.invalidate', fetch, invalidated.append)
+    registry.clear()
+
+    run(registry.refresh())
+    assert invalidated == []
+
+    run(registry.refresh())
+    assert invalidated == [unhedged, Fund(id='1030', name='removed')]
+
+
+def test_registry_serves_last_funds_when_refresh_fails(run):
+    results = [[hedged], HTTPException(status_code=502, detail={'message': 'Could not retrieve funds'})]
+
+    async def fetch():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    registry = FundRegistry('test.funds.last', fetch)
+    registry.clear()
+
+    run(registry.funds())
+    registry.cache.clear()
+
+    assert run(registry.funds()).names() == ['bnd-wereld-indexfonds-c-hedged']
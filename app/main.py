@@ -1,6 +1,8 @@
 from fastapi import FastAPI
+from starlette.responses import PlainTextResponse
 
-from app.routers import meesman, brandnewday, zwitserleven
+from app import client, metrics, warmup
+from app.routers import batch, meesman, brandnewday, zwitserleven
 
 tags_metadata = [
     {
@@ -9,6 +11,8 @@ tags_metadata = [
         "name": "Meesman",
     }, {
         "name": "Zwitserleven",
+    }, {
+        "name": "Batch",
     },
 ]
 app = FastAPI(
@@ -43,3 +47,23 @@ Source code is available at [GitHub](https://github.com/nbult/quotes)
 app.include_router(meesman.router)
 app.include_router(brandnewday.router)
 app.include_router(zwitserleven.router)
+app.include_router(batch.router)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.on_event('startup')
+async def startup():
+    client.open_clients(meesman.BASE_URL, brandnewday.BASE_URL, zwitserleven.FUNDS_URL)
+    metrics.start()
+    await warmup.start()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    warmup.stop()
+    metrics.stop()
+    await client.close_clients()
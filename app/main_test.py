@@ -0,0 +1,43 @@
+import httpx
+import respx
+from fastapi.testclient import TestClient
+
+from . import client, metrics
+from .main import app
+from .routers import meesman
+
+
+def test_startup_and_shutdown_manage_clients():
+    with TestClient(app):
+        assert sorted(client.clients.keys()) == ['secure.brandnewday.nl', 'www.meesman.nl', 'www.zwitserleven.nl']
+
+    assert len(client.clients) == 0
+
+
+@respx.mock
+def test_metrics_count_fetches_cache_lookups_and_serialization():
+    metrics.clear()
+    meesman.registry.clear()
+    meesman.quote_cache.clear()
+    respx.get(meesman.BASE_URL).mock(return_value=httpx.Response(
+        200, text='<td class="fund-name"><a href="/onze-fondsen/aandelen-wereldwijd-totaal/">Totaal</a></td>'))
+    respx.get(meesman.QUOTE_URL.format('aandelen-wereldwijd-totaal')).mock(
+        return_value=httpx.Response(200, text='data: [{"x":"2021-01-01T00:00:00","y":10}]'))
+
+    with TestClient(app) as test_client:
+        for _ in range(2):
+            assert test_client.get('/meesman/aandelen-wereldwijd-totaal').status_code == 200
+
+        response = test_client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/plain; version=0.0.4; charset=utf-8'
+
+    lines = response.text.splitlines()
+    assert 'quotes_fetch_seconds_count{provider="meesman",operation="quotes",outcome="ok"} 1.0' in lines
+    assert 'quotes_parse_seconds_count{provider="meesman",operation="funds"} 1.0' in lines
+    assert 'quotes_upstream_request_seconds_count{host="www.meesman.nl",outcome="200"} 2.0' in lines
+    assert 'quotes_cache_lookups_total{cache="meesman.quotes",result="miss"} 1.0' in lines
+    assert 'quotes_cache_lookups_total{cache="meesman.quotes",result="hit"} 1.0' in lines
+    assert 'quotes_encoded_lookups_total{result="hit"} 1.0' in lines
+    assert 'quotes_serialize_seconds_count 1.0' in lines
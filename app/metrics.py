@@ -0,0 +1,326 @@
+"""
+Counters and histograms of this worker process, exposed in the Prometheus text format on /metrics.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from app import config
+from app.database import Database
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+registry: List['Metric'] = []
+
+tasks: List[asyncio.Future] = []
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Metric(ABC):
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        registry.append(self)
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError('Metric {0} has labels {1}, not {2}'.format(self.name, self.labels, tuple(labels)))
+
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abstractmethod
+    def samples(self, values: Dict[Tuple[str, ...], Any]) -> Iterator[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        """
+        Returns the name, labels and value of every sample of the values, in the order they are rendered.
+        """
+
+    @abstractmethod
+    def merge(self, value: Any, other: Any) -> Any:
+        """
+        Returns the sum of two values of the same labels, observed by different worker processes.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Forgets all observed values.
+        """
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], Any]] = None) -> str:
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation), '# TYPE {0} {1}'.format(self.name, self.type)]
+        lines += ['{0}{1} {2}'.format(name, format_labels(labels), format_value(value))
+                  for name, labels, value in self.samples(self.values if values is None else values)]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labels, key)), value
+
+    def merge(self, value, other):
+        return value + other
+
+    def clear(self):
+        self.values.clear()
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # per labels, the count per bucket (not cumulative) and the sum of the observed values.
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        counts, total = self.values.setdefault(self.key(labels), ([0] * len(self.buckets), [0.0]))
+        counts[next(i for i, bound in enumerate(self.buckets) if value <= bound)] += 1
+        total[0] += value
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self.values.get(self.key(labels), ([0], [0.0]))
+        return sum(counts)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + [('le', format_value(bound))], cumulative
+
+            yield self.name + '_sum', labels, total[0]
+            yield self.name + '_count', labels, cumulative
+
+    def merge(self, value, other):
+        return [a + b for a, b in zip(value[0], other[0])], [value[1][0] + other[1][0]]
+
+    def clear(self):
+        self.values.clear()
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Observes the duration of every call of the decorated coroutine function, with an outcome label of ok or error.
+    """
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs) -> T:
+            start = time.perf_counter()
+            outcome = 'error'
+
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def parsing(provider: str, operation: str, size: int) -> Iterator[None]:
+    """
+    Observes the size of a page of a provider and the duration of parsing it.
+    """
+    PAGE_BYTES.observe(size, provider=provider, operation=operation)
+
+    with PARSE_SECONDS.time(provider=provider, operation=operation):
+        yield
+
+
+class SharedValues:
+    """
+    Values of every worker process in the shared SQLite database, a row per worker process and metric. Every worker
+    process publishes its own values, rendering sums those of all of them. Counters and histograms of worker processes
+    that stopped are kept, so the sums never go down; gauges only count the worker processes that published recently.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.interval = interval
+        self.worker = ''
+        self.database = Database(path, 'CREATE TABLE IF NOT EXISTS metrics (worker TEXT NOT NULL, name TEXT NOT NULL, '
+                                       'metric_values TEXT NOT NULL, updated REAL NOT NULL, '
+                                       'PRIMARY KEY (worker, name))', self.connected)
+
+    def connected(self):
+        # process ids are reused, a worker process started later must not overwrite the values of an earlier one.
+        self.worker = '{0}-{1}'.format(os.getpid(), uuid.uuid4().hex)
+
+    def publish(self):
+        connection = self.database.connection
+        values = [(self.worker, metric.name, json.dumps(list(metric.values.items())), time.time())
+                  for metric in registry]
+
+        with self.database.transaction():
+            connection.executemany('INSERT INTO metrics (worker, name, metric_values, updated) VALUES (?, ?, ?, ?) '
+                                   'ON CONFLICT (worker, name) DO UPDATE SET metric_values = excluded.metric_values, '
+                                   'updated = excluded.updated', values)
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """
+        Returns the values of every metric summed over the worker processes.
+        """
+        metrics = {metric.name: metric for metric in registry}
+        collected: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in metrics}
+        # a worker process that did not publish for a few intervals is gone.
+        live = time.time() - self.interval * 3
+
+        for name, metric_values, updated in self.database.connection.execute(
+                'SELECT name, metric_values, updated FROM metrics'):
+            metric = metrics.get(name)
+
+            if metric is None or (isinstance(metric, Gauge) and updated < live):
+                continue
+
+            values = collected[name]
+
+            for key, value in json.loads(metric_values):
+                key = tuple(key)
+                values[key] = metric.merge(values[key], value) if key in values else value
+
+        return collected
+
+    def clear(self):
+        self.database.connection.execute('DELETE FROM metrics')
+
+
+def render() -> str:
+    if shared is None:
+        return ''.join(metric.render() for metric in registry)
+
+    # the values of this worker process are current, those of the others are as recent as their last publish.
+    shared.publish()
+    collected = shared.collect()
+    return ''.join(metric.render(collected[metric.name]) for metric in registry)
+
+
+async def publish():
+    """
+    Publishes the values of this worker process every interval, failures are logged and tried again.
+    """
+    while True:
+        await asyncio.sleep(shared.interval)
+
+        try:
+            shared.publish()
+        except sqlite3.Error as e:
+            logger.warning('Publishing metrics failed: %r', e)
+
+
+def start():
+    if shared is not None:
+        tasks.append(asyncio.ensure_future(publish()))
+
+
+def stop():
+    for task in tasks:
+        task.cancel()
+
+    tasks.clear()
+
+    if shared is not None:
+        try:
+            shared.publish()
+        except sqlite3.Error as e:
+            logger.warning('Publishing metrics failed: %r', e)
+
+
+def clear():
+    for metric in registry:
+        metric.clear()
+
+    if shared is not None:
+        shared.clear()
+
+
+FETCH_SECONDS = Histogram('quotes_fetch_seconds', 'Duration of retrieving funds or quotes from a provider, parsing '
+                          'included.', ['provider', 'operation', 'outcome'])
+PARSE_SECONDS = Histogram('quotes_parse_seconds', 'Duration of parsing a page of a provider.',
+                          ['provider', 'operation'])
+PAGE_BYTES = Histogram('quotes_page_bytes', 'Size of the pages retrieved from a provider.', ['provider', 'operation'],
+                       SIZE_BUCKETS)
+PAGES_UNCHANGED = Counter('quotes_pages_unchanged_total', 'Pages of a provider not parsed because they did not change, '
+                          'by reason: not_modified or fingerprint.', ['provider', 'operation', 'reason'])
+UPSTREAM_SECONDS = Histogram('quotes_upstream_request_seconds', 'Duration of every request to an upstream host, '
+                             'retries included.', ['host', 'outcome'])
+UPSTREAM_REJECTED = Counter('quotes_upstream_rejected_total', 'Requests not sent because the circuit breaker of the '
+                            'host is open.', ['host'])
+CACHE_LOOKUPS = Counter('quotes_cache_lookups_total', 'Cache lookups by result, which is hit, stale or miss.',
+                        ['cache', 'result'])
+CACHE_EVICTIONS = Counter('quotes_cache_evictions_total', 'Entries evicted from a cache because it held maxsize entries, '
+                          'or the caches together exceeded the memory budget.', ['cache', 'reason'])
+CACHE_BYTES = Gauge('quotes_cache_bytes', 'Approximate memory used by the entries of a cache.', ['cache'])
+SERIALIZE_SECONDS = Histogram('quotes_serialize_seconds', 'Duration of encoding a JSON response.')
+RESPONSE_BYTES = Histogram('quotes_response_bytes', 'Size of JSON responses.', buckets=SIZE_BUCKETS)
+COMPRESSED_BYTES = Histogram('quotes_compressed_bytes', 'Size of compressed JSON responses.', ['encoding'],
+                             SIZE_BUCKETS)
+ENCODED_LOOKUPS = Counter('quotes_encoded_lookups_total', 'Lookups of encoded JSON responses by result, which is hit '
+                          'or miss.', ['result'])
+
+# worker processes sharing the SQLite cache share their metrics in its database, a scrape of any of them renders the
+# metrics of all. Otherwise every worker process only renders its own.
+shared: Optional[SharedValues] = SharedValues(config.CACHE_PATH, config.METRICS_INTERVAL) \
+    if config.CACHE_BACKEND == 'sqlite' else None
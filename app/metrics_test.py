@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import sqlite3
+
+import pytest
+
+from . import metrics
+from .metrics import Counter, Gauge, Histogram, SharedValues, parsing, timed
+
+
+@pytest.fixture(autouse=True)
+def isolate_registry(monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', [])
+    # every worker process renders its own values, unless a test shares them.
+    monkeypatch.setattr(metrics, 'shared', None)
+    yield
+
+
+def test_counter_renders_samples_per_labels():
+    counter = Counter('test_total', 'Test counter.', ['cache', 'result'])
+
+    counter.inc(cache='meesman.quotes', result='hit')
+    counter.inc(2, cache='meesman.quotes', result='hit')
+    counter.inc(cache='a"b\\c\nd', result='miss')
+
+    assert counter.get(cache='meesman.quotes', result='hit') == 3
+    assert counter.get(cache='meesman.quotes', result='miss') == 0
+    assert metrics.render().splitlines() == [
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        r'test_total{cache="a\"b\\c\nd",result="miss"} 1.0',
+        'test_total{cache="meesman.quotes",result="hit"} 3.0',
+    ]
+
+
+def test_counter_requires_its_labels():
+    counter = Counter('test_total', 'Test counter.', ['cache'])
+
+    with pytest.raises(ValueError):
+        counter.inc(result='hit')
+
+
+def test_gauge_goes_up_and_down():
+    gauge = Gauge('test_bytes', 'Test gauge.', ['cache'])
+
+    gauge.inc(100, cache='meesman.quotes')
+    gauge.inc(-40, cache='meesman.quotes')
+    assert gauge.get(cache='meesman.quotes') == 60
+
+    gauge.set(10, cache='meesman.quotes')
+    assert gauge.render().splitlines()[1:] == ['# TYPE test_bytes gauge', 'test_bytes{cache="meesman.quotes"} 10.0']
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('test_seconds', 'Test histogram.', buckets=[0.1, 1])
+
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.count() == 3
+    assert histogram.render() == '''# HELP test_seconds Test histogram.
+# TYPE test_seconds histogram
+test_seconds_bucket{le="0.1"} 1.0
+test_seconds_bucket{le="1.0"} 2.0
+test_seconds_bucket{le="+Inf"} 3.0
+test_seconds_sum 5.55
+test_seconds_count 3.0
+'''
+
+
+def test_histogram_time_observes_duration_even_on_error():
+    histogram = Histogram('test_seconds', 'Test histogram.', ['provider'])
+
+    with histogram.time(provider='meesman'):
+        pass
+
+    with pytest.raises(ValueError):
+        with histogram.time(provider='meesman'):
+            raise ValueError()
+
+    assert histogram.count(provider='meesman') == 2
+    assert histogram.count(provider='zwitserleven') == 0
+
+
+def test_timed_observes_outcome(run):
+    histogram = Histogram('test_seconds', 'Test histogram.', ['provider', 'outcome'])
+
+    @timed(histogram, provider='meesman')
+    async def fetch(fail: bool) -> str:
+        if fail:
+            raise ValueError()
+        return 'quotes'
+
+    assert run(fetch(False)) == 'quotes'
+    with pytest.raises(ValueError):
+        run(fetch(True))
+
+    assert histogram.count(provider='meesman', outcome='ok') == 1
+    assert histogram.count(provider='meesman', outcome='error') == 1
+
+
+def test_parsing_observes_size_and_duration(monkeypatch):
+    page_bytes = Histogram('test_bytes', 'Test histogram.', ['provider', 'operation'])
+    parse_seconds = Histogram('test_seconds', 'Test histogram.', ['provider', 'operation'])
+    monkeypatch.setattr(metrics, 'PAGE_BYTES', page_bytes)
+    monkeypatch.setattr(metrics, 'PARSE_SECONDS', parse_seconds)
+
+    with parsing('meesman', 'quotes', 1500):
+        pass
+
+    assert page_bytes.values[('meesman', 'quotes')][1] == [1500]
+    assert parse_seconds.count(provider='meesman', operation='quotes') == 1
+
+
+def test_clear_forgets_values():
+    counter = Counter('test_total', 'Test counter.')
+    histogram = Histogram('test_seconds', 'Test histogram.')
+    counter.inc()
+    histogram.observe(1)
+
+    metrics.clear()
+
+    assert metrics.render() == '''# HELP test_total Test counter.
+# TYPE test_total counter
+# HELP test_seconds Test histogram.
+# TYPE test_seconds histogram
+'''
+
+
+@pytest.fixture
+def shared(monkeypatch, tmp_path):
+    values = SharedValues(str(tmp_path / 'cache.sqlite3'), 15)
+    monkeypatch.setattr(metrics, 'shared', values)
+    return values
+
+
+def test_shared_values_render_the_sum_of_all_worker_processes(shared, monkeypatch):
+    counter = Counter('test_total', 'Test counter.', ['cache'])
+    gauge = Gauge('test_bytes', 'Test gauge.')
+    histogram = Histogram('test_seconds', 'Test histogram.', buckets=(1,))
+    counter.inc(cache='a')
+    gauge.set(100)
+    histogram.observe(0.5)
+    metrics.render()
+
+    # another worker process, which started later and has values of its own.
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    for metric in (counter, gauge, histogram):
+        metric.clear()
+    counter.inc(2, cache='a')
+    counter.inc(cache='b')
+    gauge.set(50)
+    histogram.observe(2)
+
+    assert metrics.render().splitlines() == [
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{cache="a"} 3.0',
+        'test_total{cache="b"} 1.0',
+        '# HELP test_bytes Test gauge.',
+        '# TYPE test_bytes gauge',
+        'test_bytes 150.0',
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="1.0"} 1.0',
+        'test_seconds_bucket{le="+Inf"} 2.0',
+        'test_seconds_sum 2.5',
+        'test_seconds_count 2.0',
+    ]
+
+    # the first worker process stopped, its counters stay but its gauges go, metrics no longer known are ignored.
+    shared.database.connection.execute('UPDATE metrics SET updated = 0 WHERE worker != ?', (shared.worker,))
+    shared.database.connection.execute("INSERT INTO metrics VALUES ('other', 'unknown_total', '[]', 0)")
+
+    lines = metrics.render().splitlines()
+    assert 'test_total{cache="a"} 3.0' in lines
+    assert 'test_bytes 50.0' in lines
+
+    metrics.clear()
+    assert shared.collect() == {'test_total': {}, 'test_bytes': {}, 'test_seconds': {}}
+
+
+def test_shared_values_are_published_every_interval(shared, run, monkeypatch, caplog):
+    counter = Counter('test_total', 'Test counter.')
+    counter.inc()
+    shared.interval = 0
+    publish = shared.publish
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def locked():
+        if failures:
+            raise failures.pop()
+        publish()
+
+    monkeypatch.setattr(shared, 'publish', locked)
+
+    async def main():
+        metrics.start()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        metrics.stop()
+
+    with caplog.at_level(logging.WARNING):
+        run(main())
+
+    assert 'Publishing metrics failed' in caplog.text
+    assert shared.collect()['test_total'] == {(): 1.0}
+    assert metrics.tasks == []
+
+
+def test_stop_logs_failed_publish(shared, monkeypatch, caplog):
+    def locked():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(shared, 'publish', locked)
+
+    with caplog.at_level(logging.WARNING):
+        metrics.stop()
+
+    assert 'Publishing metrics failed' in caplog.text
+
+
+def test_start_and_stop_without_shared_values(run):
+    async def main():
+        metrics.start()
+        assert metrics.tasks == []
+        metrics.stop()
+
+    run(main())
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -15,3 +16,11 @@ class Quote(BaseModel):
 
 class Message(BaseModel):
     message: str
+
+
+class FundQuotes(BaseModel):
+    fund: str
+    status: int
+    stale: Optional[bool]
+    quotes: Optional[List[Quote]]
+    message: Optional[str]
@@ -0,0 +1,71 @@
+"""
+Parsed pages of the providers by url. A page that did not change since it was parsed is not parsed again: it is
+requested conditionally with the validators of the last response, or else fingerprinted.
+"""
+import hashlib
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
+
+import httpx
+
+from app import client, config
+from app.cache import MemoryBackend, budget
+from app.metrics import PAGE_BYTES, PAGES_UNCHANGED, PARSE_SECONDS
+
+T = TypeVar('T')
+
+
+class Page(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fingerprint: bytes
+    parsed: Any
+
+
+pages = MemoryBackend(config.PAGE_CACHE_MAXSIZE, budget, 'pages')
+
+
+def fingerprint(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def get_validators(page: Optional[Page]) -> Dict[str, str]:
+    headers = {}
+
+    if page is not None and page.etag:
+        headers['If-None-Match'] = page.etag
+    if page is not None and page.last_modified:
+        headers['If-Modified-Since'] = page.last_modified
+
+    return headers
+
+
+async def get_parsed(url: str, error: str, parse: Callable[[str], T], provider: str, operation: str,
+                     extract: Optional[Callable[[str], str]] = None) -> Tuple[T, bool]:
+    """
+    Requests the page and parses it, unless the host answers that it was not modified or the fingerprint of the page,
+    or of the part of it returned by extract, is the same as that of the page parsed before. Returns the parsed page
+    and whether it changed.
+    """
+    entry = pages.get(url)
+    page: Optional[Page] = entry[0] if entry is not None else None
+    r = await client.get(url, error, headers=get_validators(page))
+
+    if r.status_code == httpx.codes.NOT_MODIFIED:
+        PAGES_UNCHANGED.inc(provider=provider, operation=operation, reason='not_modified')
+        return page.parsed, False
+
+    PAGE_BYTES.observe(len(r.content), provider=provider, operation=operation)
+    digest = fingerprint(extract(r.text).encode() if extract is not None else r.content)
+    changed = page is None or page.fingerprint != digest
+
+    if changed:
+        with PARSE_SECONDS.time(provider=provider, operation=operation):
+            parsed = parse(r.text)
+    else:
+        PAGES_UNCHANGED.inc(provider=provider, operation=operation, reason='fingerprint')
+        parsed = page.parsed
+
+    # the validators of the latest response are kept, also when only those changed.
+    pages.set(url, Page(r.headers.get('ETag'), r.headers.get('Last-Modified'), digest, parsed), time.time())
+    return parsed, changed
@@ -0,0 +1,79 @@
+import httpx
+import pytest
+import respx
+from fastapi import HTTPException
+
+from .metrics import PAGES_UNCHANGED, PARSE_SECONDS
+from .pages import get_parsed, get_validators, Page, pages
+
+URL = 'https://www.meesman.nl/onze-fondsen/'
+
+
+def parse(text: str) -> str:
+    if text == 'error':
+        raise HTTPException(status_code=502, detail={'message': 'Could not parse funds'})
+
+    return text.upper()
+
+
+def extract(text: str) -> str:
+    return text.split('|')[0]
+
+
+def test_get_validators():
+    assert get_validators(None) == {}
+    assert get_validators(Page(None, None, b'', None)) == {}
+    assert get_validators(Page('"v1"', None, b'', None)) == {'If-None-Match': '"v1"'}
+    assert get_validators(Page(None, 'Mon, 01 Mar 2021 00:00:00 GMT', b'', None)) == {
+        'If-Modified-Since': 'Mon, 01 Mar 2021 00:00:00 GMT'}
+
+
+@respx.mock
+def test_get_parsed_not_modified_page_is_not_parsed_again(run):
+    route = respx.get(URL).mock(side_effect=[
+        httpx.Response(200, text='funds', headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Mar 2021 00:00:00 GMT'}),
+        httpx.Response(304)])
+    unchanged = PAGES_UNCHANGED.get(provider='meesman', operation='funds', reason='not_modified')
+    parsed = PARSE_SECONDS.count(provider='meesman', operation='funds')
+
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds')) == ('FUNDS', True)
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds')) == ('FUNDS', False)
+
+    assert 'If-None-Match' not in route.calls[0].request.headers
+    assert route.calls[1].request.headers['If-None-Match'] == '"v1"'
+    assert route.calls[1].request.headers['If-Modified-Since'] == 'Mon, 01 Mar 2021 00:00:00 GMT'
+    assert PAGES_UNCHANGED.get(provider='meesman', operation='funds', reason='not_modified') == unchanged + 1
+    assert PARSE_SECONDS.count(provider='meesman', operation='funds') == parsed + 1
+
+
+@respx.mock
+def test_get_parsed_page_with_same_fingerprint_is_not_parsed_again(run):
+    respx.get(URL).mock(side_effect=[httpx.Response(200, text='funds|1'), httpx.Response(200, text='funds|2'),
+                                     httpx.Response(200, text='other|2')])
+    unchanged = PAGES_UNCHANGED.get(provider='meesman', operation='funds', reason='fingerprint')
+
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds', extract)) == ('FUNDS|1', True)
+    # only the extracted part of the page counts.
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds', extract)) == ('FUNDS|1', False)
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds', extract)) == ('OTHER|2', True)
+
+    assert PAGES_UNCHANGED.get(provider='meesman', operation='funds', reason='fingerprint') == unchanged + 1
+
+
+@respx.mock
+def test_get_parsed_fingerprints_whole_page_without_extract(run):
+    respx.get(URL).mock(side_effect=[httpx.Response(200, text='funds|1'), httpx.Response(200, text='funds|2')])
+
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds')) == ('FUNDS|1', True)
+    assert run(get_parsed(URL, 'error', parse, 'meesman', 'funds')) == ('FUNDS|2', True)
+
+
+@respx.mock
+def test_get_parsed_unparsable_page_is_not_kept(run):
+    respx.get(URL).mock(side_effect=[httpx.Response(200, text='error'), httpx.Response(200, text='error')])
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            run(get_parsed(URL, 'error', parse, 'meesman', 'funds'))
+
+    assert pages.get(URL) is None
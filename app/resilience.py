@@ -0,0 +1,62 @@
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+
+T = TypeVar('T')
+
+# set when the current request is answered with a last known value, because the upstream failed.
+served_stale: ContextVar[bool] = ContextVar('served_stale', default=False)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream is down. After threshold failures in a row the circuit opens and calls are refused for
+    reset_timeout seconds. Then a single trial call is let through, which closes the circuit when it succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, timer: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.failures = 0
+        self.opened: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.opened is None:
+            return True
+
+        if self.timer() - self.opened < self.reset_timeout:
+            return False
+
+        # half open, the calls after the trial wait for another reset timeout.
+        self.opened = self.timer()
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+
+    def failure(self):
+        self.failures += 1
+
+        if self.failures >= self.threshold:
+            self.opened = self.timer()
+
+
+async def with_fallback(call: Awaitable[T], last_known: Callable[[], Optional[T]]) -> T:
+    """
+    Awaits the call. When it fails with an HTTPException, the last known value is returned instead and the response is
+    marked as stale. Without a last known value the exception is raised.
+    """
+    try:
+        return await call
+    except HTTPException:
+        value = last_known()
+
+        if value is None:
+            raise
+
+        served_stale.set(True)
+        return value
@@ -0,0 +1,80 @@
+import pytest
+from fastapi import HTTPException
+
+from .resilience import CircuitBreaker, served_stale, with_fallback
+
+
+def test_circuit_breaker_opens_after_threshold_failures():
+    now = [1000.0]
+    breaker = CircuitBreaker(3, 60, lambda: now[0])
+
+    breaker.failure()
+    breaker.failure()
+    assert breaker.allow()
+
+    breaker.failure()
+    assert not breaker.allow()
+
+    now[0] += 59
+    assert not breaker.allow()
+
+
+def test_circuit_breaker_success_resets_failures():
+    breaker = CircuitBreaker(2, 60)
+
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+
+    assert breaker.allow()
+
+
+def test_circuit_breaker_lets_single_trial_through_after_reset_timeout():
+    now = [1000.0]
+    breaker = CircuitBreaker(1, 60, lambda: now[0])
+    breaker.failure()
+
+    now[0] += 60
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # the trial failed, the circuit stays open for another reset timeout.
+    breaker.failure()
+    now[0] += 30
+    assert not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def fail():
+    async def call():
+        raise HTTPException(status_code=502, detail={'message': 'error'})
+
+    return call()
+
+
+def test_with_fallback_returns_result_of_call(run):
+    async def call():
+        return 'fresh'
+
+    async def main():
+        return await with_fallback(call(), lambda: 'last'), served_stale.get()
+
+    assert run(main()) == ('fresh', False)
+
+
+def test_with_fallback_returns_last_known_value_and_marks_stale(run):
+    async def main():
+        return await with_fallback(fail(), lambda: 'last'), served_stale.get()
+
+    assert run(main()) == ('last', True)
+    assert not served_stale.get()
+
+
+def test_with_fallback_without_last_known_value_raises(run):
+    with pytest.raises(HTTPException):
+        run(with_fallback(fail(), lambda: None))
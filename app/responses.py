@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from importlib import import_module
+from importlib.util import find_spec
+from typing import Callable, Dict, List, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from app import config
+from app.cache import MemoryBackend, budget, freshness
+from app.metrics import COMPRESSED_BYTES, ENCODED_LOOKUPS, RESPONSE_BYTES, SERIALIZE_SECONDS
+from app.resilience import served_stale
+from app.series import Format, QuoteSeries
+
+MEDIA_TYPES = {
+    Format.json: 'application/json',
+    Format.csv: 'text/csv',
+    Format.ndjson: 'application/x-ndjson',
+}
+
+# tells that the upstream failed and the last known quotes are served.
+STALE_WARNING = '110 - "Response is Stale"'
+
+# brotli is optional, when it is installed it is preferred over gzip by clients that accept both.
+brotli = import_module('brotli') if find_spec('brotli') else None
+
+IDENTITY = 'identity'
+
+# encoded JSON responses by etag, with their compressed bodies by content coding. The etag is derived from the content
+# so entries never go stale.
+encoded = MemoryBackend(config.RESPONSE_CACHE_MAXSIZE, budget, 'responses')
+
+
+def get_encodings() -> List[str]:
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=config.BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+
+    return gzip.compress(body, config.GZIP_LEVEL, mtime=0)
+
+
+def negotiate(request: Request) -> Optional[str]:
+    """
+    Returns the supported content coding the client prefers according to its Accept-Encoding, if any.
+    """
+    accepted: Dict[str, float] = {}
+
+    for item in request.headers.get('accept-encoding', '').split(','):
+        coding, _, parameters = item.partition(';')
+        name, _, value = parameters.partition('=')
+
+        try:
+            accepted[coding.strip().lower()] = float(value) if name.strip() == 'q' else 1.0
+        except ValueError:
+            accepted[coding.strip().lower()] = 0.0
+
+    weights = {encoding: accepted.get(encoding, accepted.get('*', 0.0)) for encoding in get_encodings()}
+    # on equal weights the first, best compressing, encoding wins.
+    encoding = max(weights, key=weights.get)
+    return encoding if weights[encoding] > 0 else None
+
+
+def get_etag(series: QuoteSeries, format: Format = Format.json) -> str:
+    digest = hashlib.blake2b(series.dates.tobytes(), digest_size=16)
+    digest.update(series.closes.tobytes())
+    digest.update(format.value.encode())
+    return '"{0}"'.format(digest.hexdigest())
+
+
+def get_cache_control(remaining: Optional[float] = None, stale: bool = False) -> str:
+    """
+    Lets clients and shared caches keep a response for as long as the cache entries it was built from are fresh, and
+    serve it stale for as long as this service would. Without remaining seconds the entries were just retrieved.
+    """
+    max_age = 0 if stale else round(config.CACHE_TTL if remaining is None else remaining)
+
+    return 'public, max-age={0}, s-maxage={1}, stale-while-revalidate={2}, stale-if-error={3}'.format(
+        min(max_age, config.CACHE_CONTROL_MAX_AGE), max_age, int(max(config.CACHE_HARD_TTL - config.CACHE_TTL, 0)),
+        int(config.CACHE_HARD_TTL))
+
+
+def get_encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    return etag if encoding is None else '{0}-{1}"'.format(etag[:-1], encoding)
+
+
+def strip_encoding(tag: str) -> str:
+    for encoding in get_encodings():
+        suffix = '-{0}"'.format(encoding)
+
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+
+    return tag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[int]) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+
+    # when both are sent, If-None-Match takes precedence over If-Modified-Since.
+    if if_none_match is not None:
+        # the tag of any compressed body matches the uncompressed body, the content is the same.
+        tags = [strip_encoding(tag.strip()) for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def get_bodies(etag: str, encode: Callable[[], bytes]) -> Dict[str, bytes]:
+    """
+    Returns the bodies of the etag by content coding, the JSON body is encoded on the first request for the etag.
+    """
+    entry = encoded.get(etag)
+    ENCODED_LOOKUPS.inc(result='miss' if entry is None else 'hit')
+
+    if entry is not None:
+        return entry[0]
+
+    with SERIALIZE_SECONDS.time():
+        bodies = {IDENTITY: encode()}
+
+    RESPONSE_BYTES.observe(len(bodies[IDENTITY]))
+    encoded.set(etag, bodies, 0)
+    return bodies
+
+
+def encoded_response(request: Request, etag: str, encode: Callable[[], bytes], headers: Dict[str, str],
+                     last_modified: Optional[int] = None) -> Response:
+    """
+    Responds with the JSON body of the etag, encoded once and compressed once per content coding the clients accept.
+    Conditional requests for an unchanged body are answered with 304 Not Modified.
+    """
+    bodies = get_bodies(etag, encode)
+    encoding = negotiate(request) if len(bodies[IDENTITY]) >= config.COMPRESSION_MIN_SIZE else None
+
+    if encoding is not None and encoding not in bodies:
+        bodies[encoding] = compress(bodies[IDENTITY], encoding)
+        COMPRESSED_BYTES.observe(len(bodies[encoding]), encoding=encoding)
+        encoded.set(etag, bodies, 0)
+
+    headers = dict(headers, ETag=get_encoded_etag(etag, encoding), Vary='Accept-Encoding')
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=bodies[encoding or IDENTITY], media_type=MEDIA_TYPES[Format.json], headers=headers)
+
+
+def get_body_etag(body: bytes) -> str:
+    return '"{0}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def names_response(request: Request, names: List[str]) -> Response:
+    body = json.dumps(names, ensure_ascii=False, separators=(',', ':')).encode()
+    return encoded_response(request, get_body_etag(body), lambda: body,
+                            {'Cache-Control': get_cache_control(freshness.get(), served_stale.get())})
+
+
+def series_response(request: Request, series: QuoteSeries, format: Format = Format.json) -> Response:
+    """
+    Responds with the series in the requested format. JSON is cached by etag and compressed, CSV and NDJSON are
+    streamed in chunks. Conditional requests for an unchanged series are answered with 304 Not Modified.
+    """
+    etag = get_etag(series, format)
+    # the series is ordered by date, but pages of Brand New Day are ordered latest first.
+    last_modified = max(series.dates[0], series.dates[-1]) if len(series) else None
+
+    headers = {'Cache-Control': get_cache_control(freshness.get(), served_stale.get())}
+    if last_modified is not None:
+        headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    if served_stale.get():
+        headers['Warning'] = STALE_WARNING
+
+    if format is Format.json:
+        return encoded_response(request, etag, series.to_json, headers, last_modified)
+
+    headers['ETag'] = etag
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(series.iter_csv() if format is Format.csv else series.iter_ndjson(),
+                             media_type=MEDIA_TYPES[format], headers=headers)
@@ -0,0 +1,283 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from starlette.requests import Request
+
+from . import config, responses
+from .cache import freshness
+from .resilience import served_stale
+from .responses import (STALE_WARNING, encoded, get_cache_control, get_etag, names_response, negotiate,
+                        series_response)
+from .series import Format, QuoteSeries
+
+series = QuoteSeries.from_pairs([
+    (datetime(2021, 3, 24), 21.36),
+    (datetime(2021, 3, 25), 64.25),
+])
+
+history = QuoteSeries.from_pairs([(datetime(2021, 1, 1) + timedelta(days=i), 10 + i / 100) for i in range(100)])
+
+fake_brotli = SimpleNamespace(MODE_TEXT=1, compress=lambda body, quality, mode: b'br:' + body)
+
+
+@pytest.fixture(autouse=True)
+def clear_encoded():
+    encoded.clear()
+    yield
+
+
+def create_request(**headers) -> Request:
+    return Request({
+        'type': 'http',
+        'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_series_response_returns_json_with_validators():
+    response = series_response(create_request(), series)
+
+    assert response.status_code == 200
+    assert response.media_type == 'application/json'
+    assert response.body == series.to_json()
+    assert response.headers['etag'] == get_etag(series)
+    assert response.headers['last-modified'] == 'Thu, 25 Mar 2021 00:00:00 GMT'
+
+
+def test_series_response_reuses_encoded_body():
+    series_response(create_request(), series)
+    encoded.set(get_etag(series), {'identity': b'cached'}, 0)
+
+    assert series_response(create_request(), series).body == b'cached'
+
+
+def test_series_response_uses_latest_date_for_reversed_series():
+    response = series_response(create_request(), series[::-1])
+
+    assert response.headers['last-modified'] == 'Thu, 25 Mar 2021 00:00:00 GMT'
+    assert response.headers['etag'] != get_etag(series)
+
+
+def test_series_response_without_quotes_has_no_last_modified():
+    response = series_response(create_request(), QuoteSeries.from_pairs([]))
+
+    assert response.body == b'[]'
+    assert 'last-modified' not in response.headers
+
+
+def test_get_etag_changes_with_content():
+    changed = QuoteSeries.from_pairs([(datetime(2021, 3, 24), 21.36), (datetime(2021, 3, 25), 64.26)])
+
+    assert get_etag(series) == get_etag(QuoteSeries.from_quotes(list(series)))
+    assert get_etag(series) != get_etag(changed)
+
+
+@pytest.mark.parametrize('if_none_match', [
+    '*',
+    '"other", {etag}',
+    'W/{etag}',
+])
+def test_series_response_not_modified_when_etag_matches(if_none_match):
+    request = create_request(if_none_match=if_none_match.format(etag=get_etag(series)))
+    response = series_response(request, series)
+
+    assert response.status_code == 304
+    assert response.body == b''
+    assert response.headers['etag'] == get_etag(series)
+
+
+def test_series_response_modified_when_etag_differs():
+    request = create_request(if_none_match='"other"', if_modified_since='Fri, 26 Mar 2021 00:00:00 GMT')
+
+    assert series_response(request, series).status_code == 200
+
+
+@pytest.mark.parametrize('if_modified_since, status_code', [
+    ('Thu, 25 Mar 2021 00:00:00 GMT', 304),
+    ('Fri, 26 Mar 2021 00:00:00 GMT', 304),
+    ('Wed, 24 Mar 2021 00:00:00 GMT', 200),
+    ('not a date', 200),
+])
+def test_series_response_honours_if_modified_since(if_modified_since, status_code):
+    request = create_request(if_modified_since=if_modified_since)
+
+    assert series_response(request, series).status_code == status_code
+
+
+def test_series_response_without_quotes_ignores_if_modified_since():
+    request = create_request(if_modified_since='Thu, 25 Mar 2021 00:00:00 GMT')
+
+    assert series_response(request, QuoteSeries.from_pairs([])).status_code == 200
+
+
+@pytest.mark.parametrize('format, media_type', [
+    (Format.csv, 'text/csv; charset=utf-8'),
+    (Format.ndjson, 'application/x-ndjson'),
+])
+def test_series_response_streams_other_formats(run, format, media_type):
+    response = series_response(create_request(), series, format)
+
+    async def read():
+        return b''.join([chunk async for chunk in response.body_iterator])
+
+    body = run(read())
+
+    assert response.headers['content-type'] == media_type
+    assert response.headers['etag'] == get_etag(series, format)
+    assert body == b''.join(series.iter_csv() if format is Format.csv else series.iter_ndjson())
+    assert encoded.get(get_etag(series, format)) is None
+
+
+def test_get_etag_differs_per_format():
+    assert len({get_etag(series, format) for format in Format}) == len(Format)
+
+
+def test_series_response_not_modified_for_other_formats():
+    request = create_request(if_none_match=get_etag(series, Format.csv))
+
+    assert series_response(request, series, Format.csv).status_code == 304
+    assert series_response(request, series, Format.ndjson).status_code == 200
+
+
+def test_series_response_warns_when_served_stale():
+    assert 'warning' not in series_response(create_request(), series).headers
+
+    token = served_stale.set(True)
+    try:
+        response = series_response(create_request(), series)
+    finally:
+        served_stale.reset(token)
+
+    assert response.headers['warning'] == STALE_WARNING
+
+
+@pytest.mark.parametrize('accept_encoding, brotli, encoding', [
+    ('gzip, deflate', None, 'gzip'),
+    ('GZIP', None, 'gzip'),
+    ('*', None, 'gzip'),
+    ('deflate', None, None),
+    ('gzip;q=0', None, None),
+    ('gzip;q=high', None, None),
+    ('*, gzip;q=0', None, None),
+    ('gzip, deflate, br', None, 'gzip'),
+    ('gzip, deflate, br', fake_brotli, 'br'),
+    ('gzip, br;q=0.5', fake_brotli, 'gzip'),
+    ('*', fake_brotli, 'br'),
+])
+def test_negotiate_prefers_best_accepted_encoding(monkeypatch, accept_encoding, brotli, encoding):
+    monkeypatch.setattr(responses, 'brotli', brotli)
+
+    assert negotiate(create_request(accept_encoding=accept_encoding)) == encoding
+
+
+def test_negotiate_without_accept_encoding():
+    assert negotiate(create_request()) is None
+
+
+def test_series_response_compresses_once(monkeypatch):
+    calls = []
+    compress = responses.compress
+    monkeypatch.setattr(responses, 'compress', lambda body, encoding: calls.append(encoding) or compress(body, encoding))
+
+    first = series_response(create_request(accept_encoding='gzip'), history)
+    second = series_response(create_request(accept_encoding='gzip'), history)
+
+    assert calls == ['gzip']
+    assert first.body == second.body
+    assert gzip.decompress(first.body) == history.to_json()
+    assert len(first.body) < len(history.to_json()) / 3
+    assert first.headers['content-encoding'] == 'gzip'
+    assert first.headers['vary'] == 'Accept-Encoding'
+    assert first.headers['etag'] == get_etag(history)[:-1] + '-gzip"'
+
+
+def test_series_response_compresses_with_brotli(monkeypatch):
+    monkeypatch.setattr(responses, 'brotli', fake_brotli)
+    response = series_response(create_request(accept_encoding='gzip, br'), history)
+
+    assert response.body == b'br:' + history.to_json()
+    assert response.headers['content-encoding'] == 'br'
+    assert encoded.get(get_etag(history))[0].keys() == {'identity', 'br'}
+
+
+def test_series_response_does_not_compress_small_bodies():
+    response = series_response(create_request(accept_encoding='gzip'), series)
+
+    assert response.body == series.to_json()
+    assert 'content-encoding' not in response.headers
+    assert response.headers['vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+def test_series_response_not_modified_for_etag_of_any_encoding(accept_encoding):
+    request = create_request(accept_encoding=accept_encoding, if_none_match=get_etag(history)[:-1] + '-gzip"')
+
+    assert series_response(request, history).status_code == 304
+
+
+def test_names_response_returns_json_with_etag():
+    names = ['aandelen-wereldwijd-totaal', 'zwitserleven-variabele-rente']
+    response = names_response(create_request(), names)
+
+    assert response.status_code == 200
+    assert json.loads(response.body) == names
+
+    request = create_request(if_none_match=response.headers['etag'])
+    assert names_response(request, names).status_code == 304
+    assert names_response(request, names[:1]).status_code == 200
+
+
+def test_names_response_compresses_long_lists():
+    names = ['fund-{0}'.format(i) for i in range(100)]
+    response = names_response(create_request(accept_encoding='gzip'), names)
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.body)) == names
+
+
+@pytest.fixture
+def ttl(monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_TTL', 3600)
+    monkeypatch.setattr(config, 'CACHE_HARD_TTL', 86400)
+    monkeypatch.setattr(config, 'CACHE_CONTROL_MAX_AGE', 600)
+
+
+@pytest.mark.parametrize('remaining, stale, cache_control', [
+    (None, False, 'public, max-age=600, s-maxage=3600, stale-while-revalidate=82800, stale-if-error=86400'),
+    (1800.5, False, 'public, max-age=600, s-maxage=1800, stale-while-revalidate=82800, stale-if-error=86400'),
+    (300, False, 'public, max-age=300, s-maxage=300, stale-while-revalidate=82800, stale-if-error=86400'),
+    (0, False, 'public, max-age=0, s-maxage=0, stale-while-revalidate=82800, stale-if-error=86400'),
+    (1800, True, 'public, max-age=0, s-maxage=0, stale-while-revalidate=82800, stale-if-error=86400'),
+])
+def test_get_cache_control_follows_remaining_ttl(ttl, remaining, stale, cache_control):
+    assert get_cache_control(remaining, stale) == cache_control
+
+
+@pytest.mark.parametrize('format', list(Format))
+def test_series_response_is_cacheable_while_fresh(ttl, format):
+    freshness.set(120)
+    response = series_response(create_request(), series, format)
+
+    assert response.headers['cache-control'] == get_cache_control(120)
+
+    request = create_request(if_none_match=response.headers['etag'])
+    assert series_response(request, series, format).headers['cache-control'] == get_cache_control(120)
+
+
+def test_series_response_served_stale_is_not_fresh(ttl):
+    token = served_stale.set(True)
+    try:
+        response = series_response(create_request(), series)
+    finally:
+        served_stale.reset(token)
+
+    assert response.headers['cache-control'] == get_cache_control(stale=True)
+
+
+def test_names_response_is_cacheable_while_fresh(ttl):
+    assert names_response(create_request(), ['fund']).headers['cache-control'] == get_cache_control()
+
+    freshness.set(60)
+    assert names_response(create_request(), ['fund']).headers['cache-control'] == get_cache_control(60)
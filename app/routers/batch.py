@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from app import config
+from app.cache import freshness
+from app.models import FundQuotes
+from app.routers import brandnewday, meesman, zwitserleven
+from app.resilience import served_stale
+from app.responses import IDENTITY, MEDIA_TYPES, encoded_response, get_bodies, get_body_etag, get_cache_control, \
+    get_etag
+from app.series import Format, QuoteQuery, QuoteSeries
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix='/batch',
+    tags=['Batch']
+)
+
+FUND_DESCRIPTION = 'Fund as provider/fund, for example meesman/aandelen-wereldwijd-totaal'
+
+providers: Dict[str, Callable[[str], Awaitable[QuoteSeries]]] = {
+    'brandnewday': brandnewday.find_series,
+    'meesman': meesman.find_series,
+    'zwitserleven': zwitserleven.find_series,
+}
+
+
+@router.get(
+    "/",
+    response_model=List[FundQuotes],
+    summary="Delivers quotes for several funds of any provider at once",
+)
+async def get_quotes(request: Request, fund: List[str] = Query(..., description=FUND_DESCRIPTION),
+                     query: QuoteQuery = Depends()) -> Response:
+    """
+    Delivers the quotes of every fund, oldest first. A fund that could not be found or retrieved gets a status and
+    message instead of quotes, without failing the other funds. With format=ndjson every fund is a line, streamed as
+    soon as the fund and those before it are resolved.
+    """
+    if query.format is Format.csv:
+        raise HTTPException(status_code=400, detail={'message': 'Format csv is not supported for several funds'})
+
+    semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+    # the freshness of every fund with quotes, each fund is resolved in a task of its own.
+    states: List[Tuple[Optional[float], bool]] = []
+
+    async def resolve(fund_id: str) -> bytes:
+        async with semaphore:
+            try:
+                series = query.apply(await find_series(fund_id))
+            except HTTPException as e:
+                return error(fund_id, e.status_code, e.detail['message'] if isinstance(e.detail, dict) else e.detail)
+            except Exception:
+                # any other failure, like a page that could not be parsed, also only fails this fund.
+                logger.exception('Retrieving %s failed', fund_id)
+                return error(fund_id, 502, 'Could not retrieve quotes')
+
+        states.append((freshness.get(), served_stale.get()))
+        stale = b'"stale":true,' if served_stale.get() else b''
+        # the quotes of a fund are encoded once, like those of the fund on its own.
+        quotes = get_bodies(get_etag(series), series.to_json)[IDENTITY]
+        return b'{"fund":%s,"status":200,%s"quotes":%s}' % (json.dumps(fund_id).encode(), stale, quotes)
+
+    # funds requested more than once are resolved once.
+    results = {f: asyncio.ensure_future(resolve(f)) for f in dict.fromkeys(fund)}
+
+    if query.format is Format.ndjson:
+        async def lines() -> AsyncIterator[bytes]:
+            for f in fund:
+                yield await results[f] + b'\n'
+
+        return StreamingResponse(lines(), media_type=MEDIA_TYPES[Format.ndjson])
+
+    await asyncio.gather(*results.values())
+
+    # the response is as fresh as the least fresh fund, funds that failed are not cached at all.
+    remaining = [state[0] for state in states if state[0] is not None]
+    headers = {} if len(states) < len(results) else {'Cache-Control': get_cache_control(
+        min(remaining) if remaining else None, any(state[1] for state in states))}
+
+    body = b'[' + b','.join(results[f].result() for f in fund) + b']'
+    return encoded_response(request, get_body_etag(body), lambda: body, headers)
+
+
+def error(fund_id: str, status: int, message: str) -> bytes:
+    return b'{"fund":%s,"status":%d,"message":%s}' % (json.dumps(fund_id).encode(), status, json.dumps(message).encode())
+
+
+async def find_series(fund_id: str) -> QuoteSeries:
+    provider, _, fund_name = fund_id.partition('/')
+
+    if provider not in providers:
+        raise HTTPException(status_code=404, detail={'message': 'Provider {0} could not be found'.format(provider)})
+
+    return await providers[provider](fund_name)
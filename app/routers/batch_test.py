@@ -0,0 +1,247 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+from fastapi.testclient import TestClient
+
+from . import batch, brandnewday, meesman, zwitserleven
+from ..main import app
+from ..responses import encoded, get_cache_control
+from ..series import QuoteSeries
+
+client = TestClient(app)
+
+prefix = '/batch/'
+
+MEESMAN_FUND = 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/'
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    for module in (brandnewday, meesman):
+        module.registry.clear()
+        module.quote_cache.clear()
+        module.store.clear()
+    zwitserleven.registry.clear()
+    zwitserleven.quote_cache.clear()
+    zwitserleven.store.clear()
+    encoded.clear()
+    yield
+
+
+def setup_meesman_response():
+    funds = '<td class="fund-name"><a href="/onze-fondsen/aandelen-wereldwijd-totaal/">Totaal</a></td>'
+    respx.get(meesman.BASE_URL).mock(return_value=httpx.Response(200, text=funds))
+
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}," \
+           "{\"x\":\"2021-01-02T00:00:00\",\"y\":10.50}]"
+    return respx.get(MEESMAN_FUND).mock(return_value=httpx.Response(200, text=body))
+
+
+def setup_zwitserleven_response():
+    body = '''<tr class="showFonds" id="317">
+<td><a href="https://www.zwitserleven.nl/">Zwitserleven Variabele Rente</a></td>
+<td class="koers">21,36</td><td class="koers">24-03-2021</td>
+</tr>'''
+    respx.get(zwitserleven.FUNDS_URL).mock(return_value=httpx.Response(200, text=body))
+
+
+@respx.mock
+def test_get_quotes_returns_quotes_of_every_fund():
+    setup_meesman_response()
+    setup_zwitserleven_response()
+
+    response = client.get(prefix, params={'fund': ['meesman/aandelen-wereldwijd-totaal',
+                                                   'zwitserleven/zwitserleven-variabele-rente']})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {'fund': 'meesman/aandelen-wereldwijd-totaal', 'status': 200,
+         'quotes': [{'Date': '2021-01-01T00:00:00', 'Close': 10.0}, {'Date': '2021-01-02T00:00:00', 'Close': 10.5}]},
+        {'fund': 'zwitserleven/zwitserleven-variabele-rente', 'status': 200,
+         'quotes': [{'Date': '2021-03-24T00:00:00', 'Close': 21.36}]},
+    ]
+    assert response.headers['cache-control'] == get_cache_control()
+
+
+@respx.mock
+def test_get_quotes_is_as_fresh_as_least_fresh_fund(monkeypatch):
+    setup_meesman_response()
+    setup_zwitserleven_response()
+    params = {'fund': ['meesman/aandelen-wereldwijd-totaal', 'zwitserleven/zwitserleven-variabele-rente']}
+    client.get(prefix, params=params)
+
+    now = [meesman.quote_cache.backend.created('aandelen-wereldwijd-totaal') + 100]
+    monkeypatch.setattr(meesman.quote_cache, 'timer', lambda: now[0])
+    monkeypatch.setattr(meesman.registry.cache, 'timer', lambda: now[0])
+
+    response = client.get(prefix, params=params)
+
+    assert response.headers['cache-control'] == get_cache_control(meesman.quote_cache.ttl - 100)
+
+
+@respx.mock
+def test_get_quotes_applies_query():
+    setup_meesman_response()
+
+    response = client.get(prefix, params={'fund': 'meesman/aandelen-wereldwijd-totaal', 'latest': 'true'})
+
+    assert response.json() == [{'fund': 'meesman/aandelen-wereldwijd-totaal', 'status': 200,
+                                'quotes': [{'Date': '2021-01-02T00:00:00', 'Close': 10.5}]}]
+
+
+@respx.mock
+def test_get_quotes_reports_errors_per_fund():
+    setup_meesman_response()
+    respx.get(brandnewday.BASE_URL.format('getfundsnew')).mock(return_value=httpx.Response(500, text='error'))
+
+    response = client.get(prefix, params={'fund': ['unknown/fund',
+                                                   'meesman/unknown',
+                                                   'brandnewday/bnd-wereld-indexfonds-c-hedged',
+                                                   'meesman/aandelen-wereldwijd-totaal']})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {'fund': 'unknown/fund', 'status': 404, 'message': 'Provider unknown could not be found'},
+        {'fund': 'meesman/unknown', 'status': 404, 'message': 'Fund unknown could not be found'},
+        {'fund': 'brandnewday/bnd-wereld-indexfonds-c-hedged', 'status': 502, 'message': 'Could not retrieve funds'},
+        {'fund': 'meesman/aandelen-wereldwijd-totaal', 'status': 200,
+         'quotes': [{'Date': '2021-01-01T00:00:00', 'Close': 10.0}, {'Date': '2021-01-02T00:00:00', 'Close': 10.5}]},
+    ]
+    # a response with failed funds is not cached, the next request retries them.
+    assert 'cache-control' not in response.headers
+
+
+@respx.mock
+def test_get_quotes_reports_unknown_fund_of_provider():
+    body = {'Message': json.dumps([{"Key": "1002", "Value": "bnd-wereld-indexfonds-c-hedged"}])}
+    respx.get(brandnewday.BASE_URL.format('getfundsnew')).mock(return_value=httpx.Response(200, json=body))
+
+    response = client.get(prefix, params={'fund': 'brandnewday/unknown'})
+
+    assert response.json() == [{'fund': 'brandnewday/unknown', 'status': 404,
+                                'message': 'Fund unknown could not be found'}]
+
+
+@respx.mock
+def test_get_quotes_resolves_duplicate_funds_once():
+    route = setup_meesman_response()
+
+    response = client.get(prefix, params={'fund': ['meesman/aandelen-wereldwijd-totaal'] * 2})
+
+    assert [r['fund'] for r in response.json()] == ['meesman/aandelen-wereldwijd-totaal'] * 2
+    assert route.call_count == 1
+
+
+def test_get_quotes_requires_funds():
+    assert client.get(prefix).status_code == 422
+
+
+def test_get_quotes_bounds_concurrency(monkeypatch):
+    running = []
+    peak = []
+
+    async def find_series(fund_name):
+        running.append(fund_name)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(fund_name)
+        raise batch.HTTPException(status_code=404, detail='Fund {0} could not be found'.format(fund_name))
+
+    monkeypatch.setattr(batch.config, 'BATCH_CONCURRENCY', 2)
+    monkeypatch.setitem(batch.providers, 'meesman', find_series)
+
+    response = client.get(prefix, params={'fund': ['meesman/{0}'.format(i) for i in range(5)]})
+
+    assert len(response.json()) == 5
+    assert max(peak) == 2
+
+
+@respx.mock
+def test_get_quotes_as_ndjson():
+    setup_meesman_response()
+
+    response = client.get(prefix, params={'fund': ['meesman/aandelen-wereldwijd-totaal', 'unknown/fund'],
+                                          'format': 'ndjson', 'latest': 'true'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert response.text.splitlines() == [
+        '{"fund":"meesman/aandelen-wereldwijd-totaal","status":200,'
+        '"quotes":[{"Date":"2021-01-02T00:00:00","Close":10.5}]}',
+        '{"fund":"unknown/fund","status":404,"message":"Provider unknown could not be found"}',
+    ]
+
+
+@respx.mock
+@pytest.mark.parametrize('format', ['json', 'ndjson'])
+def test_get_quotes_malformed_fund_fails_only_that_fund(format):
+    setup_meesman_response()
+    respx.get(meesman.BASE_URL).mock(return_value=httpx.Response(200, text=(
+        '<td class="fund-name"><a href="/onze-fondsen/aandelen-wereldwijd-totaal/">Totaal</a></td>'
+        '<td class="fund-name"><a href="/onze-fondsen/malformed/">Malformed</a></td>')))
+    respx.get(meesman.QUOTE_URL.format('malformed')).mock(
+        return_value=httpx.Response(200, text='data: [{"x":"01-01-2021","y":10}]'))
+
+    response = client.get(prefix, params={'fund': ['meesman/malformed', 'meesman/aandelen-wereldwijd-totaal'],
+                                          'format': format, 'latest': 'true'})
+
+    assert response.status_code == 200
+    assert 'cache-control' not in response.headers
+    funds = [json.loads(line) for line in response.text.splitlines()] if format == 'ndjson' else response.json()
+    assert funds == [
+        {'fund': 'meesman/malformed', 'status': 502, 'message': 'Could not retrieve quotes'},
+        {'fund': 'meesman/aandelen-wereldwijd-totaal', 'status': 200,
+         'quotes': [{'Date': '2021-01-02T00:00:00', 'Close': 10.5}]},
+    ]
+
+
+@respx.mock
+def test_get_quotes_encodes_quotes_and_response_once(monkeypatch):
+    setup_meesman_response()
+    setup_zwitserleven_response()
+    params = {'fund': ['meesman/aandelen-wereldwijd-totaal', 'zwitserleven/zwitserleven-variabele-rente']}
+    encodings = []
+    to_json = QuoteSeries.to_json
+    monkeypatch.setattr(QuoteSeries, 'to_json', lambda self: encodings.append(1) or to_json(self))
+    monkeypatch.setattr(batch.config, 'COMPRESSION_MIN_SIZE', 0)
+
+    first = client.get(prefix, params=params, headers={'Accept-Encoding': 'gzip'})
+    # the quotes of a fund on its own are the same encoded quotes.
+    client.get('/meesman/aandelen-wereldwijd-totaal')
+    second = client.get(prefix, params=params, headers={'Accept-Encoding': 'gzip'})
+
+    assert len(encodings) == 2
+    assert second.headers['content-encoding'] == 'gzip'
+    assert second.headers['etag'] == first.headers['etag']
+    assert second.json() == first.json()
+
+    response = client.get(prefix, params=params, headers={'If-None-Match': first.headers['etag']})
+    assert response.status_code == 304
+
+
+def test_get_quotes_as_csv_returns_http400():
+    response = client.get(prefix, params={'fund': 'meesman/aandelen-wereldwijd-totaal', 'format': 'csv'})
+
+    assert response.status_code == 400
+
+
+@respx.mock
+def test_get_quotes_marks_stale_funds():
+    setup_meesman_response()
+    setup_zwitserleven_response()
+    respx.get(MEESMAN_FUND).mock(return_value=httpx.Response(500, text='error'))
+    meesman.store.add('aandelen-wereldwijd-totaal', meesman.QuoteSeries.from_pairs([(1609372800, 9.5)]))
+
+    response = client.get(prefix, params={'fund': ['meesman/aandelen-wereldwijd-totaal',
+                                                   'zwitserleven/zwitserleven-variabele-rente']})
+
+    assert response.json() == [
+        {'fund': 'meesman/aandelen-wereldwijd-totaal', 'status': 200, 'stale': True,
+         'quotes': [{'Date': '2020-12-31T00:00:00', 'Close': 9.5}]},
+        {'fund': 'zwitserleven/zwitserleven-variabele-rente', 'status': 200,
+         'quotes': [{'Date': '2021-03-24T00:00:00', 'Close': 21.36}]},
+    ]
+    assert response.headers['cache-control'] == get_cache_control(stale=True)
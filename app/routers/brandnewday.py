@@ -1,13 +1,24 @@
+import asyncio
 import json
+import math
 import re
-from datetime import date, datetime
-from typing import List, Optional
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
 
-import requests
-from cachetools import TTLCache
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
 
+from app import client, config
+from app.cache import create_cache
+from app.funds import FundRegistry
+from app.metrics import FETCH_SECONDS, parsing, timed
 from app.models import Fund, Quote, Message
+from app.resilience import with_fallback
+from app.responses import names_response, series_response
+from app.series import QuoteQuery, QuoteSeries
+from app.singleflight import SingleFlight
+from app.store import create_store
 
 router = APIRouter(
     prefix='/brandnewday',
@@ -16,8 +27,15 @@ router = APIRouter(
 
 BASE_URL = 'https://secure.brandnewday.nl/service/{0}/'
 QUOTE_REGEX = r'\/Date\(([0-9]+)\)\/'
-funds_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
-quote_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
+PAGE_SIZE = 60
+START_DATE = date(2010, 1, 1)
+
+registry = FundRegistry('brandnewday.funds', lambda: fetch_funds(), lambda fund: quote_cache.pop(fund.id, None))
+quote_cache = create_cache('brandnewday.quotes')
+store = create_store('brandnewday')
+
+# concurrent cache misses share a single upstream fetch, stale entries are refreshed in the background.
+quotes_flight = SingleFlight()
 
 
 @router.get(
@@ -26,83 +44,141 @@ quote_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
     summary="Get all available funds",
     responses={502: {'description': 'When an error occurred while retrieving the funds', 'model': Message}}
 )
-async def get_funds() -> List[str]:
-    return [f.name for f in await list_funds()]
-
+async def get_funds(request: Request) -> Response:
+    return names_response(request, (await registry.funds()).names())
 
-async def list_funds() -> List[Fund]:
-    if len(funds_cache) == 0:
-        await fetch_funds()
-    return list(funds_cache.values())
 
+@timed(FETCH_SECONDS, provider='brandnewday', operation='funds')
+async def fetch_funds() -> List[Fund]:
+    r = await client.get(BASE_URL.format('getfundsnew'), 'Could not retrieve funds')
 
-async def fetch_funds():
-    r = requests.get(url=BASE_URL.format('getfundsnew'))
+    with parsing('brandnewday', 'funds', len(r.content)):
+        funds = json.loads(r.json()['Message'])
 
-    if r.status_code != requests.codes.ok:
-        raise HTTPException(status_code=502, detail={'message': 'Could not retrieve funds'})
+    return [Fund(name=str.lower(fund['Value']).replace(' ', '-'), id=fund['Key']) for fund in funds]
 
-    funds = json.loads(r.json()['Message'])
 
-    # clear the caches, there might be new funds how unlikely it might be.
-    quote_cache.clear()
-    funds_cache.clear()
+@router.get(
+    "/{fund_name}",
+    response_model=List[Quote],
+    summary="Delivers quotes for the specified fund by name",
+    responses={502: {'description': 'When an error occurred while retrieving the quotes', 'model': Message},
+               404: {'description': 'When the specified fund could not be found, or the fund is unknown',
+                     'model': Message}},
+)
+async def get_quotes(request: Request, fund_name: str, page: Optional[int] = 1, query: QuoteQuery = Depends()) -> Response:
+    fund = await registry.find(fund_name)
 
-    for fund in funds:
-        fund_name = str.lower(fund['Value']).replace(' ', '-')
-        fund_id = fund['Key']
+    if page < 1:
+        raise HTTPException(status_code=400, detail="Invalid page, must be >= 1")
 
-        funds_cache[fund_id] = Fund(name=fund_name, id=fund_id)
+    return series_response(request, get_page(query.apply(await get_series(fund.id)), page), query.format)
 
 
 @router.get(
-    "/{fund_name}",
+    "/{fund_name}/history",
     response_model=List[Quote],
-    summary="Delivers quotes for the specified fund by name",
+    summary="Delivers all quotes for the specified fund by name, oldest first",
     responses={502: {'description': 'When an error occurred while retrieving the quotes', 'model': Message},
                404: {'description': 'When the specified fund could not be found, or the fund is unknown',
                      'model': Message}},
 )
-async def get_quotes(fund_name: str, page: Optional[int] = 1) -> List[Quote]:
-    funds = await list_funds()
-    fund = next((f for f in funds if f.name == fund_name.strip().lower()), None)
+async def get_history(request: Request, fund_name: str, query: QuoteQuery = Depends()) -> Response:
+    return series_response(request, query.apply(await find_series(fund_name)), query.format)
 
-    if fund:
 
-        cache_id = get_cache_id(fund.id, page)
-        if cache_id not in quote_cache:
-            await fetch_quotes(fund.id, page)
+async def find_series(fund_name: str) -> QuoteSeries:
+    fund = await registry.find(fund_name)
+    return await get_series(fund.id)
 
-        return quote_cache[cache_id]
 
-    else:
-        raise HTTPException(status_code=404, detail="Fund {0} could not be found".format(fund_name))
+async def get_series(fund_id: str) -> QuoteSeries:
+    quotes, stale = quote_cache.lookup(fund_id)
 
+    if quotes is None:
+        # when the quotes cannot be retrieved, the quotes that were stored before are served.
+        return await with_fallback(quotes_flight.do(fund_id, lambda: fetch_quotes(fund_id)),
+                                   lambda: store.quotes(fund_id) or None)
 
-async def fetch_quotes(fund_id: str, page: int):
-    if page < 1:
-        raise HTTPException(status_code=400, detail="Invalid page, must be >= 1")
+    if stale:
+        quotes_flight.background(fund_id, lambda: fetch_quotes(fund_id))
+
+    return quotes
+
+
+def get_page(quotes: QuoteSeries, page: int) -> QuoteSeries:
+    # like Brand New Day itself, the first page holds the latest quotes and quotes are ordered latest first.
+    end = max(len(quotes) - (page - 1) * PAGE_SIZE, 0)
+    return quotes[max(end - PAGE_SIZE, 0):end][::-1]
 
-    r = requests.post(
-        url=BASE_URL.format('navvaluesforfund'),
+
+async def prefetch(fund: Fund, ahead: float):
+    """
+    Refreshes the quotes of the fund when they are missing or go stale within ahead seconds.
+    """
+    if quote_cache.is_stale(fund.id, ahead):
+        await quotes_flight.do(fund.id, lambda: fetch_quotes(fund.id))
+
+
+def get_windows(start: date, today: date) -> List[Tuple[date, date]]:
+    """
+    Splits the days from start until today in windows anchored at the first day of the current month. The quotes of
+    the closed window before this month no longer change, so its pages do not shift while they are retrieved, and once
+    stored it is not retrieved again. Only the current month gets new quotes.
+    """
+    month = today.replace(day=1)
+
+    if start >= month:
+        return [(start, today)]
+
+    return [(start, month - timedelta(days=1)), (month, today)]
+
+
+@timed(FETCH_SECONDS, provider='brandnewday', operation='quotes')
+async def fetch_quotes(fund_id: str) -> QuoteSeries:
+    # only the quotes since the last stored quote are retrieved, the rest of the history is in the store.
+    last_date = store.last_date(fund_id)
+    start_date = last_date.date() if last_date else START_DATE
+    semaphore = asyncio.Semaphore(config.BRANDNEWDAY_PAGE_CONCURRENCY)
+
+    async def fetch(window: Tuple[date, date], page: int) -> dict:
+        async with semaphore:
+            return await fetch_page(fund_id, window, page)
+
+    async def fetch_window(window: Tuple[date, date]) -> List[dict]:
+        # the first page tells how many pages there are, the other pages are retrieved concurrently.
+        first = await fetch(window, 1)
+
+        if len(first["Data"]) < PAGE_SIZE:
+            return [first]
+
+        return [first] + list(await asyncio.gather(
+            *[fetch(window, page) for page in range(2, math.ceil(first["Total"] / PAGE_SIZE) + 1)]))
+
+    windows = await asyncio.gather(*[fetch_window(window) for window in get_windows(start_date, date.today())])
+
+    # the quotes are only stored once all pages are retrieved, so the store never has gaps.
+    store.add(fund_id, QuoteSeries.from_pairs(
+        (int(re.match(QUOTE_REGEX, q["RateDate"]).group(1)) // 1000, q["LastRate"])
+        for pages in windows for page in pages for q in page["Data"]
+    ))
+
+    quotes = store.quotes(fund_id)
+    quote_cache[fund_id] = quotes
+    return quotes
+
+
+async def fetch_page(fund_id: str, window: Tuple[date, date], page: int) -> dict:
+    r = await client.post(
+        BASE_URL.format('navvaluesforfund'),
+        'Could not retrieve quotes',
         headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
         data={'page': page,
-              'pageSize': 60,
+              'pageSize': PAGE_SIZE,
               'fundId': fund_id,
-              'startDate': '01-01-2010',
-              'endDate': date.today().strftime('%d-%m-%Y'),
+              'startDate': window[0].strftime('%d-%m-%Y'),
+              'endDate': window[1].strftime('%d-%m-%Y'),
               })
 
-    if r.status_code != requests.codes.ok:
-        raise HTTPException(status_code=502, detail={'message': 'Could not retrieve quotes'})
-
-    cache_id = get_cache_id(fund_id, page)
-    quote_cache[cache_id] = [
-        Quote(Date=datetime.utcfromtimestamp(int(re.match(QUOTE_REGEX, q["RateDate"]).group(1)) / 1000),
-              Close=q["LastRate"])
-        for q in r.json()["Data"]
-    ]
-
-
-def get_cache_id(fund_id: str, page: int) -> str:
-    return '{0}@{1}'.format(fund_id, page)
+    with parsing('brandnewday', 'quotes', len(r.content)):
+        return r.json()
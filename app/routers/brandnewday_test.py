@@ -1,33 +1,78 @@
+import asyncio
+import calendar
 import json
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+from urllib.parse import parse_qsl
 
+import httpx
 import pytest
-import responses
+import respx
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
-from .brandnewday import funds_cache, quote_cache
+from . import brandnewday
+from .brandnewday import registry, quote_cache, store, get_series, quotes_flight
 from ..main import app
-from ..models import Quote
+from ..models import Fund, Quote
+from ..series import QuoteSeries
 
 client = TestClient(app)
 
 prefix = '/brandnewday/'
 
+NAVVALUES_URL = 'https://secure.brandnewday.nl/service/navvaluesforfund/'
+
+# the windows Brand New Day is asked for: the closed months and the current month.
+MONTH = date.today().replace(day=1)
+CLOSED_END = (MONTH - timedelta(days=1)).strftime('%d-%m-%Y')
+CURRENT = {'startDate': MONTH.strftime('%d-%m-%Y'), 'endDate': date.today().strftime('%d-%m-%Y')}
+
 
 @pytest.fixture(autouse=True)
 def clear_cache():
-    funds_cache.clear()
+    registry.clear()
     quote_cache.clear()
+    store.clear()
     yield
 
 
+def navvalues(rows: List[Tuple[datetime, float]]):
+    """
+    Answers like Brand New Day, with the quotes from startDate until endDate, latest first, a page at a time.
+    """
+    def answer(request: httpx.Request) -> httpx.Response:
+        form = dict(parse_qsl(request.content.decode()))
+        start, end = (datetime.strptime(form[name], '%d-%m-%Y') for name in ('startDate', 'endDate'))
+        selected = sorted((row for row in rows if start <= row[0] <= end), reverse=True)
+        size = int(form['pageSize'])
+        offset = (int(form['page']) - 1) * size
+
+        return httpx.Response(200, json={
+            'Data': [{'FundId': 1012, 'LastRate': close,
+                      'RateDate': '/Date({0})/'.format(calendar.timegm(day.timetuple()) * 1000)}
+                     for day, close in selected[offset:offset + size]],
+            'Total': len(selected)})
+
+    return answer
+
+
+def history(start: datetime, count: int) -> List[Tuple[datetime, float]]:
+    return [(start - timedelta(days=i), 10.0 + i) for i in range(count)]
+
+
+def setup_current_window_response():
+    respx.post(NAVVALUES_URL, data=dict(CURRENT, page='1', pageSize='60', fundId='1012')).mock(
+        return_value=httpx.Response(200, json={'Data': [], 'Total': 0}))
+
+
 def setup_get_funds_response():
     body = {'Message': json.dumps([{"Key": "1002", "Value": "bnd-wereld-indexfonds-c-hedged"},
                                    {"Key": "1012", "Value": "bnd-wereld-indexfonds-c-unhedged"}])}
-    responses.add(responses.GET, 'https://secure.brandnewday.nl/service/getfundsnew/', json=body, status=200)
+    respx.get('https://secure.brandnewday.nl/service/getfundsnew/').mock(return_value=httpx.Response(200, json=body))
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_funds_list():
     setup_get_funds_response()
 
@@ -37,15 +82,16 @@ def test_get_funds_returns_funds_list():
     assert response.json() == ['bnd-wereld-indexfonds-c-hedged', 'bnd-wereld-indexfonds-c-unhedged']
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_502():
-    responses.add(responses.GET, 'https://secure.brandnewday.nl/service/getfundsnew/',
-                  body='error', status=502)
+    respx.get('https://secure.brandnewday.nl/service/getfundsnew/').mock(
+        return_value=httpx.Response(502, text='error'))
     response = client.get(prefix, allow_redirects=False)
 
     assert response.status_code == 502
 
 
+@respx.mock
 def test_get_quotes_unknown_name_returns_http404():
     setup_get_funds_response()
 
@@ -53,22 +99,18 @@ def test_get_quotes_unknown_name_returns_http404():
     assert response.status_code == 404
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_server_error_returns_http502():
     setup_get_funds_response()
-    responses.add(
-        responses.POST,
-        url='https://secure.brandnewday.nl/service/navvaluesforfund/',
-        body='error',
-        status=500
-    )
+    respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        return_value=httpx.Response(500, text='error'))
 
     response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
 
     assert response.status_code == 502
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_invalid_page():
     setup_get_funds_response()
 
@@ -77,7 +119,7 @@ def test_get_quotes_invalid_page():
     assert response.status_code == 400
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_known_name_returns_http200():
     setup_get_funds_response()
 
@@ -94,21 +136,16 @@ def test_get_quotes_known_name_returns_http200():
     ],
         'Total': 1224, 'AggregateResults': None, 'Errors': None}
 
-    responses.add(
-        responses.POST,
-        url='https://secure.brandnewday.nl/service/navvaluesforfund/',
-        json=body,
-        headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
-        match=[
-            responses.urlencoded_params_matcher({'page': '1',
-                                                 'pageSize': '60',
-                                                 'fundId': '1012',
-                                                 'startDate': '01-01-2010',
-                                                 'endDate': date.today().strftime('%d-%m-%Y'),
-                                                 })
-        ],
-        status=200
-    )
+    respx.post(
+        'https://secure.brandnewday.nl/service/navvaluesforfund/',
+        data={'page': '1',
+              'pageSize': '60',
+              'fundId': '1012',
+              'startDate': '01-01-2010',
+              'endDate': CLOSED_END,
+              }
+    ).mock(return_value=httpx.Response(200, json=body))
+    setup_current_window_response()
 
     response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
 
@@ -119,7 +156,7 @@ def test_get_quotes_known_name_returns_http200():
                                {'Close': 13.535809, 'Date': '2021-03-19T00:00:00'}]
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_are_cached():
     setup_get_funds_response()
 
@@ -136,26 +173,11 @@ def test_get_quotes_are_cached():
     ],
         'Total': 1224, 'AggregateResults': None, 'Errors': None}
 
-    responses.add(
-        responses.POST,
-        url='https://secure.brandnewday.nl/service/navvaluesforfund/',
-        json=body,
-        headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
-        match=[responses.urlencoded_params_matcher(
-            {'page': '1', 'pageSize': '60', 'fundId': '1012', 'startDate': '01-01-2010',
-             'endDate': date.today().strftime('%d-%m-%Y')})],
-        status=200
-    )
-    responses.add(
-        responses.POST,
-        url='https://secure.brandnewday.nl/service/navvaluesforfund/',
-        body='error',
-        headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
-        match=[responses.urlencoded_params_matcher(
-            {'page': '1', 'pageSize': '60', 'fundId': '1012', 'startDate': '01-01-2010',
-             'endDate': date.today().strftime('%d-%m-%Y')})],
-        status=500
-    )
+    respx.post(
+        'https://secure.brandnewday.nl/service/navvaluesforfund/',
+        data={'page': '1', 'pageSize': '60', 'fundId': '1012', 'startDate': '01-01-2010', 'endDate': CLOSED_END}
+    ).mock(side_effect=[httpx.Response(200, json=body), httpx.Response(500, text='error')])
+    setup_current_window_response()
 
     assert len(quote_cache) == 0
     response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
@@ -168,6 +190,250 @@ def test_get_quotes_are_cached():
     assert len(quote_cache) == 1
     response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
     assert response.status_code == 200
-    assert quote_cache['1012@1'] == [Quote(Date=datetime(2021, 3, 21, 0, 0, 0), Close=13.535882),
-                                     Quote(Date=datetime(2021, 3, 20, 0, 0, 0), Close=13.535846),
-                                     Quote(Date=datetime(2021, 3, 19, 0, 0, 0), Close=13.535809)]
+    assert list(quote_cache['1012']) == [Quote(Date=datetime(2021, 3, 19, 0, 0, 0), Close=13.535809),
+                                         Quote(Date=datetime(2021, 3, 20, 0, 0, 0), Close=13.535846),
+                                         Quote(Date=datetime(2021, 3, 21, 0, 0, 0), Close=13.535882)]
+
+
+@respx.mock
+def test_concurrent_get_quotes_errors_are_shared(run):
+    route = respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        return_value=httpx.Response(500, text='error'))
+
+    async def main():
+        return await asyncio.gather(*[get_series('1012') for _ in range(5)],
+                                    return_exceptions=True)
+
+    results = run(main())
+
+    # a single fetch, of the closed months and the current month.
+    assert route.call_count == 2
+    assert all(isinstance(r, HTTPException) and r.status_code == 502 for r in results)
+
+
+@respx.mock
+def test_stale_quotes_are_served_while_refreshed(run, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quote_cache, 'timer', lambda: now[0])
+    rows = [(datetime(2021, 3, 21), 13.535882)]
+    route = respx.post(NAVVALUES_URL).mock(side_effect=navvalues(rows))
+
+    async def main():
+        await get_series('1012')
+        now[0] += quote_cache.ttl
+        rows.append((datetime(2021, 3, 22), 13.6))
+
+        stale = await get_series('1012')
+        await asyncio.gather(*quotes_flight.calls.values())
+        fresh = await get_series('1012')
+
+        return stale, fresh
+
+    stale, fresh = run(main())
+
+    assert route.call_count == 4
+    assert list(stale) == [Quote(Date=datetime(2021, 3, 21, 0, 0, 0), Close=13.535882)]
+    assert list(fresh) == [Quote(Date=datetime(2021, 3, 21, 0, 0, 0), Close=13.535882),
+                           Quote(Date=datetime(2021, 3, 22, 0, 0, 0), Close=13.6)]
+
+
+@respx.mock
+def test_stale_funds_are_served_while_refreshed(run, monkeypatch):
+    setup_get_funds_response()
+    now = [1000.0]
+    monkeypatch.setattr(registry.cache, 'timer', lambda: now[0])
+
+    async def main():
+        await registry.funds()
+        now[0] += registry.cache.ttl
+
+        stale = await registry.funds()
+        await asyncio.gather(*registry.flight.calls.values())
+
+        return stale.names()
+
+    assert run(main()) == ['bnd-wereld-indexfonds-c-hedged', 'bnd-wereld-indexfonds-c-unhedged']
+    assert respx.calls.call_count == 2
+    assert not registry.cache.has_stale()
+
+
+@respx.mock
+def test_refreshed_funds_only_invalidate_quotes_of_changed_funds(run):
+    hedged = {"Key": "1002", "Value": "bnd-wereld-indexfonds-c-hedged"}
+    unhedged = {"Key": "1012", "Value": "bnd-wereld-indexfonds-c-unhedged"}
+    respx.get('https://secure.brandnewday.nl/service/getfundsnew/').mock(
+        side_effect=[httpx.Response(200, json={'Message': json.dumps([hedged, unhedged])}),
+                     httpx.Response(200, json={'Message': json.dumps([hedged])})])
+
+    async def main():
+        await registry.funds()
+        quote_cache['1002'] = QuoteSeries.from_pairs([(datetime(2021, 3, 21), 13.5)])
+        quote_cache['1012'] = QuoteSeries.from_pairs([(datetime(2021, 3, 21), 14.5)])
+
+        return await registry.refresh()
+
+    funds = run(main())
+
+    assert funds.names() == ['bnd-wereld-indexfonds-c-hedged']
+    assert list(quote_cache) == ['1002']
+
+
+def page_body(start: datetime, count: int, total: int = None):
+    return {'Data': [{'FundId': 1012, 'LastRate': 10.0 + i,
+                      'RateDate': '/Date({0})/'.format((calendar.timegm(start.timetuple()) - i * 86400) * 1000)}
+                     for i in range(count)],
+            'Total': total or count}
+
+
+@respx.mock
+def test_get_quotes_retrieves_all_pages():
+    setup_get_funds_response()
+    route = respx.post(NAVVALUES_URL).mock(side_effect=navvalues(history(datetime(2021, 3, 21), 70)))
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged?page=2')
+
+    assert route.call_count == 3
+    assert any(b'page=2' in call.request.content for call in route.calls)
+    assert response.status_code == 200
+    assert len(response.json()) == 10
+    assert response.json()[0]['Date'] == '2021-01-20T00:00:00'
+    assert len(quote_cache['1012']) == 70
+    assert len(store.quotes('1012')) == 70
+
+
+@respx.mock
+def test_get_quotes_page_beyond_history_is_empty():
+    setup_get_funds_response()
+    respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        return_value=httpx.Response(200, json=page_body(datetime(2021, 3, 21), 3)))
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged?page=2')
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@respx.mock
+def test_get_quotes_only_retrieves_quotes_since_last_stored_quote():
+    setup_get_funds_response()
+    store.add('1012', QuoteSeries.from_pairs([(datetime(2021, 3, 19), 13.535809)]))
+    respx.post(
+        'https://secure.brandnewday.nl/service/navvaluesforfund/',
+        data={'page': '1', 'pageSize': '60', 'fundId': '1012', 'startDate': '19-03-2021', 'endDate': CLOSED_END}
+    ).mock(return_value=httpx.Response(200, json=page_body(datetime(2021, 3, 20), 2)))
+    setup_current_window_response()
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
+
+    assert response.status_code == 200
+    assert response.json() == [{'Close': 10.0, 'Date': '2021-03-20T00:00:00'},
+                               {'Close': 13.535809, 'Date': '2021-03-19T00:00:00'}]
+
+
+@respx.mock
+def test_get_quotes_failed_page_stores_nothing():
+    setup_get_funds_response()
+    respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        side_effect=[httpx.Response(200, json=page_body(datetime(2021, 3, 21), 60, 120)),
+                     httpx.Response(500, text='error')])
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged')
+
+    assert response.status_code == 502
+    assert store.last_date('1012') is None
+
+
+@respx.mock
+def test_get_history_retrieves_pages_concurrently(monkeypatch):
+    setup_get_funds_response()
+    monkeypatch.setattr(brandnewday.config, 'BRANDNEWDAY_PAGE_CONCURRENCY', 2)
+    concurrency = {'current': 0, 'max': 0}
+
+    answer = navvalues(history(datetime(2021, 3, 21), 300))
+
+    async def measure(request):
+        concurrency['current'] += 1
+        concurrency['max'] = max(concurrency['max'], concurrency['current'])
+        await asyncio.sleep(0.01)
+        concurrency['current'] -= 1
+        return answer(request)
+
+    route = respx.post(NAVVALUES_URL).mock(side_effect=measure)
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged/history')
+
+    # five pages of the closed months, one of the current month.
+    assert route.call_count == 6
+    assert concurrency['max'] == 2
+    assert response.status_code == 200
+    assert len(response.json()) == 300
+    assert response.json()[0]['Date'] < response.json()[-1]['Date']
+    assert len(quote_cache) == 1
+
+
+def test_get_history_unknown_name_returns_http404():
+    with respx.mock:
+        setup_get_funds_response()
+        response = client.get(prefix + 'unknown/history')
+
+    assert response.status_code == 404
+
+
+@respx.mock
+def test_get_quotes_date_range():
+    setup_get_funds_response()
+    respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        return_value=httpx.Response(200, json=page_body(datetime(2021, 3, 21), 10)))
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged?from=2021-03-18&to=2021-03-19')
+    assert [q['Date'] for q in response.json()] == ['2021-03-19T00:00:00', '2021-03-18T00:00:00']
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged/history?from=2021-03-20')
+    assert [q['Date'] for q in response.json()] == ['2021-03-20T00:00:00', '2021-03-21T00:00:00']
+
+    response = client.get(prefix + 'bnd-wereld-indexfonds-c-unhedged/history?latest=true')
+    assert response.json() == [{'Close': 10.0, 'Date': '2021-03-21T00:00:00'}]
+
+
+@respx.mock
+def test_prefetch_refreshes_quotes_ahead_of_expiry(run, monkeypatch):
+    route = respx.post('https://secure.brandnewday.nl/service/navvaluesforfund/').mock(
+        return_value=httpx.Response(200, json=page_body(datetime(2021, 3, 21), 1)))
+    fund = Fund(id='1012', name='bnd-wereld-indexfonds-c-unhedged')
+    now = [1000.0]
+    monkeypatch.setattr(quote_cache, 'timer', lambda: now[0])
+
+    run(brandnewday.prefetch(fund, 60))
+    assert route.call_count == 2
+    assert len(quote_cache['1012']) == 1
+
+    # fresh for more than a minute, nothing to do.
+    run(brandnewday.prefetch(fund, 60))
+    assert route.call_count == 2
+
+    now[0] += quote_cache.ttl - 30
+    run(brandnewday.prefetch(fund, 60))
+    assert route.call_count == 4
+
+
+@pytest.mark.parametrize('start, today, windows', [
+    (date(2010, 1, 1), date(2021, 3, 22), [(date(2010, 1, 1), date(2021, 2, 28)), (date(2021, 3, 1), date(2021, 3, 22))]),
+    (date(2021, 2, 26), date(2021, 3, 1), [(date(2021, 2, 26), date(2021, 2, 28)), (date(2021, 3, 1), date(2021, 3, 1))]),
+    (date(2021, 3, 19), date(2021, 3, 22), [(date(2021, 3, 19), date(2021, 3, 22))]),
+    (date(2021, 3, 1), date(2021, 3, 1), [(date(2021, 3, 1), date(2021, 3, 1))]),
+])
+def test_get_windows_closes_months_before_current_month(start, today, windows):
+    assert brandnewday.get_windows(start, today) == windows
+
+
+@respx.mock
+def test_get_quotes_of_stored_closed_months_only_retrieves_current_month(run):
+    stored = datetime.combine(MONTH, datetime.min.time())
+    store.add('1012', QuoteSeries.from_pairs([(stored, 10.0)]))
+    route = respx.post(NAVVALUES_URL).mock(side_effect=navvalues([(stored, 10.0)]))
+
+    quotes = run(get_series('1012'))
+
+    assert route.call_count == 1
+    assert dict(parse_qsl(route.calls[0].request.content.decode()))['startDate'] == MONTH.strftime('%d-%m-%Y')
+    assert list(quotes) == [Quote(Date=stored, Close=10.0)]
@@ -1,27 +1,42 @@
 import json
 import re
-from datetime import datetime
 from typing import List
 
-import requests
-from bs4 import BeautifulSoup
-from cachetools import TTLCache
-from fastapi import HTTPException, APIRouter
-
-from app.models import Quote, Message
+from fastapi import HTTPException, APIRouter, Depends
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.cache import create_cache
+from app.funds import FundRegistry
+from app.metrics import FETCH_SECONDS, timed
+from app.models import Fund, Quote, Message
+from app.pages import get_parsed
+from app.resilience import with_fallback
+from app.responses import names_response, series_response
+from app.series import QuoteQuery, QuoteSeries, from_isoformat
+from app.singleflight import SingleFlight
+from app.soup import parse_only
+from app.store import create_store
 
 router = APIRouter(
     prefix='/meesman',
     tags=['Meesman']
 )
 
-QUOTES_REGEX = r'data:\s(\[{.*}+\])'
+# start of the data of a chart embedded in a fund page, the data itself is parsed by the JSON decoder.
+CHART_REGEX = re.compile(r'data:\s(?=\[{)')
 
 BASE_URL = 'https://www.meesman.nl/onze-fondsen/'
 QUOTE_URL = BASE_URL + '{0}/'
 
-funds_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
-quote_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
+decoder = json.JSONDecoder()
+
+registry = FundRegistry('meesman.funds', lambda: fetch_funds(), lambda fund: quote_cache.pop(fund.id, None))
+quote_cache = create_cache('meesman.quotes')
+store = create_store('meesman')
+
+# concurrent cache misses share a single upstream fetch, stale entries are refreshed in the background.
+quotes_flight = SingleFlight()
 
 
 @router.get(
@@ -29,27 +44,19 @@ quote_cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
     response_model=List[str],
     summary="Get all available funds"
 )
-async def get_funds() -> List[str]:
-    if len(funds_cache) == 0:
-        await fetch_funds()
-    return list(funds_cache.values())
-
+async def get_funds(request: Request) -> Response:
+    return names_response(request, (await registry.funds()).names())
 
-async def fetch_funds():
-    r = requests.get(url=BASE_URL)
 
-    if r.status_code != requests.codes.ok:
-        raise HTTPException(status_code=502, detail={'message': 'Could not retrieve funds'})
+@timed(FETCH_SECONDS, provider='meesman', operation='funds')
+async def fetch_funds() -> List[Fund]:
+    funds, _ = await get_parsed(BASE_URL, 'Could not retrieve funds', parse_funds, 'meesman', 'funds')
+    return [Fund(id=fund, name=fund) for fund in funds]
 
-    soup = BeautifulSoup(r.text, 'html.parser')
 
-    # clear the caches, there might be new funds how unlikely it might be.
-    quote_cache.clear()
-    funds_cache.clear()
-
-    for fund_name in soup.find_all('td', {'class': 'fund-name'}):
-        fund = fund_name.find('a').get('href').split('/')[2]
-        funds_cache[fund] = fund
+def parse_funds(text: str) -> List[str]:
+    soup = parse_only(text, 'td', 'fund-name')
+    return [fund_name.find('a').get('href').split('/')[2] for fund_name in soup.find_all('td', {'class': 'fund-name'})]
 
 
 @router.get(
@@ -60,32 +67,79 @@ async def fetch_funds():
                404: {'description': 'When the specified fund could not be found, or the fund is unknown',
                      'model': Message}},
 )
-async def get_quotes(fund_name: str) -> List[Quote]:
-    funds = await get_funds()
+async def get_quotes(request: Request, fund_name: str, query: QuoteQuery = Depends()) -> Response:
+    return series_response(request, query.apply(await find_series(fund_name)), query.format)
+
+
+async def find_series(fund_name: str) -> QuoteSeries:
+    fund = await registry.find(fund_name)
+    return await get_series(fund.id)
+
+
+async def get_series(fund_name: str) -> QuoteSeries:
+    quotes, stale = quote_cache.lookup(fund_name)
+
+    if quotes is None:
+        # when the quotes cannot be retrieved, the quotes that were stored before are served.
+        return await with_fallback(quotes_flight.do(fund_name, lambda: fetch_quotes(fund_name)),
+                                   lambda: store.quotes(fund_name) or None)
+
+    if stale:
+        quotes_flight.background(fund_name, lambda: fetch_quotes(fund_name))
+
+    return quotes
+
+
+async def prefetch(fund: Fund, ahead: float):
+    """
+    Refreshes the quotes of the fund when they are missing or go stale within ahead seconds.
+    """
+    if quote_cache.is_stale(fund.id, ahead):
+        await quotes_flight.do(fund.id, lambda: fetch_quotes(fund.id))
+
+
+@timed(FETCH_SECONDS, provider='meesman', operation='quotes')
+async def fetch_quotes(fund_name: str) -> QuoteSeries:
+    quotes, changed = await get_parsed(QUOTE_URL.format(fund_name), 'Could not retrieve quotes', parse_quotes,
+                                       'meesman', 'quotes', extract_charts)
 
-    if fund_name in funds:
+    # Meesman only offers the whole chart, the store keeps quotes that drop off the chart.
+    if changed:
+        store.add(fund_name, quotes)
 
-        if fund_name not in quote_cache:
-            await fetch_quotes(fund_name)
+    quotes = store.quotes(fund_name)
+    quote_cache[fund_name] = quotes
+    return quotes
 
-        return quote_cache[fund_name]
-    else:
-        raise HTTPException(status_code=404, detail={'message': 'Fund {0} could not be found'.format(fund_name)})
 
+def extract_charts(text: str) -> str:
+    """
+    Returns the part of a fund page with the charts, from the first chart up to the end of the script of the last one.
+    """
+    charts = [match.start() for match in CHART_REGEX.finditer(text)]
 
-async def fetch_quotes(fund_name: str):
+    if not charts:
+        return ''
 
-    r = requests.get(url=QUOTE_URL.format(fund_name))
+    end = text.find('</script>', charts[-1])
+    return text[charts[0]:end if end >= 0 else len(text)]
 
-    if r.status_code == requests.codes.ok:
 
-        quotes: List[Quote] = []
+def parse_quotes(text: str) -> QuoteSeries:
+    """
+    Parses the quotes of the charts in a fund page. Each chart is located by its anchor and decoded up to the end of its
+    data, instead of matching the whole page with a regular expression.
+    """
+    pairs = []
+    match = CHART_REGEX.search(text)
 
-        for result in re.findall(QUOTES_REGEX, str(r.text)):
-            quotes += [Quote(Date=datetime.strptime(q['x'], '%Y-%m-%dT%H:%M:%S'), Close=q['y'])
-                       for q in json.loads(result)]
+    while match:
+        try:
+            data, end = decoder.raw_decode(text, match.end())
+        except ValueError:
+            raise HTTPException(status_code=502, detail={'message': 'Could not parse quotes'})
 
-        quote_cache[fund_name] = quotes
+        pairs += [(from_isoformat(q['x']), q['y']) for q in data]
+        match = CHART_REGEX.search(text, end)
 
-    else:
-        raise HTTPException(status_code=502, detail={'message': 'Could not retrieve quotes'})
+    return QuoteSeries.from_pairs(pairs)
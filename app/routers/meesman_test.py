@@ -1,12 +1,16 @@
+import asyncio
 from datetime import datetime
 
+import httpx
 import pytest
-import responses
+import respx
 from fastapi.testclient import TestClient
 
-from .meesman import quote_cache, funds_cache
+from .meesman import extract_charts, fetch_quotes, parse_quotes, quote_cache, registry, store, get_series, \
+    quotes_flight
 from ..main import app
 from ..models import Quote
+from ..series import QuoteSeries
 
 client = TestClient(app)
 
@@ -15,8 +19,9 @@ prefix = '/meesman/'
 
 @pytest.fixture(autouse=True)
 def clear_cache():
-    funds_cache.clear()
+    registry.clear()
     quote_cache.clear()
+    store.clear()
     yield
 
 
@@ -33,11 +38,10 @@ def setup_get_funds_response():
     </tr>
     </table></html>'''
 
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/',
-                  body=body, status=200)
+    respx.get('https://www.meesman.nl/onze-fondsen/').mock(return_value=httpx.Response(200, text=body))
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_funds_list():
     setup_get_funds_response()
     response = client.get(prefix, allow_redirects=False)
@@ -46,15 +50,15 @@ def test_get_funds_returns_funds_list():
     assert response.json() == ['aandelen-wereldwijd-totaal', 'aandelen-ontwikkelde-landen', 'aandelen-opkomende-landen']
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_502():
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/',
-                  body='error', status=502)
+    respx.get('https://www.meesman.nl/onze-fondsen/').mock(return_value=httpx.Response(502, text='error'))
     response = client.get(prefix, allow_redirects=False)
 
     assert response.status_code == 502
 
 
+@respx.mock
 def test_get_quotes_unknown_name_returns_http404():
     setup_get_funds_response()
 
@@ -62,15 +66,15 @@ def test_get_quotes_unknown_name_returns_http404():
     assert response.status_code == 404
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_known_name_returns_http200():
     setup_get_funds_response()
 
     body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}," \
            "{\"x\":\"2021-01-02T00:00:00\",\"y\":10.50}," \
            "{\"x\":\"2021-01-03T00:00:00\",\"y\":11}]"
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/',
-                  body=body, status=200)
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
 
     response = client.get(prefix + 'aandelen-wereldwijd-totaal')
 
@@ -81,27 +85,25 @@ def test_get_quotes_known_name_returns_http200():
                                {'Close': 11.0, 'Date': '2021-01-03T00:00:00'}]
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_server_error_returns_http502():
     setup_get_funds_response()
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/',
-                  body='unknown', status=500)
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(500, text='unknown'))
 
     response = client.get(prefix + 'aandelen-wereldwijd-totaal')
 
     assert response.status_code == 502
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_are_cached():
     setup_get_funds_response()
     body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}," \
            "{\"x\":\"2021-01-02T00:00:00\",\"y\":10.50}," \
            "{\"x\":\"2021-01-03T00:00:00\",\"y\":11}]"
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/',
-                  body=body, status=200)
-    responses.add(responses.GET, 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/',
-                  body='error', status=500)
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        side_effect=[httpx.Response(200, text=body), httpx.Response(500, text='error')])
 
     assert len(quote_cache) == 0
 
@@ -116,6 +118,221 @@ def test_get_quotes_are_cached():
     # let's call it again.
     response = client.get(prefix + 'aandelen-wereldwijd-totaal')
     assert response.status_code == 200
-    assert quote_cache['aandelen-wereldwijd-totaal'] == [Quote(Date=datetime(2021, 1, 1, 0, 0, 0), Close=10.0),
-                                                         Quote(Date=datetime(2021, 1, 2, 0, 0, 0), Close=10.5),
-                                                         Quote(Date=datetime(2021, 1, 3, 0, 0, 0), Close=11.0)]
+    assert list(quote_cache['aandelen-wereldwijd-totaal']) == [
+        Quote(Date=datetime(2021, 1, 1, 0, 0, 0), Close=10.0),
+        Quote(Date=datetime(2021, 1, 2, 0, 0, 0), Close=10.5),
+        Quote(Date=datetime(2021, 1, 3, 0, 0, 0), Close=11.0)]
+
+
+@respx.mock
+def test_concurrent_get_quotes_are_fetched_once(run):
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}]"
+    route = respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
+
+    async def main():
+        return await asyncio.gather(*[get_series('aandelen-wereldwijd-totaal') for _ in range(5)])
+
+    results = run(main())
+
+    assert route.call_count == 1
+    assert [list(r) for r in results] == [[Quote(Date=datetime(2021, 1, 1, 0, 0, 0), Close=10.0)]] * 5
+
+
+@respx.mock
+def test_stale_quotes_are_served_while_refreshed(run, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quote_cache, 'timer', lambda: now[0])
+    route = respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        side_effect=[httpx.Response(200, text="data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}]"),
+                     httpx.Response(200, text="data: [{\"x\":\"2021-01-02T00:00:00\",\"y\":11}]")])
+
+    async def main():
+        await get_series('aandelen-wereldwijd-totaal')
+        now[0] += quote_cache.ttl
+
+        stale = await get_series('aandelen-wereldwijd-totaal')
+        await asyncio.gather(*quotes_flight.calls.values())
+        fresh = await get_series('aandelen-wereldwijd-totaal')
+
+        return stale, fresh
+
+    stale, fresh = run(main())
+
+    assert route.call_count == 2
+    assert list(stale) == [Quote(Date=datetime(2021, 1, 1, 0, 0, 0), Close=10.0)]
+    assert list(fresh) == [Quote(Date=datetime(2021, 1, 1, 0, 0, 0), Close=10.0),
+                           Quote(Date=datetime(2021, 1, 2, 0, 0, 0), Close=11.0)]
+
+
+@respx.mock
+def test_stale_funds_are_served_while_refreshed(run, monkeypatch):
+    setup_get_funds_response()
+    now = [1000.0]
+    monkeypatch.setattr(registry.cache, 'timer', lambda: now[0])
+
+    async def main():
+        await registry.funds()
+        now[0] += registry.cache.ttl
+
+        stale = await registry.funds()
+        await asyncio.gather(*registry.flight.calls.values())
+
+        return stale.names()
+
+    assert run(main()) == ['aandelen-wereldwijd-totaal', 'aandelen-ontwikkelde-landen', 'aandelen-opkomende-landen']
+    assert respx.calls.call_count == 2
+    assert not registry.cache.has_stale()
+
+
+@respx.mock
+def test_refreshed_funds_keep_quotes_warm(run):
+    setup_get_funds_response()
+    series = QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)])
+
+    async def main():
+        await registry.funds()
+        quote_cache['aandelen-wereldwijd-totaal'] = series
+        await registry.refresh()
+
+    run(main())
+
+    assert quote_cache['aandelen-wereldwijd-totaal'] == series
+
+
+@respx.mock
+def test_get_quotes_keeps_stored_history():
+    setup_get_funds_response()
+    store.add('aandelen-wereldwijd-totaal', QuoteSeries.from_pairs([(datetime(2020, 12, 31, 0, 0, 0), 9.5)]))
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}]"
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal')
+
+    assert response.status_code == 200
+    assert response.json() == [{'Close': 9.5, 'Date': '2020-12-31T00:00:00'},
+                               {'Close': 10.0, 'Date': '2021-01-01T00:00:00'}]
+
+
+@respx.mock
+def test_get_quotes_date_range():
+    setup_get_funds_response()
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}," \
+           "{\"x\":\"2021-01-02T00:00:00\",\"y\":10.50}," \
+           "{\"x\":\"2021-01-03T00:00:00\",\"y\":11}]"
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?from=2021-01-02&to=2021-01-02')
+    assert response.json() == [{'Close': 10.5, 'Date': '2021-01-02T00:00:00'}]
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?latest=true')
+    assert response.json() == [{'Close': 11.0, 'Date': '2021-01-03T00:00:00'}]
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?limit=2')
+    assert response.json() == [{'Close': 10.5, 'Date': '2021-01-02T00:00:00'},
+                               {'Close': 11.0, 'Date': '2021-01-03T00:00:00'}]
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?limit=0')
+    assert response.status_code == 422
+
+
+@respx.mock
+def test_get_quotes_conditional_request_returns_http304():
+    setup_get_funds_response()
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}]"
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal')
+    assert response.status_code == 200
+    assert response.headers['last-modified'] == 'Fri, 01 Jan 2021 00:00:00 GMT'
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal', headers={'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+@respx.mock
+def test_get_quotes_as_csv():
+    setup_get_funds_response()
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}," \
+           "{\"x\":\"2021-01-02T00:00:00\",\"y\":10.50}]"
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text=body))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?format=csv&from=2021-01-02')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/csv; charset=utf-8'
+    assert response.text == 'Date,Close\n2021-01-02 00:00:00,10.5\n'
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal?format=xml')
+    assert response.status_code == 422
+
+
+def test_parse_quotes_of_every_chart():
+    text = """<html><script>
+    var chart = {series: [{name: 'Koers', data: [{"x":"2021-01-02T00:00:00","y":10.5},{"x":"2021-01-01T00:00:00","y":10}],
+        color: '#fff'}, {name: 'Rendement', data: [{"x":"2021-01-03T12:30:00","y":11}]}]};
+    var other = {data: []};
+    </script><p>data: none</p></html>"""
+
+    assert list(parse_quotes(text)) == [
+        Quote(Date=datetime(2021, 1, 1), Close=10.0),
+        Quote(Date=datetime(2021, 1, 2), Close=10.5),
+        Quote(Date=datetime(2021, 1, 3, 12, 30), Close=11.0)]
+    assert len(parse_quotes('<html></html>')) == 0
+
+
+def test_extract_charts():
+    text = '<html><p>1 visitor</p><script>var chart = {data: [{"x":"2021-01-01T00:00:00","y":10}]};\n' \
+           'var other = {data: [{"x":"2021-01-02T00:00:00","y":11}]};</script><p>2 visitors</p></html>'
+
+    assert extract_charts(text) == 'data: [{"x":"2021-01-01T00:00:00","y":10}]};\n' \
+                                   'var other = {data: [{"x":"2021-01-02T00:00:00","y":11}]};'
+    assert extract_charts('<html>data: [{"x":"2021-01-01T00:00:00"') == 'data: [{"x":"2021-01-01T00:00:00"'
+    assert extract_charts('<html></html>') == ''
+
+
+@respx.mock
+def test_unchanged_charts_are_not_parsed_again(run, monkeypatch):
+    chart = '<script>data: [{"x":"2021-01-01T00:00:00","y":10}]</script>'
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(side_effect=[
+        httpx.Response(200, text='<p>1 visitor</p>' + chart), httpx.Response(200, text='<p>2 visitors</p>' + chart)])
+    run(fetch_quotes('aandelen-wereldwijd-totaal'))
+
+    def fail(*args):
+        raise AssertionError('parsed again')
+
+    monkeypatch.setattr(store, 'add', fail)
+    quotes = run(fetch_quotes('aandelen-wereldwijd-totaal'))
+
+    assert list(quotes) == [Quote(Date=datetime(2021, 1, 1), Close=10.0)]
+
+
+@respx.mock
+def test_get_quotes_unparsable_chart_returns_http502():
+    setup_get_funds_response()
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(200, text='data: [{"x":"2021-01-01T00:00:00","y":10},'))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal')
+
+    assert response.status_code == 502
+    assert response.json() == {'detail': {'message': 'Could not parse quotes'}}
+
+
+@respx.mock
+def test_get_quotes_serves_stored_quotes_when_upstream_fails():
+    setup_get_funds_response()
+    store.add('aandelen-wereldwijd-totaal', QuoteSeries.from_pairs([(datetime(2020, 12, 31, 0, 0, 0), 9.5)]))
+    respx.get('https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/').mock(
+        return_value=httpx.Response(500, text='error'))
+
+    response = client.get(prefix + 'aandelen-wereldwijd-totaal')
+
+    assert response.status_code == 200
+    assert response.headers['warning'] == '110 - "Response is Stale"'
+    assert response.json() == [{'Close': 9.5, 'Date': '2020-12-31T00:00:00'}]
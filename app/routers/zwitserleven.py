@@ -1,12 +1,19 @@
 from datetime import datetime
-from typing import List
-
-import requests
-from bs4 import BeautifulSoup
-from cachetools import TTLCache
-from fastapi import HTTPException, APIRouter
-
-from app.models import Quote, Message
+from typing import List, Tuple
+
+from fastapi import APIRouter, Depends
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.cache import create_cache
+from app.funds import FundRegistry
+from app.metrics import FETCH_SECONDS, timed
+from app.models import Fund, Quote, Message
+from app.pages import get_parsed
+from app.responses import names_response, series_response
+from app.series import QuoteQuery, QuoteSeries
+from app.soup import parse_only
+from app.store import create_store
 from app.utils import clean_fund_name
 
 router = APIRouter(
@@ -19,7 +26,10 @@ QUOTES_REGEX = r'data:\s(\[{.*}+\])'
 FUNDS_URL = 'https://www.zwitserleven.nl/webtools/fondskoersen_2011/fondskoersen.aspx?cms_id=14421&amp;cms_template' \
             '=NL2015+Infopagina'
 
-cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
+# the fund list holds the latest quote of every fund, refreshing the funds also refreshes the quotes.
+registry = FundRegistry('zwitserleven.funds', lambda: fetch_funds())
+quote_cache = create_cache('zwitserleven.quotes')
+store = create_store('zwitserleven')
 
 
 @router.get(
@@ -27,29 +37,22 @@ cache = TTLCache(maxsize=128, ttl=60 * 60 * 4)  # ttl in seconds, 4hrs.
     response_model=List[str],
     summary="Get all available funds"
 )
-async def get_funds() -> List[str]:
-    if len(cache) == 0:
-        await fetch_funds()
-    return list(cache.keys())
+async def get_funds(request: Request) -> Response:
+    return names_response(request, (await registry.funds()).names())
 
 
-async def fetch_funds():
-    r = requests.get(url=FUNDS_URL)
+@timed(FETCH_SECONDS, provider='zwitserleven', operation='funds')
+async def fetch_funds() -> List[Fund]:
+    funds, changed = await get_parsed(FUNDS_URL, 'Could not retrieve funds', parse_funds, 'zwitserleven', 'funds',
+                                      extract_table)
 
-    if r.status_code != requests.codes.ok:
-        raise HTTPException(status_code=502, detail={'message': 'Could not retrieve funds'})
+    for fund, date, close in funds:
+        # Zwitserleven only shows the latest quote, the history is built up in the store.
+        if changed:
+            store.add(fund.name, QuoteSeries.from_pairs([(date, close)]))
+        quote_cache[fund.name] = store.quotes(fund.name)
 
-    soup = BeautifulSoup(r.text, 'html.parser')
-    cache.clear()
-
-    for fund in soup.find_all('tr', {'class': 'showFonds'}):
-        name = clean_fund_name(fund.find('a').text.strip())
-
-        quotes = fund.find_all('td', {'class': 'koers'})
-        close = float(quotes[0].text.strip().replace(',', '.'))
-        date = datetime.strptime(quotes[1].text.strip(), '%d-%m-%Y')
-
-        cache[name] = [Quote(Date=date, Close=close)]
+    return [fund for fund, _, _ in funds]
 
 
 @router.get(
@@ -60,10 +63,44 @@ async def fetch_funds():
                404: {'description': 'When the specified fund could not be found, or the fund is unknown',
                      'model': Message}},
 )
-async def get_quotes(fund_name: str) -> List[Quote]:
-    funds = await get_funds()
+async def get_quotes(request: Request, fund_name: str, query: QuoteQuery = Depends()) -> Response:
+    return series_response(request, query.apply(await find_series(fund_name)), query.format)
+
+
+async def find_series(fund_name: str) -> QuoteSeries:
+    fund = await registry.find(fund_name)
+    quotes, _ = quote_cache.lookup(fund.name)
+
+    # the quotes are cached together with the funds, unless they were evicted.
+    return quotes if quotes is not None else store.quotes(fund.name)
+
+
+def extract_table(text: str) -> str:
+    """
+    Returns the part of the page with the rows of the funds.
+    """
+    start = text.find('showFonds')
+
+    if start < 0:
+        return ''
+
+    end = text.find('</tr>', text.rfind('showFonds'))
+    return text[start:end if end >= 0 else len(text)]
+
+
+def parse_funds(text: str) -> List[Tuple[Fund, datetime, float]]:
+    """
+    Parses every fund with the date and close of its latest quote.
+    """
+    funds = []
+
+    for fund in parse_only(text, 'tr', 'showFonds').find_all('tr', {'class': 'showFonds'}):
+        name = clean_fund_name(fund.find('a').text.strip())
+
+        quotes = fund.find_all('td', {'class': 'koers'})
+        close = float(quotes[0].text.strip().replace(',', '.'))
+        date = datetime.strptime(quotes[1].text.strip(), '%d-%m-%Y')
+
+        funds.append((Fund(id=fund.get('id', name), name=name), date, close))
 
-    if fund_name in funds:
-        return cache[fund_name]
-    else:
-        raise HTTPException(status_code=404, detail={'message': 'Fund {0} could not be found'.format(fund_name)})
+    return funds
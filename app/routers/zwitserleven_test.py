@@ -1,12 +1,15 @@
+import asyncio
 from datetime import datetime
 
+import httpx
 import pytest
-import responses
+import respx
 from fastapi.testclient import TestClient
 
-from .zwitserleven import cache
+from .zwitserleven import extract_table, fetch_funds, quote_cache, registry, store, FUNDS_URL
 from ..main import app
 from ..models import Quote
+from ..series import QuoteSeries
 
 client = TestClient(app)
 
@@ -15,11 +18,13 @@ prefix = '/zwitserleven/'
 
 @pytest.fixture(autouse=True)
 def clear_cache():
-    cache.clear()
+    registry.clear()
+    quote_cache.clear()
+    store.clear()
     yield
 
 
-def setup_get_funds_response():
+def setup_get_funds_response(*extra):
     body = '''<html>
 <table>
 <tr class="showFonds" id="139">
@@ -46,12 +51,10 @@ def setup_get_funds_response():
 </table>
 </html>'''
 
-    responses.add(responses.GET,
-                  'https://www.zwitserleven.nl/webtools/fondskoersen_2011/fondskoersen.aspx?cms_id=14421&amp'
-                  ';cms_template=NL2015+Infopagina', body=body, status=200)
+    respx.get(FUNDS_URL).mock(side_effect=[httpx.Response(200, text=body), *extra])
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_funds_list():
     setup_get_funds_response()
     response = client.get(prefix, allow_redirects=False)
@@ -61,17 +64,15 @@ def test_get_funds_returns_funds_list():
                                'zwitserleven-vastgoedfonds']
 
 
-@responses.activate
+@respx.mock
 def test_get_funds_returns_502():
-    responses.add(responses.GET,
-                  'https://www.zwitserleven.nl/webtools/fondskoersen_2011/fondskoersen.aspx?cms_id=14421&amp'
-                  ';cms_template=NL2015+Infopagina',
-                  body='error', status=502)
+    respx.get(FUNDS_URL).mock(return_value=httpx.Response(502, text='error'))
     response = client.get(prefix, allow_redirects=False)
 
     assert response.status_code == 502
 
 
+@respx.mock
 def test_get_quotes_unknown_name_returns_http404():
     setup_get_funds_response()
 
@@ -79,46 +80,148 @@ def test_get_quotes_unknown_name_returns_http404():
     assert response.status_code == 404
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_known_name_returns_http200():
     setup_get_funds_response()
 
     response = client.get(prefix + 'zwitserleven-vastgoedfonds')
 
-    assert len(cache) == 3
+    assert len(quote_cache) == 3
     assert response.status_code == 200
     assert response.json() == [{'Close': 24.26, 'Date': '2021-03-24T00:00:00'}]
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_server_error_returns_http502():
-    responses.add(responses.GET,
-                  'https://www.zwitserleven.nl/webtools/fondskoersen_2011/fondskoersen.aspx?cms_id=14421&amp'
-                  ';cms_template=NL2015+Infopagina',
-                  body='error', status=500)
+    respx.get(FUNDS_URL).mock(return_value=httpx.Response(500, text='error'))
 
     response = client.get(prefix + 'zwitserleven-vastgoedfonds')
 
     assert response.status_code == 502
 
 
-@responses.activate
+@respx.mock
 def test_get_quotes_are_cached():
-    setup_get_funds_response()
-    responses.add(responses.GET,
-                  'https://www.zwitserleven.nl/webtools/fondskoersen_2011/fondskoersen.aspx?cms_id=14421&amp'
-                  ';cms_template=NL2015+Infopagina',
-                  body='error', status=500)
+    setup_get_funds_response(httpx.Response(500, text='error'))
 
-    assert len(cache) == 0
+    assert len(quote_cache) == 0
 
     response = client.get(prefix + 'zwitserleven-vastgoedfonds')
     assert response.status_code == 200
     assert response.json() == [{'Close': 24.26, 'Date': '2021-03-24T00:00:00'}]
 
-    assert len(cache) == 3
+    assert len(quote_cache) == 3
 
     # let's call it again.
     response = client.get(prefix + 'zwitserleven-vastgoedfonds')
     assert response.status_code == 200
-    assert cache['zwitserleven-vastgoedfonds'] == [Quote(Date=datetime(2021, 3, 24, 0, 0, 0), Close=24.26)]
+    assert list(quote_cache['zwitserleven-vastgoedfonds']) == [Quote(Date=datetime(2021, 3, 24, 0, 0, 0), Close=24.26)]
+
+
+@respx.mock
+def test_concurrent_get_funds_are_fetched_once(run):
+    setup_get_funds_response()
+
+    async def main():
+        return [funds.names() for funds in await asyncio.gather(*[registry.funds() for _ in range(5)])]
+
+    results = run(main())
+
+    assert respx.calls.call_count == 1
+    assert results == [['zwitserleven-ultra-long-duration-fonds', 'zwitserleven-variabele-rente',
+                        'zwitserleven-vastgoedfonds']] * 5
+
+
+@respx.mock
+def test_stale_funds_are_served_while_refreshed(run, monkeypatch):
+    setup_get_funds_response(httpx.Response(500, text='error'))
+    now = [1000.0]
+    monkeypatch.setattr(registry.cache, 'timer', lambda: now[0])
+
+    async def main():
+        await registry.funds()
+        now[0] += registry.cache.ttl
+
+        stale = await registry.funds()
+        await asyncio.gather(*registry.flight.calls.values(), return_exceptions=True)
+
+        return stale.names()
+
+    assert run(main()) == ['zwitserleven-ultra-long-duration-fonds', 'zwitserleven-variabele-rente',
+                           'zwitserleven-vastgoedfonds']
+    assert respx.calls.call_count == 2
+    # the refresh failed, the stale quotes are kept.
+    assert list(quote_cache['zwitserleven-vastgoedfonds']) == [Quote(Date=datetime(2021, 3, 24, 0, 0, 0), Close=24.26)]
+
+
+@respx.mock
+def test_get_quotes_returns_history():
+    setup_get_funds_response()
+    store.add('zwitserleven-vastgoedfonds', QuoteSeries.from_pairs([(datetime(2021, 3, 23, 0, 0, 0), 24.1),
+                                                                    (datetime(2021, 3, 24, 0, 0, 0), 24.26)]))
+
+    response = client.get(prefix + 'zwitserleven-vastgoedfonds')
+
+    assert response.status_code == 200
+    assert response.json() == [{'Close': 24.1, 'Date': '2021-03-23T00:00:00'},
+                               {'Close': 24.26, 'Date': '2021-03-24T00:00:00'}]
+
+
+@respx.mock
+def test_get_quotes_latest():
+    setup_get_funds_response()
+    store.add('zwitserleven-vastgoedfonds', QuoteSeries.from_pairs([(datetime(2021, 3, 23, 0, 0, 0), 24.1)]))
+
+    response = client.get(prefix + 'zwitserleven-vastgoedfonds?latest=true')
+
+    assert response.json() == [{'Close': 24.26, 'Date': '2021-03-24T00:00:00'}]
+
+    response = client.get(prefix + 'zwitserleven-vastgoedfonds?to=2021-03-23')
+
+    assert response.json() == [{'Close': 24.1, 'Date': '2021-03-23T00:00:00'}]
+
+
+@respx.mock
+def test_get_quotes_of_evicted_fund_are_read_from_store():
+    setup_get_funds_response()
+    assert client.get(prefix).status_code == 200
+
+    del quote_cache['zwitserleven-vastgoedfonds']
+
+    response = client.get(prefix + 'Zwitserleven Vastgoedfonds')
+    assert response.status_code == 200
+    assert response.json() == [{'Close': 24.26, 'Date': '2021-03-24T00:00:00'}]
+
+
+@respx.mock
+def test_get_funds_are_identified_by_row_id(run):
+    setup_get_funds_response()
+
+    funds = run(registry.funds())
+
+    assert funds.get('101').name == 'zwitserleven-vastgoedfonds'
+
+
+def test_extract_table():
+    text = '<p>1 visitor</p><table><tr class="showFonds"><td>1</td></tr><tr class="showFonds"><td>2</td></tr>' \
+           '</table><p>2 visitors</p>'
+
+    assert extract_table(text) == 'showFonds"><td>1</td></tr><tr class="showFonds"><td>2</td>'
+    assert extract_table('<tr class="showFonds"><td>1</td>') == 'showFonds"><td>1</td>'
+    assert extract_table('<html></html>') == ''
+
+
+@respx.mock
+def test_unchanged_funds_refresh_quotes_from_store(run, monkeypatch):
+    setup_get_funds_response()
+    run(fetch_funds())
+    quote_cache.clear()
+
+    def fail(*args):
+        raise AssertionError('parsed again')
+
+    monkeypatch.setattr(store, 'add', fail)
+    setup_get_funds_response()
+    run(fetch_funds())
+
+    assert list(quote_cache['zwitserleven-vastgoedfonds']) == [Quote(Date=datetime(2021, 3, 24), Close=24.26)]
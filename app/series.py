@@ -0,0 +1,150 @@
+import calendar
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+from enum import Enum
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from fastapi import Query
+
+from app.models import Quote
+
+DAY = 24 * 60 * 60
+
+# number of quotes serialized at once when streaming a series.
+CHUNK_SIZE = 1000
+
+
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def to_timestamp(value: Union[date, datetime]) -> int:
+    return calendar.timegm(value.timetuple())
+
+
+def from_isoformat(value: str) -> int:
+    """
+    Converts an ISO 8601 date and time without time zone, like 2021-01-01T00:00:00, to a timestamp. Much faster than
+    strptime and timegm, which matters when converting the thousands of dates of a chart.
+    """
+    moment = datetime.fromisoformat(value)
+    return (moment.toordinal() - EPOCH) * DAY + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+class QuoteSeries:
+    """
+    Compact series of quotes ordered by date, kept as two arrays of timestamps (seconds since the epoch, UTC) and
+    closes instead of a list of Quote models.
+    """
+
+    __slots__ = ('dates', 'closes')
+
+    def __init__(self, dates: Optional[array] = None, closes: Optional[array] = None):
+        self.dates = dates if dates is not None else array('q')
+        self.closes = closes if closes is not None else array('d')
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[Union[int, datetime], float]]) -> 'QuoteSeries':
+        """
+        Creates a series from (date, close) pairs in any order, the date is a datetime or a timestamp. When a date
+        occurs more than once, the first close is kept.
+        """
+        closes = {}
+
+        for day, close in pairs:
+            closes.setdefault(day if isinstance(day, int) else to_timestamp(day), close)
+
+        dates = sorted(closes)
+        return cls(array('q', dates), array('d', [closes[d] for d in dates]))
+
+    @classmethod
+    def from_quotes(cls, quotes: Iterable[Quote]) -> 'QuoteSeries':
+        return cls.from_pairs((q.Date, q.Close) for q in quotes)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __iter__(self) -> Iterator[Quote]:
+        for day, close in zip(self.dates, self.closes):
+            yield Quote(Date=datetime.utcfromtimestamp(day), Close=close)
+
+    def __getitem__(self, index: slice) -> 'QuoteSeries':
+        return QuoteSeries(self.dates[index], self.closes[index])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, QuoteSeries):
+            return NotImplemented
+        return self.dates == other.dates and self.closes == other.closes
+
+    def __repr__(self) -> str:
+        return 'QuoteSeries({0})'.format(list(self))
+
+    def slice(self, from_date: Optional[date] = None, to_date: Optional[date] = None,
+              limit: Optional[int] = None) -> 'QuoteSeries':
+        """
+        Returns the quotes from from_date up to and including to_date, and at most the latest limit of those. The
+        bounds are found using binary search.
+        """
+        start = bisect_left(self.dates, to_timestamp(from_date)) if from_date else 0
+        end = bisect_left(self.dates, to_timestamp(to_date) + DAY) if to_date else len(self.dates)
+
+        if limit is not None:
+            start = max(start, end - limit)
+
+        return self[start:end]
+
+    def to_json(self) -> bytes:
+        """
+        Serializes the series as a JSON list of quotes, without creating a Quote model for every quote.
+        """
+        return ('[' + ','.join(
+            '{"Date":"%s","Close":%r}' % (datetime.utcfromtimestamp(day).isoformat(), close)
+            for day, close in zip(self.dates, self.closes)
+        ) + ']').encode()
+
+    def iter_csv(self) -> Iterator[bytes]:
+        """
+        Serializes the series as CSV with a header, in chunks of quotes.
+        """
+        yield b'Date,Close\n'
+        yield from self.iter_chunks('%s,%r\n', '%Y-%m-%d %H:%M:%S')
+
+    def iter_ndjson(self) -> Iterator[bytes]:
+        """
+        Serializes the series as newline delimited JSON, a quote per line, in chunks of quotes.
+        """
+        yield from self.iter_chunks('{"Date":"%s","Close":%r}\n', '%Y-%m-%dT%H:%M:%S')
+
+    def iter_chunks(self, line: str, date_format: str) -> Iterator[bytes]:
+        for start in range(0, len(self.dates), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            yield ''.join(
+                line % (datetime.utcfromtimestamp(day).strftime(date_format), close)
+                for day, close in zip(self.dates[start:end], self.closes[start:end])
+            ).encode()
+
+
+class Format(str, Enum):
+    json = 'json'
+    csv = 'csv'
+    ndjson = 'ndjson'
+
+
+class QuoteQuery:
+    """
+    Query parameters to select part of a series of quotes and the format to deliver them in.
+    """
+
+    def __init__(self,
+                 from_date: Optional[date] = Query(None, alias='from', description='Only quotes on or after this date'),
+                 to_date: Optional[date] = Query(None, alias='to', description='Only quotes on or before this date'),
+                 limit: Optional[int] = Query(None, ge=1, description='Only the latest quotes, at most this many'),
+                 latest: bool = Query(False, description='Only the latest quote'),
+                 format: Format = Query(Format.json, description='Format of the quotes')):
+        self.from_date = from_date
+        self.to_date = to_date
+        self.limit = 1 if latest else limit
+        self.format = format
+
+    def apply(self, series: QuoteSeries) -> QuoteSeries:
+        return series.slice(self.from_date, self.to_date, self.limit)
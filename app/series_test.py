@@ -0,0 +1,108 @@
+import json
+from array import array
+from datetime import date, datetime
+
+from . import series as series_module
+from .models import Quote
+from .series import QuoteSeries, from_isoformat, to_timestamp
+
+series = QuoteSeries.from_quotes(Quote(Date=datetime(2021, 1, day), Close=10.0 + day) for day in range(1, 11))
+
+
+def test_from_pairs_orders_by_date_and_keeps_first_close():
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 1, 2), 10.5), (1609459200, 10), (datetime(2021, 1, 2), 12.0)])
+
+    assert quotes.dates == array('q', [1609459200, 1609545600])
+    assert quotes.closes == array('d', [10.0, 10.5])
+
+
+def test_iterates_quotes():
+    assert list(QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10)])) == [Quote(Date=datetime(2021, 1, 1), Close=10.0)]
+
+
+def test_equality():
+    assert series == QuoteSeries.from_quotes(list(series))
+    assert series != series[1:]
+    assert series != list(series)
+
+
+def test_repr():
+    assert repr(QuoteSeries()) == 'QuoteSeries([])'
+
+
+def test_slice_without_bounds_returns_all_quotes():
+    assert series.slice() == series
+
+
+def test_slice_from_date_is_inclusive():
+    assert series.slice(from_date=date(2021, 1, 8)) == series[7:]
+
+
+def test_slice_to_date_is_inclusive():
+    assert series.slice(to_date=date(2021, 1, 3)) == series[:3]
+
+
+def test_slice_to_date_includes_whole_day():
+    intraday = QuoteSeries.from_pairs([(datetime(2021, 1, 1, 17, 30), 10.0)])
+
+    assert intraday.slice(to_date=date(2021, 1, 1)) == intraday
+
+
+def test_slice_range():
+    assert series.slice(from_date=date(2021, 1, 3), to_date=date(2021, 1, 5)) == series[2:5]
+
+
+def test_slice_range_without_quotes():
+    assert len(series.slice(from_date=date(2021, 2, 1))) == 0
+    assert len(series.slice(to_date=date(2020, 12, 31))) == 0
+    assert len(series.slice(from_date=date(2021, 1, 5), to_date=date(2021, 1, 3))) == 0
+
+
+def test_slice_limit_returns_latest_quotes():
+    assert series.slice(limit=2) == series[8:]
+    assert series.slice(to_date=date(2021, 1, 5), limit=2) == series[3:5]
+    assert series.slice(from_date=date(2021, 1, 9), limit=5) == series[8:]
+
+
+def test_slice_empty_series():
+    assert len(QuoteSeries().slice(from_date=date(2021, 1, 1), to_date=date(2021, 1, 5), limit=1)) == 0
+
+
+def test_to_json_matches_quote_model():
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 3, 21), 13.535882), (datetime(2021, 3, 22, 17, 30, 5), 10)])
+
+    assert json.loads(quotes.to_json()) == [json.loads(q.json()) for q in quotes]
+    assert quotes.to_json() == b'[{"Date":"2021-03-21T00:00:00","Close":13.535882},' \
+                               b'{"Date":"2021-03-22T17:30:05","Close":10.0}]'
+    assert QuoteSeries().to_json() == b'[]'
+
+
+def test_iter_csv():
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 3, 21), 13.535882), (datetime(2021, 3, 22, 17, 30, 5), 10)])
+
+    assert b''.join(quotes.iter_csv()) == b'Date,Close\n2021-03-21 00:00:00,13.535882\n2021-03-22 17:30:05,10.0\n'
+    assert b''.join(QuoteSeries().iter_csv()) == b'Date,Close\n'
+
+
+def test_iter_ndjson_matches_to_json():
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 3, 21), 13.535882), (datetime(2021, 3, 22, 17, 30, 5), 10)])
+
+    lines = b''.join(quotes.iter_ndjson()).splitlines()
+
+    assert [json.loads(line) for line in lines] == json.loads(quotes.to_json())
+    assert list(QuoteSeries().iter_ndjson()) == []
+
+
+def test_iter_serializes_in_chunks(monkeypatch):
+    monkeypatch.setattr(series_module, 'CHUNK_SIZE', 2)
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 3, day), day) for day in range(1, 6)])
+
+    chunks = list(quotes.iter_ndjson())
+
+    assert [chunk.count(b'\n') for chunk in chunks] == [2, 2, 1]
+    assert b''.join(chunks).splitlines()[-1] == b'{"Date":"2021-03-05T00:00:00","Close":5.0}'
+
+
+def test_from_isoformat():
+    for value in ['2021-03-21T00:00:00', '2021-03-22T17:30:05', '1969-12-31T23:59:59', '2000-02-29T12:00:00']:
+        assert from_isoformat(value) == to_timestamp(datetime.strptime(value, '%Y-%m-%dT%H:%M:%S'))
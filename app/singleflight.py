@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single call, all callers receive the same result or error.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[Any]], log: bool = False) -> asyncio.Future:
+        """
+        Returns the call in flight for the key, or starts one. With log, errors of a call it starts are logged once.
+        """
+        call = self.calls.get(key)
+
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            call.add_done_callback(lambda _: self.forget(key, call))
+            if log:
+                call.add_done_callback(lambda _: log_failure(key, call))
+            self.calls[key] = call
+
+        return call
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        # shield the call, a cancelled caller must not cancel the call for the other callers.
+        return await asyncio.shield(self.start(key, fn))
+
+    def background(self, key: Hashable, fn: Callable[[], Awaitable[Any]]):
+        """
+        Starts the call without waiting for it, errors are logged instead of raised. Joining a call in flight does not
+        log its errors again, a call started by do raises them to its callers.
+        """
+        self.start(key, fn, log=True)
+
+    def forget(self, key: Hashable, call: asyncio.Future):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def __len__(self):
+        return len(self.calls)
+
+
+def log_failure(key: Hashable, call: asyncio.Future):
+    if not call.cancelled() and call.exception() is not None:
+        logger.warning('Background refresh of %s failed: %r', key, call.exception())
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from .singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced(run):
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'quotes'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('fund', fetch) for _ in range(10)])
+
+    assert run(main()) == ['quotes'] * 10
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+def test_calls_for_different_keys_are_not_coalesced(run):
+    flight = SingleFlight()
+
+    async def fetch(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        return await asyncio.gather(flight.do('a', lambda: fetch('a')), flight.do('b', lambda: fetch('b')))
+
+    assert run(main()) == ['a', 'b']
+
+
+def test_error_is_raised_for_all_callers(run):
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('upstream down')
+
+    async def main():
+        return await asyncio.gather(*[flight.do('fund', fetch) for _ in range(3)], return_exceptions=True)
+
+    results = run(main())
+
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(flight) == 0
+
+
+def test_sequential_calls_are_not_coalesced(run):
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return len(calls)
+
+    assert run(flight.do('fund', fetch)) == 1
+    assert run(flight.do('fund', fetch)) == 2
+
+
+def test_cancelled_caller_does_not_cancel_call(run):
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return 'quotes'
+
+    async def main():
+        first = asyncio.ensure_future(flight.do('fund', fetch))
+        second = asyncio.ensure_future(flight.do('fund', fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        return await second
+
+    assert run(main()) == 'quotes'
+
+
+def test_forget_ignores_replaced_call(run):
+    flight = SingleFlight()
+    flight.calls['fund'] = 'newer'
+
+    flight.forget('fund', 'older')
+
+    assert flight.calls == {'fund': 'newer'}
+
+
+def test_background_call_is_not_awaited(run):
+    flight = SingleFlight()
+    done = []
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        done.append(1)
+
+    async def main():
+        flight.background('fund', fetch)
+        assert len(flight) == 1
+        assert done == []
+        await asyncio.sleep(0.05)
+
+    run(main())
+
+    assert done == [1]
+    assert len(flight) == 0
+
+
+def test_background_call_errors_are_logged(run, caplog):
+    flight = SingleFlight()
+
+    async def fetch():
+        raise ValueError('upstream down')
+
+    async def main():
+        # every request for the stale entry joins the refresh in flight, its error is logged once.
+        for _ in range(5):
+            flight.background('fund', fetch)
+        await asyncio.sleep(0.01)
+
+    run(main())
+
+    assert caplog.text.count('Background refresh of fund failed') == 1
+
+
+def test_background_call_cancellation_is_not_logged(run, caplog):
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(1)
+
+    async def main():
+        flight.background('fund', fetch)
+        flight.calls['fund'].cancel()
+        await asyncio.sleep(0.01)
+
+    run(main())
+
+    assert caplog.text == ''
@@ -0,0 +1,14 @@
+from importlib.util import find_spec
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# lxml is optional, when it is installed it is used instead of the much slower html.parser of Python.
+PARSER = 'lxml' if find_spec('lxml') else 'html.parser'
+
+
+def parse_only(text: str, name: str, class_: str) -> BeautifulSoup:
+    """
+    Parses only the elements with the given name and class, and their contents, instead of building a tree of the
+    whole page.
+    """
+    return BeautifulSoup(text, PARSER, parse_only=SoupStrainer(name, class_=class_))
@@ -0,0 +1,24 @@
+from importlib.util import find_spec
+
+import pytest
+
+from . import soup
+from .soup import parse_only
+
+PARSERS = ['html.parser'] + (['lxml'] if find_spec('lxml') else [])
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_parse_only_keeps_matching_elements(monkeypatch, parser):
+    monkeypatch.setattr(soup, 'PARSER', parser)
+    text = '''<html><body><table>
+    <tr class="showFonds"><td><a href="/a">A</a></td></tr>
+    <tr class="other"><td><a href="/b">B</a></td></tr>
+    <tr class="showFonds"><td><a href="/c">C</a></td></tr>
+    </table></body></html>'''
+
+    result = parse_only(text, 'tr', 'showFonds')
+
+    assert [tr.find('a').text for tr in result.find_all('tr', {'class': 'showFonds'})] == ['A', 'C']
+    assert result.find('tr', {'class': 'other'}) is None
+    assert result.find('body') is None
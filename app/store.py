@@ -0,0 +1,119 @@
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Optional
+
+from app import config
+from app.database import Database
+from app.series import QuoteSeries
+
+
+class QuoteStore(ABC):
+    """
+    Append-only store for the quotes of a provider, a series of quotes per fund. A series holds at most one quote per
+    date, the first quote stored for a date is kept.
+    """
+
+    @abstractmethod
+    def add(self, fund: str, quotes: QuoteSeries) -> int:
+        """
+        Adds the quotes to the series of the fund, returns the number of quotes that were new.
+        """
+
+    @abstractmethod
+    def quotes(self, fund: str) -> QuoteSeries:
+        """
+        Returns the series of the fund.
+        """
+
+    @abstractmethod
+    def last_date(self, fund: str) -> Optional[datetime]:
+        """
+        Returns the date of the latest quote of the fund, or None when the series is empty.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Removes all series.
+        """
+
+
+class MemoryStore(QuoteStore):
+    """
+    Keeps the quotes in the memory of the current process, they are lost on restart.
+    """
+
+    def __init__(self):
+        self.series: Dict[str, QuoteSeries] = {}
+
+    def add(self, fund: str, quotes: QuoteSeries) -> int:
+        series = self.series.get(fund, QuoteSeries())
+        # the stored quotes come first, so their closes are kept.
+        self.series[fund] = QuoteSeries.from_pairs(chain(zip(series.dates, series.closes),
+                                                         zip(quotes.dates, quotes.closes)))
+        return len(self.series[fund]) - len(series)
+
+    def quotes(self, fund: str) -> QuoteSeries:
+        # a series is never changed once stored, a new one replaces it.
+        return self.series.get(fund, QuoteSeries())
+
+    def last_date(self, fund: str) -> Optional[datetime]:
+        series = self.series.get(fund)
+        return datetime.utcfromtimestamp(series.dates[-1]) if series else None
+
+    def clear(self):
+        self.series.clear()
+
+
+class SqliteStore(QuoteStore):
+    """
+    Keeps the quotes in a SQLite database, they survive restarts and are shared by all worker processes on a host.
+    """
+
+    def __init__(self, path: str, namespace: str):
+        self.path = path
+        self.namespace = namespace
+        self.database = Database(path, 'CREATE TABLE IF NOT EXISTS quotes (namespace TEXT NOT NULL, fund TEXT NOT NULL, '
+                                       'date INTEGER NOT NULL, close REAL NOT NULL, PRIMARY KEY (namespace, fund, date)) '
+                                       'WITHOUT ROWID')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self.database.connection
+
+    def add(self, fund: str, quotes: QuoteSeries) -> int:
+        # one transaction, otherwise every quote is committed, and synced to disk, on its own.
+        with self.database.transaction() as connection:
+            return connection.executemany(
+                'INSERT OR IGNORE INTO quotes (namespace, fund, date, close) VALUES (?, ?, ?, ?)',
+                [(self.namespace, fund, day, close) for day, close in zip(quotes.dates, quotes.closes)]).rowcount
+
+    def quotes(self, fund: str) -> QuoteSeries:
+        series = QuoteSeries()
+
+        for day, close in self.connection.execute(
+                'SELECT date, close FROM quotes WHERE namespace = ? AND fund = ? ORDER BY date', (self.namespace, fund)):
+            series.dates.append(day)
+            series.closes.append(close)
+
+        return series
+
+    def last_date(self, fund: str) -> Optional[datetime]:
+        last = self.connection.execute('SELECT MAX(date) FROM quotes WHERE namespace = ? AND fund = ?',
+                                       (self.namespace, fund)).fetchone()[0]
+        return datetime.utcfromtimestamp(last) if last is not None else None
+
+    def clear(self):
+        self.connection.execute('DELETE FROM quotes WHERE namespace = ?', (self.namespace,))
+
+
+def create_store(name: str) -> QuoteStore:
+    if config.STORE_BACKEND == 'memory':
+        return MemoryStore()
+
+    if config.STORE_BACKEND == 'sqlite':
+        return SqliteStore(config.STORE_PATH, name)
+
+    raise ValueError('Unknown store backend {0}'.format(config.STORE_BACKEND))
@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from . import config
+from .cache import sizeof
+from .series import QuoteSeries
+from .store import MemoryStore, SqliteStore, create_store
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    return SqliteStore(str(tmp_path / 'quotes.sqlite3'), 'meesman')
+
+
+def test_add_returns_number_of_new_quotes(store):
+    assert store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 2), 10.5), (datetime(2021, 1, 1), 10.0)])) == 2
+    assert store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 2), 10.5), (datetime(2021, 1, 3), 11.0)])) == 1
+
+
+def test_quotes_are_ordered_by_date(store):
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 2), 10.5)]))
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)]))
+
+    assert store.quotes('fund') == QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0), (datetime(2021, 1, 2), 10.5)])
+    assert store.quotes('other') == QuoteSeries()
+
+
+def test_first_quote_for_a_date_is_kept(store):
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)]))
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 1), 12.0)]))
+
+    assert store.quotes('fund') == QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)])
+
+
+def test_last_date(store):
+    assert store.last_date('fund') is None
+
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 2), 10.5), (datetime(2021, 1, 1), 10.0)]))
+
+    assert store.last_date('fund') == datetime(2021, 1, 2)
+
+
+def test_clear(store):
+    store.add('fund', QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)]))
+    store.clear()
+
+    assert len(store.quotes('fund')) == 0
+
+
+def test_memory_store_keeps_compact_series():
+    store = MemoryStore()
+    quotes = QuoteSeries.from_pairs([(i * 86400, 10.0 + i) for i in range(5000)])
+    store.add('fund', quotes[:4000])
+    store.add('fund', quotes[3000:])
+
+    assert store.quotes('fund') == quotes
+    assert sizeof(store.series) < sizeof(quotes) * 1.1
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    quotes = QuoteSeries.from_pairs([(datetime(2021, 1, 1), 10.0)])
+    SqliteStore(str(tmp_path / 'quotes.sqlite3'), 'meesman').add('fund', quotes)
+
+    assert SqliteStore(str(tmp_path / 'quotes.sqlite3'), 'meesman').quotes('fund') == quotes
+    assert len(SqliteStore(str(tmp_path / 'quotes.sqlite3'), 'brandnewday').quotes('fund')) == 0
+
+
+def test_sqlite_store_reconnects_after_fork(tmp_path, monkeypatch):
+    store = SqliteStore(str(tmp_path / 'quotes.sqlite3'), 'meesman')
+    connection = store.connection
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+
+    assert store.connection is not connection
+
+
+def test_create_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'STORE_PATH', str(tmp_path / 'quotes.sqlite3'))
+
+    monkeypatch.setattr(config, 'STORE_BACKEND', 'memory')
+    assert isinstance(create_store('meesman'), MemoryStore)
+
+    monkeypatch.setattr(config, 'STORE_BACKEND', 'sqlite')
+    store = create_store('meesman')
+    assert isinstance(store, SqliteStore)
+    assert store.namespace == 'meesman'
+
+    monkeypatch.setattr(config, 'STORE_BACKEND', 'redis')
+    with pytest.raises(ValueError):
+        create_store('meesman')
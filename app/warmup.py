@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import random
+import sqlite3
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app import config
+from app.database import Lease
+from app.funds import FundRegistry
+from app.models import Fund
+from app.routers import brandnewday, meesman, zwitserleven
+
+logger = logging.getLogger(__name__)
+
+# the registry and quote prefetch of every provider, Zwitserleven has its quotes in the fund list.
+providers: Dict[str, Tuple[FundRegistry, Optional[Callable[[Fund, float], Awaitable[None]]]]] = {
+    'brandnewday': (brandnewday.registry, brandnewday.prefetch),
+    'meesman': (meesman.registry, meesman.prefetch),
+    'zwitserleven': (zwitserleven.registry, None),
+}
+
+tasks: List[asyncio.Future] = []
+
+# seconds the lease on warming up the shared cache is held without being renewed, and between attempts to claim it.
+LEASE_DURATION = 60
+LEASE_INTERVAL = 1
+
+# worker processes sharing the SQLite cache warm up one at a time, the others then find the entries fresh. Each worker
+# process has its own memory cache, and warms it up itself.
+lease: Optional[Lease] = Lease(config.CACHE_PATH, 'warmup', LEASE_DURATION) if config.CACHE_BACKEND == 'sqlite' else None
+
+
+def parse_selection(value: str) -> Dict[str, Optional[Set[str]]]:
+    """
+    Parses the funds to warm up into the fund names per provider, None selects all funds of the provider.
+    """
+    selection: Dict[str, Optional[Set[str]]] = {}
+
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        provider, _, fund_name = item.partition('/')
+
+        for name in (list(providers) if provider == '*' else [provider]):
+            if name not in providers:
+                logger.warning('Unknown provider %s in warm up', name)
+            elif provider == '*' or fund_name in ('', '*'):
+                selection[name] = None
+            elif selection.setdefault(name, set()) is not None:
+                selection[name].add(fund_name)
+
+    return selection
+
+
+async def warm_up(selection: Dict[str, Optional[Set[str]]], ahead: float):
+    """
+    Refreshes the fund lists and the quotes of the selected funds that are missing or go stale within ahead seconds.
+    Failures are logged, they never stop the other funds.
+    """
+    semaphore = asyncio.Semaphore(config.WARMUP_CONCURRENCY)
+
+    async def prefetch(provider: str, fn: Callable[[Fund, float], Awaitable[None]], fund: Fund):
+        async with semaphore:
+            try:
+                await fn(fund, ahead)
+            except Exception as e:
+                logger.warning('Warming up %s/%s failed: %r', provider, fund.name, e)
+
+    calls = []
+
+    for provider, names in selection.items():
+        registry, fn = providers[provider]
+
+        try:
+            await registry.prefetch(ahead)
+            funds = await registry.funds()
+        except Exception as e:
+            logger.warning('Warming up %s failed: %r', provider, e)
+            continue
+
+        selected = list(funds) if names is None else []
+
+        for name in sorted(names or []):
+            fund = funds.find(name)
+
+            if fund is None:
+                logger.warning('Unknown fund %s/%s in warm up', provider, name)
+            else:
+                selected.append(fund)
+
+        if fn is not None:
+            calls += [prefetch(provider, fn, fund) for fund in selected]
+
+    await asyncio.gather(*calls)
+
+
+async def warm_up_shared(selection: Dict[str, Optional[Set[str]]], ahead: float):
+    """
+    Warms up once this worker process holds the lease, renewing it until done, so worker processes that start at the
+    same time do not all fetch the same funds.
+    """
+    if lease is None:
+        return await warm_up(selection, ahead)
+
+    while not claim():
+        await asyncio.sleep(LEASE_INTERVAL)
+
+    async def renew():
+        while True:
+            await asyncio.sleep(lease.duration / 3)
+            claim()
+
+    renewal = asyncio.ensure_future(renew())
+
+    try:
+        await warm_up(selection, ahead)
+    finally:
+        renewal.cancel()
+
+        try:
+            lease.release()
+        except sqlite3.Error as e:
+            # the lease expires by itself.
+            logger.warning('Releasing the warm up lease failed: %r', e)
+
+
+def claim() -> bool:
+    """
+    Claims or renews the lease, a database that is locked for too long is logged and tried again later.
+    """
+    try:
+        return lease.claim()
+    except sqlite3.Error as e:
+        logger.warning('Claiming the warm up lease failed: %r', e)
+        return False
+
+
+async def schedule(selection: Dict[str, Optional[Set[str]]], first: asyncio.Future):
+    ahead = config.WARMUP_INTERVAL + config.WARMUP_JITTER
+    # a failed warm up is logged, it never stops the next ones.
+    await asyncio.wait([first])
+
+    if not first.cancelled() and first.exception() is not None:
+        logger.warning('Warming up failed: %r', first.exception())
+
+    while True:
+        await asyncio.sleep(config.WARMUP_INTERVAL + random.uniform(0, config.WARMUP_JITTER))
+
+        try:
+            await warm_up_shared(selection, ahead)
+        except Exception as e:
+            logger.warning('Warming up failed: %r', e)
+
+
+async def start():
+    """
+    Warms up the configured funds, waiting at most WARMUP_TIMEOUT seconds, and keeps them fresh in the background.
+    """
+    selection = parse_selection(config.WARMUP_FUNDS)
+
+    if not selection:
+        return
+
+    first = asyncio.ensure_future(warm_up_shared(selection, config.WARMUP_INTERVAL + config.WARMUP_JITTER))
+    tasks.extend([first, asyncio.ensure_future(schedule(selection, first))])
+
+    await asyncio.wait([first], timeout=config.WARMUP_TIMEOUT)
+
+
+def stop():
+    for task in tasks:
+        task.cancel()
+
+    tasks.clear()
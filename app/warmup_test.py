@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+import httpx
+import pytest
+import respx
+
+from . import config, warmup
+from .database import Lease
+from .routers import brandnewday, meesman, zwitserleven
+from .warmup import parse_selection, warm_up
+
+MEESMAN_FUND = 'https://www.meesman.nl/onze-fondsen/aandelen-wereldwijd-totaal/'
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    for module in (brandnewday, meesman):
+        module.registry.clear()
+        module.quote_cache.clear()
+        module.store.clear()
+    zwitserleven.registry.clear()
+    zwitserleven.quote_cache.clear()
+    zwitserleven.store.clear()
+    yield
+
+
+def setup_meesman_response(quotes: httpx.Response = None):
+    funds = '<td class="fund-name"><a href="/onze-fondsen/aandelen-wereldwijd-totaal/">Totaal</a></td>' \
+            '<td class="fund-name"><a href="/onze-fondsen/aandelen-opkomende-landen/">Opkomend</a></td>'
+    respx.get(meesman.BASE_URL).mock(return_value=httpx.Response(200, text=funds))
+
+    body = "data: [{\"x\":\"2021-01-01T00:00:00\",\"y\":10}]"
+    return respx.get(MEESMAN_FUND).mock(return_value=quotes or httpx.Response(200, text=body))
+
+
+def setup_zwitserleven_response():
+    body = '''<tr class="showFonds" id="317">
+<td><a href="https://www.zwitserleven.nl/">Zwitserleven Variabele Rente</a></td>
+<td class="koers">21,36</td><td class="koers">24-03-2021</td>
+</tr>'''
+    return respx.get(zwitserleven.FUNDS_URL).mock(return_value=httpx.Response(200, text=body))
+
+
+@pytest.mark.parametrize('value, selection', [
+    ('', {}),
+    (' , ', {}),
+    ('*', {'brandnewday': None, 'meesman': None, 'zwitserleven': None}),
+    ('meesman', {'meesman': None}),
+    ('meesman/*', {'meesman': None}),
+    ('meesman/a, meesman/b,zwitserleven/c', {'meesman': {'a', 'b'}, 'zwitserleven': {'c'}}),
+    ('meesman/*,meesman/a', {'meesman': None}),
+    ('meesman/a,meesman/*', {'meesman': None}),
+])
+def test_parse_selection(value, selection):
+    assert parse_selection(value) == selection
+
+
+def test_parse_selection_ignores_unknown_provider(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert parse_selection('unknown/fund,meesman/a') == {'meesman': {'a'}}
+
+    assert 'Unknown provider unknown in warm up' in caplog.text
+
+
+@respx.mock
+def test_warm_up_fetches_selected_funds(run, caplog):
+    route = setup_meesman_response()
+
+    with caplog.at_level(logging.WARNING):
+        run(warm_up({'meesman': {'aandelen-wereldwijd-totaal', 'unknown'}}, 60))
+
+    assert route.call_count == 1
+    assert list(meesman.quote_cache) == ['aandelen-wereldwijd-totaal']
+    assert 'Unknown fund meesman/unknown in warm up' in caplog.text
+
+    # everything is fresh, nothing is fetched again.
+    run(warm_up({'meesman': {'aandelen-wereldwijd-totaal'}}, 60))
+
+    assert respx.calls.call_count == 2
+
+
+@respx.mock
+def test_warm_up_fetches_all_funds_with_bounded_concurrency(run, monkeypatch):
+    running = []
+    peak = []
+
+    async def prefetch(fund, ahead):
+        running.append(fund)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(fund)
+
+    setup_meesman_response()
+    setup_zwitserleven_response()
+    monkeypatch.setattr(config, 'WARMUP_CONCURRENCY', 1)
+    monkeypatch.setitem(warmup.providers, 'meesman', (meesman.registry, prefetch))
+
+    run(warm_up({'meesman': None, 'zwitserleven': None}, 60))
+
+    assert len(peak) == 2
+    assert max(peak) == 1
+    assert list(zwitserleven.quote_cache) == ['zwitserleven-variabele-rente']
+
+
+@respx.mock
+def test_warm_up_logs_failures_and_continues(run, caplog):
+    setup_meesman_response(httpx.Response(500, text='error'))
+    respx.get(brandnewday.BASE_URL.format('getfundsnew')).mock(return_value=httpx.Response(500, text='error'))
+    setup_zwitserleven_response()
+
+    with caplog.at_level(logging.WARNING):
+        run(warm_up({'brandnewday': None, 'meesman': {'aandelen-wereldwijd-totaal'}, 'zwitserleven': None}, 60))
+
+    assert 'Warming up brandnewday failed' in caplog.text
+    assert 'Warming up meesman/aandelen-wereldwijd-totaal failed' in caplog.text
+    assert list(zwitserleven.quote_cache) == ['zwitserleven-variabele-rente']
+
+
+@respx.mock
+def test_start_warms_up_and_keeps_refreshing(run, monkeypatch):
+    route = setup_zwitserleven_response()
+    monkeypatch.setattr(config, 'WARMUP_FUNDS', 'zwitserleven/*')
+    monkeypatch.setattr(config, 'WARMUP_INTERVAL', 0)
+    monkeypatch.setattr(config, 'WARMUP_JITTER', 0)
+    now = [1000.0]
+    monkeypatch.setattr(zwitserleven.registry.cache, 'timer', lambda: now[0])
+
+    async def main():
+        await warmup.start()
+        assert list(zwitserleven.quote_cache) == ['zwitserleven-variabele-rente']
+
+        # the scheduled warm ups refresh the funds once they go stale.
+        now[0] += zwitserleven.registry.cache.ttl
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        tasks = list(warmup.tasks)
+        warmup.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        return tasks
+
+    tasks = run(main())
+
+    assert route.call_count == 2
+    assert all(task.done() for task in tasks)
+    assert warmup.tasks == []
+
+
+@respx.mock
+def test_warm_up_shared_waits_for_lease(run, monkeypatch, tmp_path):
+    route = setup_zwitserleven_response()
+    response = route.return_value
+    lease = Lease(str(tmp_path / 'cache.sqlite3'), 'warmup', 0.03)
+    monkeypatch.setattr(warmup, 'lease', lease)
+    monkeypatch.setattr(warmup, 'LEASE_INTERVAL', 0)
+
+    async def slow(request):
+        # slow enough for the lease to be renewed while warming up.
+        await asyncio.sleep(0.05)
+        return response
+
+    route.side_effect = slow
+
+    def holders():
+        return lease.database.connection.execute('SELECT holder, expires > ? FROM leases', (time.time(),)).fetchall()
+
+    async def main():
+        # another worker process holds the lease.
+        lease.database.connection.execute('INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)',
+                                          ('warmup', -1, float('inf')))
+        task = asyncio.ensure_future(warmup.warm_up_shared({'zwitserleven': None}, 0))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert route.call_count == 0
+
+        lease.database.connection.execute('DELETE FROM leases')
+        await asyncio.sleep(0.04)
+        # the lease outlived its duration, it was renewed.
+        assert holders() == [(os.getpid(), 1)]
+        await task
+
+    run(main())
+
+    assert route.call_count == 1
+    assert holders() == []
+
+
+class LockedLease:
+    """
+    Lease in a database that stays locked for the first claims, and on every release.
+    """
+
+    def __init__(self, locked: int):
+        self.duration = 0.03
+        self.locked = locked
+        self.claims = 0
+
+    def claim(self) -> bool:
+        self.claims += 1
+        if self.claims <= self.locked:
+            raise sqlite3.OperationalError('database is locked')
+        return True
+
+    def release(self):
+        raise sqlite3.OperationalError('database is locked')
+
+
+@respx.mock
+def test_warm_up_shared_survives_locked_database(run, monkeypatch, caplog):
+    route = setup_zwitserleven_response()
+    response = route.return_value
+    lease = LockedLease(2)
+    monkeypatch.setattr(warmup, 'lease', lease)
+    monkeypatch.setattr(warmup, 'LEASE_INTERVAL', 0)
+
+    async def slow(request):
+        await asyncio.sleep(0.05)
+        return response
+
+    route.side_effect = slow
+
+    with caplog.at_level(logging.WARNING):
+        run(warmup.warm_up_shared({'zwitserleven': None}, 0))
+
+    # claimed at the third attempt, and renewed while warming up.
+    assert route.call_count == 1
+    assert lease.claims > 3
+    assert caplog.text.count('Claiming the warm up lease failed') == 2
+    assert 'Releasing the warm up lease failed' in caplog.text
+
+
+def test_renewal_survives_locked_database(run, monkeypatch, caplog):
+    lease = LockedLease(0)
+    monkeypatch.setattr(warmup, 'lease', lease)
+
+    async def warm_up(selection, ahead):
+        # the claims while renewing fail from now on.
+        lease.locked = 100
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(warmup, 'warm_up', warm_up)
+
+    with caplog.at_level(logging.WARNING):
+        run(warmup.warm_up_shared({}, 0))
+
+    assert caplog.text.count('Claiming the warm up lease failed') == lease.claims - 1 > 1
+
+
+def test_schedule_survives_failed_warm_ups(run, monkeypatch, caplog):
+    monkeypatch.setattr(config, 'WARMUP_FUNDS', 'zwitserleven/*')
+    monkeypatch.setattr(config, 'WARMUP_INTERVAL', 0)
+    monkeypatch.setattr(config, 'WARMUP_JITTER', 0)
+    calls = []
+
+    async def warm_up_shared(selection, ahead):
+        calls.append(ahead)
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(warmup, 'warm_up_shared', warm_up_shared)
+
+    async def main():
+        with caplog.at_level(logging.WARNING):
+            await warmup.start()
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+        tasks = list(warmup.tasks)
+        warmup.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    run(main())
+
+    assert len(calls) > 2
+    assert caplog.text.count('Warming up failed') == len(calls)
+
+
+def test_start_without_funds_does_nothing(run, monkeypatch):
+    monkeypatch.setattr(config, 'WARMUP_FUNDS', '')
+
+    run(warmup.start())
+
+    assert warmup.tasks == []
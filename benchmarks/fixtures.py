@@ -0,0 +1,108 @@
+"""
+Upstream pages replayed by the stand-in server. A page recorded in benchmarks/fixtures is used as is, otherwise a page
+is generated about the size of the real one. Record the real pages, for example to commit them as the baseline, with
+
+    python -m benchmarks.fixtures
+"""
+import json
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, List
+
+import httpx
+
+from app.routers import brandnewday, meesman, zwitserleven
+from benchmarks import funds_bench, meesman_bench
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+# the end of the generated history, so generated pages do not change from day to day.
+END_DATE = date(2025, 12, 31)
+EPOCH = date(1970, 1, 1)
+
+
+def create_brandnewday_funds() -> str:
+    funds = [{'Key': str(1000 + i), 'Value': 'BND Fonds {0}'.format(i)} for i in range(12)]
+    return json.dumps({'Message': json.dumps(funds)})
+
+
+def create_brandnewday_quotes() -> str:
+    # the quotes of a fund since brandnewday.START_DATE, every working day, latest first as Brand New Day pages them.
+    rows = []
+
+    for i in range((END_DATE - brandnewday.START_DATE).days + 1):
+        day = brandnewday.START_DATE + timedelta(days=i)
+
+        if day.weekday() < 5:
+            rate = round(10 + i / 1000, 6)
+            rows.append({'FundId': 1000, 'FundLabel': None, 'LastRate': rate, 'BidRate': rate, 'AskRate': rate,
+                         'RateDate': '/Date({0})/'.format((day - EPOCH).days * 86400000),
+                         'Yield': -0.2612228741355754, 'InsertedBy': None, 'Inserted': '/Date(-62135596800000)/',
+                         'UpdatedBy': None, 'Updated': '/Date(-62135596800000)/'})
+
+    return json.dumps(rows[::-1])
+
+
+PAGES = {
+    'meesman-funds.html': funds_bench.create_meesman_page,
+    'meesman-quotes.html': meesman_bench.create_page,
+    'brandnewday-funds.json': create_brandnewday_funds,
+    'brandnewday-quotes.json': create_brandnewday_quotes,
+    'zwitserleven-funds.html': funds_bench.create_zwitserleven_page,
+}
+
+
+def load(name: str) -> str:
+    path = FIXTURES / name
+    return path.read_text(encoding='utf-8') if path.exists() else PAGES[name]()
+
+
+def record_brandnewday_quotes(http: httpx.Client, fund_id: str) -> str:
+    rows: List[dict] = []
+    page = 1
+
+    while True:
+        r = http.post(brandnewday.BASE_URL.format('navvaluesforfund'), data={
+            'page': page, 'pageSize': brandnewday.PAGE_SIZE, 'fundId': fund_id,
+            'startDate': brandnewday.START_DATE.strftime('%d-%m-%Y'), 'endDate': date.today().strftime('%d-%m-%Y')})
+        r.raise_for_status()
+        rows += r.json()['Data']
+
+        if len(rows) >= r.json()['Total'] or not r.json()['Data']:
+            return json.dumps(rows)
+
+        page += 1
+
+
+def main():
+    FIXTURES.mkdir(exist_ok=True)
+
+    with httpx.Client(timeout=30) as http:
+        def get(url: str) -> Callable[[], str]:
+            def fetch() -> str:
+                r = http.get(url)
+                r.raise_for_status()
+                return r.text
+
+            return fetch
+
+        meesman_funds = get(meesman.BASE_URL)()
+        brandnewday_funds = get(brandnewday.BASE_URL.format('getfundsnew'))()
+        fund_id = json.loads(json.loads(brandnewday_funds)['Message'])[0]['Key']
+
+        recorders = {
+            'meesman-funds.html': lambda: meesman_funds,
+            'meesman-quotes.html': get(meesman.QUOTE_URL.format(meesman.parse_funds(meesman_funds)[0])),
+            'brandnewday-funds.json': lambda: brandnewday_funds,
+            'brandnewday-quotes.json': lambda: record_brandnewday_quotes(http, fund_id),
+            'zwitserleven-funds.html': get(zwitserleven.FUNDS_URL),
+        }
+
+        for name, record in recorders.items():
+            text = record()
+            (FIXTURES / name).write_text(text, encoding='utf-8')
+            print('{0}: {1:,} bytes'.format(name, len(text)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compares parsing the fund lists of Meesman and Zwitserleven into a whole BeautifulSoup tree with html.parser, with
+parse_only using html.parser and, when installed, lxml. Measures time and peak memory per page.
+
+    python -m benchmarks.funds_bench
+"""
+import timeit
+import tracemalloc
+from importlib.util import find_spec
+
+from bs4 import BeautifulSoup
+
+from app import soup
+from app.routers import meesman, zwitserleven
+
+# menus, articles and footers of a real page, around the table of funds.
+MARKUP = '<div class="block"><p>Lorem <a href="/ipsum/">ipsum</a> <span>dolor</span> sit amet.</p></div>\n' * 1000
+
+
+def create_meesman_page() -> str:
+    rows = ''.join('<tr><td class="fund-name"><a href="/onze-fondsen/fonds-{0}/">Fonds {0}</a></td>'
+                   '<td class="koers">{0},00</td></tr>\n'.format(i) for i in range(10))
+    return '<html><body>{0}<table>{1}</table>{0}</body></html>'.format(MARKUP, rows)
+
+
+def create_zwitserleven_page() -> str:
+    rows = ''.join('<tr class="showFonds" id="{0}"><td><a href="/fondsen/fonds-{0}/">Zwitserleven Fonds {0}</a></td>'
+                   '<td class="koers">{0},25</td><td class="koers">25-03-2021</td></tr>\n'.format(i) for i in range(40))
+    return '<html><body>{0}<table>{1}</table>{0}</body></html>'.format(MARKUP, rows)
+
+
+def parse_meesman_tree(text: str):
+    # the previous implementation of meesman.fetch_funds.
+    tree = BeautifulSoup(text, 'html.parser')
+    return [fund_name.find('a').get('href').split('/')[2] for fund_name in tree.find_all('td', {'class': 'fund-name'})]
+
+
+def parse_zwitserleven_tree(text: str):
+    # the previous implementation of zwitserleven.fetch_funds, without the conversion of the quotes.
+    tree = BeautifulSoup(text, 'html.parser')
+    return [fund.find('a').text.strip() for fund in tree.find_all('tr', {'class': 'showFonds'})]
+
+
+def measure(parse, text: str):
+    number = 20
+    duration = timeit.timeit(lambda: parse(text), number=number) / number
+
+    tracemalloc.start()
+    parse(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, peak
+
+
+def main():
+    pages = [
+        ('meesman', create_meesman_page(), parse_meesman_tree, meesman.parse_funds),
+        ('zwitserleven', create_zwitserleven_page(), parse_zwitserleven_tree, zwitserleven.parse_funds),
+    ]
+    parsers = ['html.parser'] + (['lxml'] if find_spec('lxml') else [])
+
+    for name, text, parse_tree, parse_funds in pages:
+        assert len(parse_tree(text)) == len(parse_funds(text))
+        print('{0}: {1:,} bytes'.format(name, len(text)))
+
+        duration, peak = measure(parse_tree, text)
+        print('  whole tree  html.parser {0:>8.2f} ms {1:>12,} bytes peak'.format(duration * 1000, peak))
+
+        for parser in parsers:
+            soup.PARSER = parser
+            only_duration, only_peak = measure(parse_funds, text)
+            print('  parse_only  {0:<11} {1:>8.2f} ms {2:>12,} bytes peak   {3:.1f}x faster, {4:.1f}x less memory'.format(
+                parser, only_duration * 1000, only_peak, duration / only_duration, peak / only_peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares parsing a Meesman fund page with a regular expression over the whole page and strptime, with parse_quotes.
+
+    python -m benchmarks.meesman_bench [page.html ...]
+
+Without arguments a generated page is used, about the size of a real fund page with a chart since 2006. Save a real
+fund page, for example with curl, to measure that page instead.
+"""
+import json
+import re
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from app.routers.meesman import parse_quotes
+from app.series import QuoteSeries
+
+QUOTES_REGEX = r'data:\s(\[{.*}+\])'
+SIZE = 5000  # about twenty years of daily quotes.
+
+
+def create_page() -> str:
+    start = datetime(2006, 1, 1)
+    data = json.dumps([{'x': (start + timedelta(days=i)).isoformat(), 'y': round(10 + i / 1000, 4)}
+                       for i in range(SIZE)], separators=(',', ':'))
+
+    # markup around the chart, the menu and fund tables of a real page are about as large.
+    markup = '<div class="row"><td class="fund-name"><a href="/onze-fondsen/fonds/">Fonds</a></td></div>\n' * 1500
+
+    # the data ends the line, otherwise the greedy regular expression matches past its end.
+    return '<html><head></head><body>{0}<script>\nvar chart = {{series: [{{name: "Koers", data: {1}\n}}]}};\n' \
+           '</script>{0}</body></html>'.format(markup, data)
+
+
+def parse_regex(text: str) -> QuoteSeries:
+    # the previous implementation of meesman.fetch_quotes.
+    return QuoteSeries.from_pairs((datetime.strptime(q['x'], '%Y-%m-%dT%H:%M:%S'), q['y'])
+                                  for result in re.findall(QUOTES_REGEX, str(text))
+                                  for q in json.loads(result))
+
+
+def main():
+    pages = {path: open(path, encoding='utf-8').read() for path in sys.argv[1:]} or {'generated': create_page()}
+
+    for name, text in pages.items():
+        assert parse_regex(text) == parse_quotes(text)
+
+        number = 20
+        time_regex = timeit.timeit(lambda: parse_regex(text), number=number) / number
+        time_parse = timeit.timeit(lambda: parse_quotes(text), number=number) / number
+
+        print('{0}: {1:,} bytes, {2} quotes'.format(name, len(text), len(parse_quotes(text))))
+        print('parse      regex {0:>10.2f} ms      parse_quotes {1:>10.2f} ms      {2:.1f}x'.format(
+            time_regex * 1000, time_parse * 1000, time_regex / time_parse))
+
+
+if __name__ == '__main__':
+    main()
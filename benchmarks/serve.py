@@ -0,0 +1,46 @@
+"""
+Runs the service against the stand-in of benchmarks.standin instead of the websites of the providers. POST
+/_bench/clear empties every cache and store, so the next request is served from a cold cache.
+
+    python -m benchmarks.serve [--port 8000] [--upstream http://127.0.0.1:8001]
+"""
+import argparse
+
+import uvicorn
+
+from app import pages, responses
+from app.main import app
+from app.routers import brandnewday, meesman, zwitserleven
+
+
+def redirect(upstream: str):
+    meesman.BASE_URL = upstream + '/onze-fondsen/'
+    meesman.QUOTE_URL = meesman.BASE_URL + '{0}/'
+    brandnewday.BASE_URL = upstream + '/service/{0}/'
+    zwitserleven.FUNDS_URL = upstream + '/webtools/fondskoersen_2011/fondskoersen.aspx'
+
+
+async def clear():
+    for provider in (meesman, brandnewday, zwitserleven):
+        provider.registry.clear()
+        provider.quote_cache.clear()
+        provider.store.clear()
+
+    pages.pages.clear()
+    responses.encoded.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the service against the stand-in of the providers.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--upstream', default='http://127.0.0.1:8001')
+    args = parser.parse_args()
+
+    redirect(args.upstream)
+    app.add_api_route('/_bench/clear', clear, methods=['POST'], include_in_schema=False)
+
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
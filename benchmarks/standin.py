@@ -0,0 +1,77 @@
+"""
+Stand-in for the websites of the providers, serving the pages of benchmarks.fixtures on the paths of the real websites
+after a fixed latency.
+
+    python -m benchmarks.standin [--port 8001] [--latency 0.05] [--no-etag]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from benchmarks.fixtures import EPOCH, load
+
+
+def create_app(latency: float, etag: bool = True) -> Starlette:
+    pages = {name: load(name).encode() for name in ('meesman-funds.html', 'meesman-quotes.html',
+                                                    'brandnewday-funds.json', 'zwitserleven-funds.html')}
+    rows = json.loads(load('brandnewday-quotes.json'))
+    # the day of every row, to select the rows from the start until the end date of a request.
+    days = [int(re.search(r'\d+', row['RateDate']).group()) // 86400000 for row in rows]
+
+    def page(name: str, media_type: str):
+        # like the real websites, pages are validated with their etag, which --no-etag leaves out.
+        headers = {'ETag': '"{0}"'.format(hashlib.md5(pages[name]).hexdigest())} if etag else {}
+
+        async def endpoint(request: Request) -> Response:
+            await asyncio.sleep(latency)
+
+            if etag and request.headers.get('If-None-Match') == headers['ETag']:
+                return Response(status_code=304, headers=headers)
+
+            return Response(pages[name], media_type=media_type, headers=headers)
+
+        return endpoint
+
+    async def navvaluesforfund(request: Request) -> Response:
+        await asyncio.sleep(latency)
+
+        form = {name: values[0] for name, values in parse_qs((await request.body()).decode()).items()}
+        start, end = ((datetime.strptime(form[name], '%d-%m-%Y').date() - EPOCH).days for name in ('startDate', 'endDate'))
+        selected = [row for row, day in zip(rows, days) if start <= day <= end]
+        size = int(form['pageSize'])
+        offset = (int(form['page']) - 1) * size
+
+        return Response(json.dumps({'Data': selected[offset:offset + size], 'Total': len(selected),
+                                    'AggregateResults': None, 'Errors': None}), media_type='application/json')
+
+    return Starlette(routes=[
+        Route('/onze-fondsen/', page('meesman-funds.html', 'text/html')),
+        Route('/onze-fondsen/{fund}/', page('meesman-quotes.html', 'text/html')),
+        Route('/service/getfundsnew/', page('brandnewday-funds.json', 'application/json')),
+        Route('/service/navvaluesforfund/', navvaluesforfund, methods=['POST']),
+        Route('/webtools/fondskoersen_2011/fondskoersen.aspx', page('zwitserleven-funds.html', 'text/html')),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in for the websites of the providers.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before every page is served')
+    parser.add_argument('--no-etag', action='store_true', help='serve pages without an etag, so they are fingerprinted')
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency, not args.no_etag), host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
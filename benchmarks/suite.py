@@ -0,0 +1,232 @@
+"""
+Measures the service end to end against the stand-in of the providers, and parsing and serialization in isolation.
+
+    python -m benchmarks.suite [--output results.json] [--compare baseline.json]
+
+Every endpoint is measured from a cold cache, from a warm cache and from a warm cache with concurrent clients. The
+service and the stand-in run in processes of their own, both with the QUOTES_* settings of the environment. The
+results are stored in benchmarks/results, compare them with those of an earlier run on the same machine; the exit
+status is 1 when a result is worse than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import httpx
+
+from app import pages, soup
+from app.routers import meesman, zwitserleven
+from app.series import QuoteSeries
+from benchmarks.fixtures import load
+
+RESULTS = Path(__file__).parent / 'results'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while process.poll() is None and time.monotonic() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+    raise RuntimeError('{0} did not start'.format(url))
+
+
+@contextmanager
+def run(module: str, port: int, *args: str) -> Iterator[str]:
+    url = 'http://127.0.0.1:{0}'.format(port)
+    # the first requests are measured from a cold cache, not after a warm up.
+    env = dict(os.environ, QUOTES_WARMUP_FUNDS='')
+    process = subprocess.Popen([sys.executable, '-m', module, '--port', str(port), *args], env=env)
+
+    try:
+        wait_until_ready(url, process)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(latencies: List[float], duration: float) -> Dict[str, float]:
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentiles[49] * 1000,
+        'p95_ms': percentiles[94] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+        'rps': len(latencies) / duration,
+    }
+
+
+async def measure(http: httpx.AsyncClient, path: str, requests: int, concurrency: int = 1,
+                  before: Callable = None) -> Dict[str, float]:
+    latencies: List[float] = []
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            if before is not None:
+                await before()
+
+            start = time.perf_counter()
+            r = await http.get(path)
+            latencies.append(time.perf_counter() - start)
+            r.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    # the duration of clearing the caches is not part of the throughput of cold requests.
+    duration = sum(latencies) if before is not None else time.perf_counter() - start
+
+    return summarize(latencies, duration)
+
+
+async def measure_endpoints(url: str, args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        async def clear():
+            (await http.post('/_bench/clear')).raise_for_status()
+
+        funds = {provider: (await http.get('/{0}/'.format(provider))).json()[0]
+                 for provider in ('meesman', 'brandnewday', 'zwitserleven')}
+        endpoints = {
+            'meesman.funds': '/meesman/',
+            'meesman.quotes': '/meesman/{0}'.format(funds['meesman']),
+            'brandnewday.history': '/brandnewday/{0}/history'.format(funds['brandnewday']),
+            'zwitserleven.quotes': '/zwitserleven/{0}'.format(funds['zwitserleven']),
+            'batch': '/batch/?' + '&'.join('fund={0}/{1}'.format(*fund) for fund in funds.items()),
+        }
+
+        results = {}
+
+        for name, path in endpoints.items():
+            results[name + '.cold'] = await measure(http, path, args.cold, before=clear)
+            results[name + '.warm'] = await measure(http, path, args.requests)
+            results[name + '.concurrent'] = await measure(http, path, args.requests, args.concurrency)
+
+        return results
+
+
+def measure_call(fn: Callable) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1000
+
+
+def measure_micro() -> Dict[str, Dict[str, float]]:
+    meesman_funds = load('meesman-funds.html')
+    meesman_quotes = load('meesman-quotes.html')
+    zwitserleven_funds = load('zwitserleven-funds.html')
+    series: QuoteSeries = meesman.parse_quotes(meesman_quotes)
+
+    calls = {
+        'meesman.parse_funds': lambda: meesman.parse_funds(meesman_funds),
+        'meesman.parse_quotes': lambda: meesman.parse_quotes(meesman_quotes),
+        'meesman.fingerprint': lambda: pages.fingerprint(meesman.extract_charts(meesman_quotes).encode()),
+        'zwitserleven.parse_funds': lambda: zwitserleven.parse_funds(zwitserleven_funds),
+        'series.json': series.to_json,
+        'series.csv': lambda: b''.join(series.iter_csv()),
+        'series.ndjson': lambda: b''.join(series.iter_ndjson()),
+    }
+
+    return {name: {'ms': measure_call(call)} for name, call in calls.items()}
+
+
+def flatten(results: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    return {'{0}.{1}'.format(name, metric): value for name, metrics in results.items() for metric, value in
+            metrics.items()}
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], threshold: float) -> bool:
+    """
+    Prints the change of every result compared with the baseline, returns whether none is worse than the threshold.
+    """
+    passed = True
+    print('{0:<45} {1:>12} {2:>12}'.format('', 'baseline', 'current'))
+
+    for name, value in current.items():
+        if not baseline.get(name):
+            continue
+
+        change = (value - baseline[name]) / baseline[name] * 100
+        # a higher throughput is better, for all other results lower is better.
+        worse = -change if name.endswith('.rps') else change
+        flag = 'WORSE' if worse > threshold else ''
+        passed = passed and not flag
+
+        print('{0:<45} {1:>12.2f} {2:>12.2f} {3:>+8.1f}%  {4}'.format(name, baseline[name], value, change, flag))
+
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the service end to end and parsing in isolation.')
+    parser.add_argument('--requests', type=int, default=200, help='requests per warm measurement')
+    parser.add_argument('--cold', type=int, default=10, help='requests per cold measurement')
+    parser.add_argument('--concurrency', type=int, default=10, help='clients of the concurrent measurements')
+    parser.add_argument('--latency', default='0.05', help='seconds the stand-in waits before serving a page')
+    parser.add_argument('--no-etag', action='store_true', help='the stand-in serves pages without an etag')
+    parser.add_argument('--micro', action='store_true', help='only measure parsing and serialization')
+    parser.add_argument('--output', type=Path, help='file to store the results in')
+    parser.add_argument('--compare', type=Path, help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=10, help='percentage a result may be worse')
+    args = parser.parse_args()
+
+    results = {'micro': flatten(measure_micro())}
+
+    if not args.micro:
+        upstream_port, port = free_port(), free_port()
+
+        standin = ['--latency', args.latency] + (['--no-etag'] if args.no_etag else [])
+
+        with run('benchmarks.standin', upstream_port, *standin) as upstream, \
+                run('benchmarks.serve', port, '--upstream', upstream) as url:
+            results['endpoints'] = flatten(asyncio.run(measure_endpoints(url, args)))
+
+    output = args.output or RESULTS / '{0:%Y%m%d-%H%M%S}.json'.format(datetime.now())
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parser': soup.PARSER,
+        'settings': {name: value for name, value in os.environ.items() if name.startswith('QUOTES_')},
+        'arguments': {name: str(value) for name, value in vars(args).items()},
+        'results': results,
+    }, indent=2))
+
+    for group in results.values():
+        for name, value in group.items():
+            print('{0:<45} {1:>12.2f}'.format(name, value))
+
+    print('stored in {0}'.format(output))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())['results']
+        passed = all([compare(results[group], baseline.get(group, {}), args.threshold) for group in results])
+        sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()